@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark for step 6 of map_it (linking calls to nodes).
+
+Builds synthetic models of 1k, 10k and 100k functions directly out of
+Groups / Nodes / Calls and times SymbolTable-based linking against the
+linear scan that map_it used to do.
+
+Run from the repository root:
+    python -m benchmarks.bench_linking
+    python -m benchmarks.bench_linking --sizes 1000 10000 --linear-max 10000
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from src.engine import SymbolTable, _find_links
+from src.model import GROUP_TYPE, Call, Group, Node
+
+FUNCTIONS_PER_FILE = 20
+CLASSES_PER_FILE = 2
+CALLS_PER_FUNCTION = 4
+
+
+def make_model(num_functions, seed=0):
+    """
+    Build a deterministic synthetic model with num_functions function nodes.
+    Roughly half of the function tokens are reused across files so that
+    ambiguous (bad) calls show up like they would in a real codebase.
+
+    :param int num_functions:
+    :param int seed:
+    :rtype: list[Node]
+    """
+    rand = random.Random(seed)
+    num_files = max(1, num_functions // FUNCTIONS_PER_FILE)
+    token_pool = ['func_%d' % i for i in range(num_functions // 2 or 1)]
+    class_pool = ['Class_%d' % i for i in range(num_files)]
+
+    nodes = []
+    for i in range(num_files):
+        file_group = Group('mod_%d' % i, GROUP_TYPE.FILE, 'File', ['mod_%d' % i], 0)
+        class_groups = []
+        for j in range(CLASSES_PER_FILE):
+            class_group = Group(rand.choice(class_pool), GROUP_TYPE.CLASS, 'Class',
+                                line_number=j, parent=file_group)
+            file_group.add_subgroup(class_group)
+            class_groups.append(class_group)
+
+        for j in range(FUNCTIONS_PER_FILE):
+            parent = file_group if j % 3 else class_groups[j % CLASSES_PER_FILE]
+            is_constructor = j % 3 == 0 and j < CLASSES_PER_FILE * 3
+            token = '__init__' if is_constructor else rand.choice(token_pool)
+            calls = []
+            for k in range(CALLS_PER_FUNCTION):
+                if k % 2:
+                    calls.append(Call(rand.choice(token_pool), line_number=j,
+                                      owner_token='obj'))
+                elif k % 4 == 2:
+                    calls.append(Call(rand.choice(class_pool), line_number=j))
+                else:
+                    calls.append(Call(rand.choice(token_pool), line_number=j))
+            node = Node(token, token + '()', calls, [], parent, line_number=j,
+                        is_constructor=is_constructor)
+            parent.add_node(node)
+            nodes.append(node)
+    return nodes
+
+
+def _linear_scan_possible_nodes(call, node_a, all_nodes):
+    """
+    The pre-SymbolTable resolution. Kept here only as a baseline.
+    """
+    possible_nodes = []
+    if call.is_attr():
+        for node in all_nodes:
+            if call.token == node.token and node.parent != node_a.file_group():
+                possible_nodes.append(node)
+    else:
+        for node in all_nodes:
+            if call.token == node.token \
+               and isinstance(node.parent, Group) \
+               and node.parent.group_type == GROUP_TYPE.FILE:
+                possible_nodes.append(node)
+            elif call.token == node.parent.token and node.is_constructor:
+                possible_nodes.append(node)
+    return possible_nodes
+
+
+def link_linear(nodes):
+    """
+    :param list[Node] nodes:
+    :rtype: (int, int)
+    """
+    num_edges = num_bad = 0
+    for node_a in nodes:
+        for call in node_a.calls:
+            possible_nodes = _linear_scan_possible_nodes(call, node_a, nodes)
+            if len(possible_nodes) == 1:
+                num_edges += 1
+            elif possible_nodes:
+                num_bad += 1
+    return num_edges, num_bad
+
+
+def link_indexed(nodes):
+    """
+    :param list[Node] nodes:
+    :rtype: (int, int)
+    """
+    num_edges = num_bad = 0
+    symbol_table = SymbolTable(nodes)
+    for node_a in nodes:
+        for node_b, bad_call in _find_links(node_a, symbol_table):
+            if bad_call:
+                num_bad += 1
+            if node_b:
+                num_edges += 1
+    return num_edges, num_bad
+
+
+def main(sys_argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                        help='number of synthetic functions per run')
+    parser.add_argument('--linear-max', type=int, default=10000,
+                        help='skip the linear-scan baseline above this many functions')
+    args = parser.parse_args(sys_argv)
+
+    print("%10s %12s %12s %10s" % ('functions', 'linear (s)', 'indexed (s)', 'speedup'))
+    for size in args.sizes:
+        nodes = make_model(size)
+
+        start = time.perf_counter()
+        indexed_result = link_indexed(nodes)
+        indexed_time = time.perf_counter() - start
+
+        if size <= args.linear_max:
+            start = time.perf_counter()
+            linear_result = link_linear(nodes)
+            linear_time = time.perf_counter() - start
+            assert linear_result == indexed_result, (linear_result, indexed_result)
+            print("%10d %12.3f %12.3f %9.1fx" % (size, linear_time, indexed_time,
+                                                 linear_time / indexed_time))
+        else:
+            print("%10d %12s %12.3f %10s" % (size, 'skipped', indexed_time, '-'))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for map_it.
+
+Writes a synthetic Python corpus to a temporary directory and reports the
+tracemalloc peak while map_it runs along with what the finished model
+retains, per node. Every class inherits from a base class in another file so
+step 4 (inheritance) has real work to do.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --files 50 100 200 400
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from src.engine import LanguageParams, map_it
+
+CLASSES_PER_FILE = 3
+METHODS_PER_CLASS = 8
+FUNCTIONS_PER_FILE = 6
+
+
+def write_corpus(directory, num_files, seed=0):
+    """
+    Write num_files python files into directory.
+
+    :param str directory:
+    :param int num_files:
+    :param int seed:
+    :rtype: list[str]
+    """
+    rand = random.Random(seed)
+    sources = []
+    for i in range(num_files):
+        base_file = rand.randrange(num_files)
+        lines = ['from mod_%d import Base_%d' % (base_file, base_file), '', '']
+        lines += ['class Base_%d():' % i,
+                  '    def base_method_%d(self, a):' % i,
+                  '        return helper_%d_0(a)' % i,
+                  '', '']
+        for c in range(CLASSES_PER_FILE):
+            lines.append('class Class_%d_%d(Base_%d):' % (i, c, base_file))
+            for m in range(METHODS_PER_CLASS):
+                lines += ['    def method_%d_%d_%d(self, a, b):' % (i, c, m),
+                          '        obj = Base_%d()' % base_file,
+                          '        value = obj.base_method_%d(a)' % base_file,
+                          '        self.method_%d_%d_%d(value, b)' % (
+                              i, c, rand.randrange(METHODS_PER_CLASS)),
+                          '        return helper_%d_%d(value)' % (
+                              i, rand.randrange(FUNCTIONS_PER_FILE)),
+                          '']
+            lines.append('')
+        for f in range(FUNCTIONS_PER_FILE):
+            c = rand.randrange(CLASSES_PER_FILE)
+            lines += ['def helper_%d_%d(x):' % (i, f),
+                      '    y = Class_%d_%d()' % (i, c),
+                      '    return y.method_%d_%d_%d(x, x)' % (
+                          i, c, rand.randrange(METHODS_PER_CLASS)),
+                      '', '']
+        lines.append('helper_%d_0(1)' % i)
+        path = os.path.join(directory, 'mod_%d.py' % i)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        sources.append(path)
+    return sources
+
+
+def measure(sources):
+    """
+    :param list[str] sources:
+    :rtype: (int, int, float, int, int)
+    :returns: nodes, edges, seconds, peak bytes, retained bytes
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = map_it(sources, 'py', False, [], [], [], [], False, LanguageParams())
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _, all_nodes, edges = result
+    return len(all_nodes), len(edges), seconds, peak, retained
+
+
+def main(sys_argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--files', nargs='+', type=int, default=[50, 100, 200],
+                        help='number of synthetic files per run')
+    args = parser.parse_args(sys_argv)
+    logging.disable(logging.WARNING)
+
+    print("%8s %8s %8s %10s %10s %12s %12s" % (
+        'files', 'nodes', 'edges', 'time (s)', 'peak (MB)', 'peak B/node', 'kept B/node'))
+    for num_files in args.files:
+        with tempfile.TemporaryDirectory() as directory:
+            sources = write_corpus(directory, num_files)
+            nodes, edges, seconds, peak, retained = measure(sources)
+        print("%8d %8d %8d %10.2f %10.1f %12d %12d" % (
+            num_files, nodes, edges, seconds, peak / 1e6, peak // nodes, retained // nodes))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Per-file throughput of the Python frontend.
+
+Parses every file of a corpus once and then times make_file_group on the tree,
+which is everything the Python frontend does for that file: separating
+namespaces and building the nodes with their calls and variables. Each file is
+run --repeat times and the best time is kept.
+
+With --baseline, src/python.py is also loaded from that git revision and timed
+on the same trees so that the two can be compared file by file. A file that one
+of the versions can't handle is reported with its error and left out of the
+comparison. The nodes and calls each version found are counted too, since a
+version that finds less is not faster for the same work.
+
+Every corpus is one JSON object per line. A summary goes to stderr.
+
+Run from the repository root:
+    python -m benchmarks.bench_python_frontend
+    python -m benchmarks.bench_python_frontend --baseline HEAD~1 --repeat 20
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+
+from src import engine
+from src.engine import VERSION
+from src.python import Python
+from benchmarks.bench_stages import _source_files
+
+DEFAULT_CORPORA = ('tests/test_code/py/pytz',)
+
+
+def load_baseline(revision):
+    """
+    Load src/python.py as it was at revision. It is imported as part of the
+    src package so that it uses the current model.
+
+    :param str revision:
+    :rtype: type
+    """
+    source = subprocess.run(['git', 'show', '%s:src/python.py' % revision],
+                            capture_output=True, text=True, check=True).stdout
+    name = 'src._python_%s' % ''.join(c if c.isalnum() else '_' for c in revision)
+    spec = importlib.util.spec_from_loader(name, loader=None)
+    module = importlib.util.module_from_spec(spec)
+    module.__package__ = 'src'
+    exec(compile(source, '%s:src/python.py' % revision, 'exec'), module.__dict__)
+    return module.Python
+
+
+def time_file(language, tree, filename, repeat):
+    """
+    Best time of make_file_group over repeat runs along with the number of
+    nodes and calls it made
+
+    :param type language:
+    :param ast tree:
+    :param str filename:
+    :param int repeat:
+    :rtype: (float, int, int)
+    """
+    previous = engine.LANGUAGES['py']
+    engine.LANGUAGES['py'] = language
+    try:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            # the frontend prints debugging output
+            with contextlib.redirect_stdout(io.StringIO()):
+                file_group = engine.make_file_group(tree, filename, 'py')
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        nodes = file_group.all_nodes()
+        return best, len(nodes), sum(len(getattr(n, 'calls', ())) for n in nodes)
+    finally:
+        engine.LANGUAGES['py'] = previous
+
+
+def measure(sources, repeat, baseline=None):
+    """
+    :param list[str] sources:
+    :param int repeat:
+    :param type|None baseline: a Python language class from another revision
+    :rtype: dict
+    """
+    versions = {'current': Python}
+    if baseline:
+        versions['baseline'] = baseline
+
+    files = []
+    for filename in sources:
+        record = {'file': filename}
+        start = time.perf_counter()
+        tree = Python.get_tree(filename, None)
+        record['parse_seconds'] = time.perf_counter() - start
+        for version, language in versions.items():
+            try:
+                record[version + '_seconds'], record[version + '_nodes'], \
+                    record[version + '_calls'] = time_file(language, tree, filename, repeat)
+            except Exception as ex:
+                record[version + '_error'] = '%s: %s' % (type(ex).__name__, ex)
+        files.append(record)
+
+    totals = {}
+    compared = [f for f in files if all(v + '_seconds' in f for v in versions)]
+    for version in versions:
+        seconds = sum(f[version + '_seconds'] for f in compared)
+        calls = sum(f[version + '_calls'] for f in compared)
+        totals[version] = {
+            'seconds': seconds,
+            'files_per_second': len(compared) / seconds if seconds else None,
+            'nodes': sum(f[version + '_nodes'] for f in compared),
+            'calls': calls,
+            'us_per_call': seconds / calls * 1e6 if calls else None,
+            'errors': sum(1 for f in files if version + '_error' in f),
+        }
+    return {'sources': len(sources), 'compared': len(compared),
+            'totals': totals, 'files': files}
+
+
+def _print_summary(record, outfile):
+    totals = ' '.join('%s=%.1f files/s (%.4fs, %d nodes, %d calls, %.1fus/call, %d errors)' % (
+        version, t['files_per_second'] or 0, t['seconds'], t['nodes'], t['calls'],
+        t['us_per_call'] or 0, t['errors'])
+        for version, t in record['totals'].items())
+    print("%-30s compared=%d/%d %s" % (record['corpus'], record['compared'],
+                                       record['sources'], totals), file=outfile)
+
+
+def main(sys_argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('corpora', nargs='*', default=list(DEFAULT_CORPORA),
+                        help='directories of python files. Defaults to the pytz corpus')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per file')
+    parser.add_argument('--baseline', help='git revision of src/python.py to compare against')
+    parser.add_argument('--output', help='append the results to this file instead of stdout')
+    args = parser.parse_args(sys_argv)
+    logging.disable(logging.WARNING)
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+
+    outfile = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for directory in args.corpora:
+            record = {
+                'corpus': directory,
+                'pasta_version': VERSION,
+                'python_version': platform.python_version(),
+                'baseline': args.baseline,
+                'repeat': args.repeat,
+            }
+            record.update(measure(_source_files(directory, 'py'), args.repeat, baseline))
+            outfile.write(json.dumps(record) + '\n')
+            outfile.flush()
+            _print_summary(record, sys.stderr)
+    finally:
+        if args.output:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Stage-by-stage benchmark for the whole pipeline.
+
+Generates a deterministic synthetic Python corpus for every size asked for
+and times each step of map_it, write_file and _generate_graphviz separately,
+then does one more run under tracemalloc for the peak memory. The real-world
+corpora in tests/test_code (pytz, moment, money) are measured the same way.
+A corpus that can't be analyzed here (say, node isn't installed for moment)
+is reported with its error instead of timings.
+
+Every run is one JSON object per line so that results from different versions
+can be compared with any tool. A summary table goes to stderr.
+
+Run from the repository root:
+    python -m benchmarks.bench_stages
+    python -m benchmarks.bench_stages --files 20 200 --nesting 3 --output results.ndjson
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from src.engine import VERSION, LanguageParams, _generate_graphviz, map_it, write_file
+from src.metrics import PipelineMetrics
+
+REAL_CORPORA = (
+    ('pytz', 'py', 'tests/test_code/py/pytz'),
+    ('moment', 'js', 'tests/test_code/js/moment'),
+    ('money', 'php', 'tests/test_code/php/money'),
+)
+
+
+class CorpusParams():
+    """
+    Knobs for the synthetic corpus
+    """
+    def __init__(self, files=50, functions=10, classes=3, inheritance_depth=2,
+                 calls=4, nesting=1, seed=0):
+        """
+        :param int files:
+        :param int functions: per file. Half are module functions and half are
+            spread across the classes as methods
+        :param int classes: per file
+        :param int inheritance_depth: length of each class's chain of base
+            classes, which live in other files
+        :param int calls: per function
+        :param int nesting: depth of nested if / try blocks in each function
+        :param int seed:
+        """
+        self.files = files
+        self.functions = functions
+        self.classes = classes
+        self.inheritance_depth = inheritance_depth
+        self.calls = calls
+        self.nesting = nesting
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def _function_body(rand, params, file_num, indent, depth=0):
+    """
+    Calls to random functions of this file and methods of its first class,
+    wrapped in `nesting` levels of alternating if / try blocks.
+
+    :rtype: list[str]
+    """
+    pad = ' ' * indent
+    lines = []
+    for _ in range(params.calls):
+        if rand.random() < 0.5 or not params.classes:
+            lines.append(pad + 'helper_%d_%d(a)' % (file_num, rand.randrange(params.functions)))
+        else:
+            lines.append(pad + 'obj_%d.method_%d_%d_%d(a)' % (
+                depth, file_num, 0, rand.randrange(max(1, params.functions // 2))))
+    if depth < params.nesting:
+        if depth % 2 == 0:
+            lines.append(pad + 'if a > %d:' % depth)
+            lines += _function_body(rand, params, file_num, indent + 4, depth + 1)
+            lines.append(pad + 'else:')
+            lines.append(pad + '    a = helper_%d_0(a)' % file_num)
+        else:
+            lines.append(pad + 'try:')
+            lines += _function_body(rand, params, file_num, indent + 4, depth + 1)
+            lines.append(pad + 'except ValueError:')
+            lines.append(pad + '    a = helper_%d_0(a)' % file_num)
+    lines.append(pad + 'return a')
+    return lines
+
+
+def write_corpus(directory, params):
+    """
+    Write params.files python files into directory. The same params always
+    write the same files.
+
+    :param str directory:
+    :param CorpusParams params:
+    :rtype: list[str]
+    """
+    rand = random.Random(params.seed)
+    num_methods = params.functions // 2 if params.classes else 0
+    num_helpers = max(1, params.functions - num_methods)
+    params = CorpusParams(**dict(params.to_dict(), functions=num_helpers))
+
+    sources = []
+    for i in range(params.files):
+        lines = []
+        # Base class chain: Class_i_0 inherits from a class in the file
+        # before it, and so on, inheritance_depth files back
+        base_files = [(i - d) % params.files for d in range(1, params.inheritance_depth + 1)]
+        if params.classes:
+            for base_file in sorted(set(base_files) - {i}):
+                lines.append('from mod_%d import Class_%d_0' % (base_file, base_file))
+        lines += ['', '']
+
+        for c in range(params.classes):
+            if c == 0 and base_files and base_files[0] != i:
+                lines.append('class Class_%d_0(Class_%d_0):' % (i, base_files[0]))
+            else:
+                lines.append('class Class_%d_%d():' % (i, c))
+            lines.append('    def __init__(self):')
+            lines.append('        self.value = %d' % c)
+            lines.append('')
+            for m in range(num_methods):
+                lines.append('    def method_%d_%d_%d(self, a):' % (i, c, m))
+                lines += ['        obj_%d = Class_%d_0()' % (d, i) for d in range(params.nesting + 1)]
+                lines += _function_body(rand, params, i, 8)
+                lines.append('')
+            lines.append('')
+
+        for f in range(num_helpers):
+            lines.append('def helper_%d_%d(a):' % (i, f))
+            if params.classes:
+                lines += ['    obj_%d = Class_%d_0()' % (d, i) for d in range(params.nesting + 1)]
+            lines += _function_body(rand, params, i, 4)
+            lines += ['', '']
+        lines.append('helper_%d_0(1)' % i)
+
+        path = os.path.join(directory, 'mod_%d.py' % i)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        sources.append(path)
+    return sources
+
+
+def _source_files(directory, extension):
+    """
+    :param str directory:
+    :param str extension:
+    :rtype: list[str]
+    """
+    sources = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith('.' + extension):
+                sources.append(os.path.join(root, filename))
+    return sorted(sources)
+
+
+def measure(sources, extension, graphviz=True):
+    """
+    Time each stage of one full run and measure the peak memory of another.
+
+    :param list[str] sources:
+    :param str extension:
+    :param bool graphviz: also time _generate_graphviz when dot is installed
+    :rtype: dict
+    """
+    metrics = PipelineMetrics()
+    start = time.perf_counter()
+    # map_it prints debugging output
+    with contextlib.redirect_stdout(io.StringIO()):
+        file_groups, all_nodes, edges = map_it(sources, extension, False, [], [], [], [], False,
+                                               LanguageParams(), metrics=metrics)
+    seconds = dict(metrics.wall_seconds)
+    seconds['map_it'] = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'out.gv')
+        start = time.perf_counter()
+        with open(output_file, 'w') as f:
+            write_file(f, all_nodes, edges, file_groups)
+        seconds['write_file'] = time.perf_counter() - start
+
+        if graphviz and shutil.which('dot'):
+            start = time.perf_counter()
+            _generate_graphviz(output_file, 'svg', os.path.join(directory, 'out.svg'))
+            seconds['graphviz'] = time.perf_counter() - start
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        map_it(sources, extension, False, [], [], [], [], False, LanguageParams())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'sources': len(sources),
+        'nodes': len(all_nodes),
+        'edges': len(edges),
+        'counts': metrics.counts,
+        'edges_by_kind': metrics.edges_by_kind,
+        'seconds': seconds,
+        'peak_bytes': peak,
+    }
+
+
+def _run(name, sources, extension, graphviz, extra=None):
+    record = {
+        'corpus': name,
+        'language': extension,
+        'pasta_version': VERSION,
+        'python_version': platform.python_version(),
+    }
+    record.update(extra or {})
+    try:
+        record.update(measure(sources, extension, graphviz))
+    except Exception as ex:
+        record['error'] = '%s: %s' % (type(ex).__name__, ex)
+    return record
+
+
+def _print_summary(record, outfile):
+    if 'error' in record:
+        print("%-20s %s" % (record['corpus'], record['error'].split('\n')[0][:100]), file=outfile)
+        return
+    seconds = record['seconds']
+    stages = ' '.join('%s=%.3f' % (stage, t) for stage, t in seconds.items())
+    print("%-20s nodes=%d edges=%d peak=%.1fMB %s" % (
+        record['corpus'], record['nodes'], record['edges'], record['peak_bytes'] / 1e6, stages),
+        file=outfile)
+
+
+def main(sys_argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--files', nargs='+', type=int, default=[20, 100],
+                        help='number of synthetic files per run')
+    parser.add_argument('--functions', type=int, default=10, help='functions per file')
+    parser.add_argument('--classes', type=int, default=3, help='classes per file')
+    parser.add_argument('--inheritance-depth', type=int, default=2,
+                        help='length of the chain of base classes')
+    parser.add_argument('--calls', type=int, default=4, help='calls per function')
+    parser.add_argument('--nesting', type=int, default=1,
+                        help='depth of nested if / try blocks per function')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-real', action='store_true',
+                        help='skip the tests/test_code corpora')
+    parser.add_argument('--no-graphviz', action='store_true',
+                        help="don't time graphviz even if it is installed")
+    parser.add_argument('--output', help='append the results to this file instead of stdout')
+    args = parser.parse_args(sys_argv)
+    logging.disable(logging.WARNING)
+
+    runs = []
+    for num_files in args.files:
+        runs.append(CorpusParams(num_files, args.functions, args.classes,
+                                 args.inheritance_depth, args.calls, args.nesting, args.seed))
+
+    outfile = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for params in runs:
+            with tempfile.TemporaryDirectory() as directory:
+                sources = write_corpus(directory, params)
+                record = _run('synthetic-%d' % params.files, sources, 'py',
+                              not args.no_graphviz, {'params': params.to_dict()})
+            outfile.write(json.dumps(record) + '\n')
+            outfile.flush()
+            _print_summary(record, sys.stderr)
+
+        if not args.no_real:
+            for name, extension, directory in REAL_CORPORA:
+                record = _run(name, _source_files(directory, extension), extension,
+                              not args.no_graphviz)
+                outfile.write(json.dumps(record) + '\n')
+                outfile.flush()
+                _print_summary(record, sys.stderr)
+    finally:
+        if args.output:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    main()
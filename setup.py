@@ -20,7 +20,7 @@ setup(
     url=url_base,
     download_url=download_url,
     packages=['pasta'],
-    python_requires='>=3.6',
+    python_requires='>=3.9',
     include_package_data=True,
     classifiers=[
         'Natural Language :: English',
@@ -0,0 +1,184 @@
+"""
+On-disk cache of per-file analysis summaries (see summary.py).
+
+Entries are keyed by the file's path and content hash along with everything
+else that can change the analysis: the language, the LanguageParams, the
+pasta version, the summary format and a hash of the source of the modules that
+do the analysis. An unchanged file therefore maps to an existing entry and
+skips parsing entirely, while editing a frontend invalidates its entries even
+if nobody remembered to bump SUMMARY_VERSION.
+
+The cache is bounded in size. When it grows past max_bytes, the least
+recently used entries are removed.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from .summary import SUMMARY_VERSION
+
+CACHE_FORMAT_VERSION = 2
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+ENTRY_SUFFIX = '.pasta-cache'
+
+# Everything that runs between reading a source file and its summary
+ANALYSIS_SOURCES = ('engine.py', 'model.py', 'summary.py',
+                    'python.py', 'javascript.py', 'php.py', 'ruby.py',
+                    'get_ast.js', 'get_ast.php', 'get_ast.rb')
+
+
+@functools.lru_cache(maxsize=None)
+def analysis_code_hash():
+    """
+    Hash of the modules and parser helpers that produce a summary
+
+    :rtype: str
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    code_hash = hashlib.sha256()
+    for name in ANALYSIS_SOURCES:
+        code_hash.update(name.encode() + b'\0')
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                code_hash.update(f.read())
+        except OSError:
+            pass
+        code_hash.update(b'\0')
+    return code_hash.hexdigest()
+
+
+class AnalysisCache():
+    """
+    Directory of pickled file summaries.
+    """
+    def __init__(self, directory, pasta_version, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param str directory:
+        :param str pasta_version:
+        :param int max_bytes:
+        """
+        self.directory = directory
+        self.pasta_version = pasta_version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, extension, lang_params):
+        """
+        :param str source:
+        :param str extension:
+        :param LanguageParams lang_params:
+        :rtype: str
+        """
+        with open(source, 'rb') as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        parts = [
+            'format=%d' % CACHE_FORMAT_VERSION,
+            'summary=%d' % SUMMARY_VERSION,
+            'code=%s' % analysis_code_hash(),
+            'pasta=%s' % self.pasta_version,
+            'language=%s' % extension,
+            'params=%r' % sorted(vars(lang_params).items()),
+            'path=%s' % os.path.abspath(source),
+            'content=%s' % content_hash,
+        ]
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        Return the cached summary or None if there isn't a usable one.
+
+        :param str key:
+        :rtype: tuple|None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                format_version, summary = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as ex:
+            logging.warning("Discarding unreadable cache entry %r. (%r)", path, ex)
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        if format_version != CACHE_FORMAT_VERSION or summary[0] != SUMMARY_VERSION:
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # Bump the mtime so that eviction is least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return summary
+
+    def put(self, key, summary):
+        """
+        :param str key:
+        :param tuple summary:
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so that concurrent runs never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((CACHE_FORMAT_VERSION, summary), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+
+        :rtype: int
+        :returns: number of entries removed
+        """
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for f in files:
+                if not f.endswith(ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(root, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        if removed:
+            logging.info("Evicted %d entries from the analysis cache.", removed)
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,5 +1,11 @@
 import argparse
+import asyncio
 import collections
+import concurrent.futures
+import functools
+import gzip
+import hashlib
+import io
 import json
 import logging
 import os
@@ -10,17 +16,29 @@ from .python import Python
 from .javascript import Javascript
 from .ruby import Ruby
 from .php import PHP
-from .model import (TRUNK_COLOR, LEAF_COLOR, NODE_COLOR, GROUP_TYPE, OWNER_CONST,
-                    Edge, Group, Node, IfNode, TryNode, Variable, is_installed, flatten)
+from .cache import AnalysisCache, DEFAULT_MAX_BYTES
+from .summary import (summarize_file_group, assemble_file_group, assemble_objects,
+                      restore_links, defined_tokens, referenced_tokens)
+from .graph import ALL_DEPTHS, CallGraph
+from .parser_pool import AsyncParserPool
+from .metrics import PipelineMetrics
+from .profiling import DEFAULT_OUTPUT, DEFAULT_TOP, PROFILE_MODES, run_profiled
+from .watch import make_watcher
+from .model import (TRUNK_COLOR, LEAF_COLOR, NODE_COLOR, GROUP_TYPE, OWNER_CONST, EDGE_KIND,
+                    Edge, Group, Node, IfNode, TryNode, Variable, is_installed, flatten,
+                    make_import_index, make_group_index, assign_stable_uids, make_stable_uid,
+                    remap_uids)
 
 VERSION = '2.5.0'
 
 IMAGE_EXTENSIONS = ('png', 'svg')
-TEXT_EXTENSIONS = ('dot', 'gv', 'json')
+TEXT_EXTENSIONS = ('dot', 'gv', 'json', 'ndjson', 'gv.gz')
+GZIP_EXTENSIONS = ('gv.gz',)
 VALID_EXTENSIONS = IMAGE_EXTENSIONS + TEXT_EXTENSIONS
 
 DESCRIPTION = "Generate flow charts from your source code. " \
-              "See the README at https://github.com/gitmyrepos/pasta."
+              "See the README at https://github.com/gitmyrepos/pasta. " \
+              "Run `pasta serve --help` to keep a model loaded and query it."
 
 LEGEND = """subgraph legend{
     rank = min;
@@ -56,17 +74,17 @@ class SubsetParams():
     """
     Shallow structure to make storing subset-specific parameters cleaner.
     """
-    def __init__(self, target_function, upstream_depth, downstream_depth):
-        self.target_function = target_function
+    def __init__(self, target_functions, upstream_depth, downstream_depth):
+        self.target_functions = target_functions
         self.upstream_depth = upstream_depth
         self.downstream_depth = downstream_depth
 
     @staticmethod
     def generate(target_function, upstream_depth, downstream_depth):
         """
-        :param target_function str:
-        :param upstream_depth int:
-        :param downstream_depth int:
+        :param target_function str|list[str]: one or more functions
+        :param upstream_depth int: ALL_DEPTHS for no limit
+        :param downstream_depth int: ALL_DEPTHS for no limit
         :rtype: SubsetParams|Nonetype
         """
         if upstream_depth and not target_function:
@@ -82,83 +100,34 @@ class SubsetParams():
             raise AssertionError("--target-function requires --upstream-depth or --downstream-depth")
 
         if upstream_depth < 0:
-            raise AssertionError("--upstream-depth must be >= 0. Exclude argument for complete depth.")
+            raise AssertionError("--upstream-depth must be >= 0. Use 'all' for complete depth.")
 
         if downstream_depth < 0:
-            raise AssertionError("--downstream-depth must be >= 0. Exclude argument for complete depth.")
+            raise AssertionError("--downstream-depth must be >= 0. Use 'all' for complete depth.")
 
-        return SubsetParams(target_function, upstream_depth, downstream_depth)
+        if isinstance(target_function, str):
+            target_function = [target_function]
+        return SubsetParams(list(target_function), upstream_depth, downstream_depth)
 
-def _find_target_node(subset_params, all_nodes):
+def _depth(value):
     """
-    Find the node referenced by subset_params.target_function
-    :param subset_params SubsetParams:
-    :param all_nodes list[Node]:
-    :rtype: Node
+    argparse type for --upstream-depth / --downstream-depth
+    :param str value: a number or 'all'
+    :rtype: int|float
     """
-    target_nodes = []
-    for node in all_nodes:
-        if node.token == subset_params.target_function or \
-           node.token_with_ownership() == subset_params.target_function or \
-           node.name() == subset_params.target_function:
-            target_nodes.append(node)
-    if not target_nodes:
-        raise AssertionError("Could not find node %r to build a subset." % subset_params.target_function)
-    if len(target_nodes) > 1:
-        raise AssertionError("Found multiple nodes for %r: %r. Try either a `class.func` or "
-                             "`filename::class.func`." % (subset_params.target_function, target_nodes))
-    return target_nodes[0]
-
-def _filter_nodes_for_subset(subset_params, all_nodes, edges):
-    """
-    Given subset_params, return a set of all nodes upstream and downstream of the target node.
-    :param subset_params SubsetParams:
-    :param all_nodes list[Node]:
-    :param edges list[Edge]:
-    :rtype: set[Node]
-    """
-    target_node = _find_target_node(subset_params, all_nodes)
-    downstream_dict = collections.defaultdict(set)
-    upstream_dict = collections.defaultdict(set)
-    for edge in edges:
-        upstream_dict[edge.node1].add(edge.node0)
-        downstream_dict[edge.node0].add(edge.node1)
-
-    include_nodes = {target_node}
-    step_nodes = {target_node}
-    next_step_nodes = set()
-
-    for _ in range(subset_params.downstream_depth):
-        for node in step_nodes:
-            next_step_nodes.update(downstream_dict[node])
-        include_nodes.update(next_step_nodes)
-        step_nodes = next_step_nodes
-        next_step_nodes = set()
+    if value == 'all':
+        return ALL_DEPTHS
+    return int(value)
 
-    step_nodes = {target_node}
-    next_step_nodes = set()
-
-    for _ in range(subset_params.upstream_depth):
-        for node in step_nodes:
-            next_step_nodes.update(upstream_dict[node])
-        include_nodes.update(next_step_nodes)
-        step_nodes = next_step_nodes
-        next_step_nodes = set()
-
-    return include_nodes
-
-def _filter_edges_for_subset(new_nodes, edges):
+def _filter_nodes_for_subset(subset_params, graph):
     """
-    Given the subset of nodes, filter for edges within this subset
-    :param new_nodes set[Node]:
-    :param edges list[Edge]:
-    :rtype: list[Edge]
+    Given subset_params, return a set of all nodes upstream and downstream of the target nodes.
+    :param subset_params SubsetParams:
+    :param graph CallGraph:
+    :rtype: set[Node]
     """
-    new_edges = []
-    for edge in edges:
-        if edge.node0 in new_nodes and edge.node1 in new_nodes:
-            new_edges.append(edge)
-    return new_edges
+    targets = [graph.find_one(name) for name in subset_params.target_functions]
+    return graph.reachable(targets, subset_params.downstream_depth, subset_params.upstream_depth)
 
 def _filter_groups_for_subset(new_nodes, file_groups):
     """
@@ -172,11 +141,11 @@ def _filter_groups_for_subset(new_nodes, file_groups):
             if node not in new_nodes:
                 node.remove_from_parent()
 
-    new_file_groups = [g for g in file_groups if g.all_nodes()]
+    new_file_groups = [g for g in file_groups if next(g.iter_nodes(), None) is not None]
 
     for file_group in new_file_groups:
         for group in file_group.all_groups():
-            if not group.all_nodes():
+            if next(group.iter_nodes(), None) is None:
                 group.remove_from_parent()
 
     return new_file_groups
@@ -184,39 +153,87 @@ def _filter_groups_for_subset(new_nodes, file_groups):
 def _filter_for_subset(subset_params, all_nodes, edges, file_groups):
     """
     Given subset_params, return the subset of nodes, edges, and groups
-    upstream and downstream of the target node.
+    upstream and downstream of the target nodes.
     :param subset_params SubsetParams:
     :param all_nodes list[Node]:
     :param edges list[Edge]:
     :param file_groups list[Group]:
     :rtype: list[Group], list[Node], list[Edge]
     """
-    new_nodes = _filter_nodes_for_subset(subset_params, all_nodes, edges)
-    new_edges = _filter_edges_for_subset(new_nodes, edges)
+    graph = CallGraph(all_nodes, edges)
+    new_nodes = _filter_nodes_for_subset(subset_params, graph)
+    new_edges = graph.edges_between(new_nodes)
     new_file_groups = _filter_groups_for_subset(new_nodes, file_groups)
     return new_file_groups, list(new_nodes), new_edges
 
-def generate_json(nodes, edges):
+def generate_json(nodes, edges, lean=False):
     '''
     Generate a json string from nodes and edges
     See https://github.com/jsongraph/json-graph-specification
 
     :param nodes list[Node]: functions
     :param edges list[Edge]: function calls
+    :param lean bool: structured fields instead of labels. See write_json
     :rtype: str
     '''
-    nodes = [n.to_dict() for n in nodes]
-    nodes = {n['uid']: n for n in nodes}
-    edges = [e.to_dict() for e in edges]
+    content = io.StringIO()
+    write_json(content, nodes, edges, lean=lean)
+    return content.getvalue()
+
+def write_json(outfile, nodes, edges, lean=False):
+    '''
+    Write the json graph one node / edge at a time.
+    The output is the same as json.dumps of the whole graph. If two nodes
+    share a uid, only the first is written.
 
-    return json.dumps({"graph": {
-        "directed": True,
-        "nodes": nodes,
-        "edges": edges,
-    }})
+    :param outfile File:
+    :param nodes list[Node]: functions
+    :param edges list[Edge]: function calls
+    :param lean bool: structured fields (file, line, args, variables, edge kind)
+                      instead of the html labels. Much smaller and faster.
+    :rtype: None
+    '''
+    outfile.write('{"graph": {"directed": true, "nodes": {')
+    seen_uids = set()
+    separator = ''
+    for node in nodes:
+        if node.uid in seen_uids:
+            continue
+        seen_uids.add(node.uid)
+        record = node.to_lean_dict() if lean else node.to_dict()
+        outfile.write(separator + json.dumps(node.uid) + ': ' + json.dumps(record))
+        separator = ', '
+    outfile.write('}, "edges": [')
+    separator = ''
+    for edge in edges:
+        record = edge.to_lean_dict() if lean else edge.to_dict()
+        outfile.write(separator + json.dumps(record))
+        separator = ', '
+    outfile.write(']}}')
+
+def write_ndjson(outfile, nodes, edges, lean=False):
+    '''
+    Write newline-delimited json. One record per line, nodes first:
+    {"type": "node", ...} or {"type": "edge", ...}
+
+    :param outfile File:
+    :param nodes list[Node]: functions
+    :param edges list[Edge]: function calls
+    :param lean bool: see write_json
+    :rtype: None
+    '''
+    for node in nodes:
+        record = {'type': 'node'}
+        record.update(node.to_lean_dict() if lean else node.to_dict())
+        outfile.write(json.dumps(record) + '\n')
+    for edge in edges:
+        record = {'type': 'edge'}
+        record.update(edge.to_lean_dict() if lean else edge.to_dict())
+        outfile.write(json.dumps(record) + '\n')
 
 def write_file(outfile, nodes, edges, groups, hide_legend=False,
-               no_grouping=False, as_json=False):
+               no_grouping=False, as_json=False, as_ndjson=False, lean_json=False,
+               only_nodes=None):
     '''
     Write a dot file that can be read by graphviz
 
@@ -225,31 +242,37 @@ def write_file(outfile, nodes, edges, groups, hide_legend=False,
     :param edges list[Edge]: function calls
     :param groups list[Group]: classes and files
     :param hide_legend bool:
+    :param as_json bool: write json instead. See write_json
+    :param as_ndjson bool: write newline-delimited json instead. See write_ndjson
+    :param lean_json bool: for json / ndjson, write structured fields instead of labels
+    :param only_nodes set[Node]|None: for dot, write groups as if they only had these nodes
     :rtype: None
     '''
 
     if as_json:
-        content = generate_json(nodes, edges)
-        outfile.write(content)
+        write_json(outfile, nodes, edges, lean=lean_json)
+        return
+    if as_ndjson:
+        write_ndjson(outfile, nodes, edges, lean=lean_json)
         return
 
     splines = "polyline" if len(edges) >= 500 else "ortho"
 
-    content = "digraph G {\n"
-    content += "concentrate=true;\n"
-    content += f'splines="{splines}";\n'
-    content += 'rankdir="TD";\n'
+    # Written record by record so the document is never held in memory
+    outfile.write("digraph G {\n")
+    outfile.write("concentrate=true;\n")
+    outfile.write(f'splines="{splines}";\n')
+    outfile.write('rankdir="TD";\n')
     if not hide_legend:
-        content += LEGEND
+        outfile.write(LEGEND)
     for node in nodes:
-        content += node.to_dot() + ';\n'
+        outfile.write(node.to_dot() + ';\n')
     for edge in edges:
-        content += edge.to_dot() + ';\n'
+        outfile.write(edge.to_dot() + ';\n')
     if not no_grouping:
         for group in groups:
-            content += group.to_dot()
-    content += '}\n'
-    outfile.write(content)
+            group.write_dot(outfile, only_nodes=only_nodes)
+    outfile.write('}\n')
 
 def determine_language(individual_files):
     """
@@ -326,7 +349,7 @@ def make_file_group(tree, filename, extension):
     :rtype: Group
     """
     language = LANGUAGES[extension]
-    print('filename: ', filename)
+    logging.debug("Making file group for %r", filename)
     subgroup_trees, node_trees, body_trees = language.separate_namespaces(tree)   
     group_type = GROUP_TYPE.FILE
     token = os.path.split(filename)[-1].rsplit('.' + extension, 1)[0]
@@ -345,97 +368,435 @@ def make_file_group(tree, filename, extension):
 
     for subgroup_tree in subgroup_trees:
         file_group.add_subgroup(language.make_class_group(subgroup_tree, parent=file_group))
+
+    assign_stable_uids(file_group, filename)
     return file_group
 
-def _find_link_for_call(child, node_a, all_nodes):
+def _resolve_uid_collisions(file_groups):
+    """
+    Uids are derived per file (see assign_stable_uids) so make sure that no
+    two files ended up sharing one. If they did, the later file gets a new one.
+
+    :param list[Group] file_groups:
+    :rtype: None
+    """
+    taken = set()
+    for file_group in file_groups:
+        mapping = {}
+        for obj in file_group.all_groups() + file_group.all_nodes():
+            if obj.uid in taken:
+                prefix = obj.uid.split('_', 1)[0]
+                mapping[obj.uid] = make_stable_uid(prefix, (obj.uid,), taken)
+                logging.warning("Uid %r of %r collided with another file. Using %r.",
+                                obj.uid, obj, mapping[obj.uid])
+            else:
+                taken.add(obj.uid)
+        if mapping:
+            remap_uids(file_group, mapping)
+
+def _analyze_source(source, extension, lang_params):
+    """
+    Steps 1 and 2 of map_it for a single file. This runs in a worker process
+    so the file group comes back as a picklable summary.
+    Parse errors are returned rather than raised so the caller can decide
+    whether to skip them.
+
+    :param str source:
+    :param str extension:
+    :param LanguageParams lang_params:
+    :rtype: (tuple|None, Exception|None)
+    """
+    language = LANGUAGES[extension]
+    try:
+        tree = language.get_tree(source, lang_params)
+    except Exception as ex:
+        return None, ex
+    return summarize_file_group(make_file_group(tree, source, extension)), None
+
+def _analyze_sources_parallel(sources, extension, lang_params, jobs):
+    """
+    Run _analyze_source across a pool of worker processes.
+    The largest files are scheduled first so that one huge file doesn't
+    start last and hold up the whole pool. Regardless of scheduling, results
+    are returned in the order of sources.
+
+    :param list[str] sources:
+    :param str extension:
+    :param LanguageParams lang_params:
+    :param int jobs:
+    :rtype: list[(str, (tuple|None, Exception|None))]
+    """
+    by_size = sorted(sources, key=lambda source: (-os.path.getsize(source), source))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {source: executor.submit(_analyze_source, source, extension, lang_params)
+                   for source in by_size}
+        # Collected in source order so that results and errors are deterministic
+        return [(source, futures[source].result()) for source in sources]
+
+def _analyze_sources(sources, extension, skip_parse_errors, lang_params, jobs, cache):
+    """
+    Steps 1 and 2 of map_it, returning a summary for every file.
+    Files found in the cache skip both steps. Everything else is analyzed either
+    here or in a process pool and, if there is a cache, stored for next time.
+
+    :param list[str] sources:
+    :param str extension:
+    :param bool skip_parse_errors:
+    :param LanguageParams lang_params:
+    :param int jobs:
+    :param AnalysisCache|None cache:
+    :rtype: list[(str, tuple)]
+    """
+    cache_keys = {}
+    summaries = {}
+    if cache:
+        for source in sources:
+            cache_keys[source] = cache.key(source, extension, lang_params)
+            summary = cache.get(cache_keys[source])
+            if summary:
+                summaries[source] = summary
+        logging.info("Found %d of %d file(s) in the analysis cache.",
+                     len(summaries), len(sources))
+    to_analyze = [s for s in sources if s not in summaries]
+
+    if jobs > 1 and len(to_analyze) > 1:
+        results = _analyze_sources_parallel(to_analyze, extension, lang_params, jobs)
+    else:
+        results = [(s, _analyze_source(s, extension, lang_params)) for s in to_analyze]
+
+    for source, (summary, ex) in results:
+        if ex:
+            if skip_parse_errors:
+                logging.warning("Could not parse %r. (%r) Skipping...", source, ex)
+                continue
+            raise ex
+        if cache:
+            cache.put(cache_keys[source], summary)
+        summaries[source] = summary
+
+    if cache:
+        cache.evict()
+
+    return [(s, summaries[s]) for s in sources if s in summaries]
+
+async def _make_file_groups_async(sources, extension, skip_parse_errors, lang_params, jobs):
+    """
+    Steps 1 and 2 of map_it for languages with an external parser. Up to
+    `jobs` parsers run at once and each file group is built in a worker
+    thread as soon as its file is parsed while the parsers carry on with
+    other files.
+    Errors and file groups are handled in the order of sources regardless of
+    which file finished first.
+
+    :param list[str] sources:
+    :param str extension:
+    :param bool skip_parse_errors:
+    :param LanguageParams lang_params:
+    :param int jobs:
+    :rtype: list[Group]
+    """
+    language = LANGUAGES[extension]
+    command = language.parser_command(lang_params)
+    assert command, "%s has no external parser." % language.__name__
+    pool = AsyncParserPool(command, jobs)
+
+    async def analyze(source):
+        tree, error = await pool.parse(source)
+        try:
+            tree = language.tree_from_parser(source, tree, error)
+        except Exception as ex:
+            return None, ex
+        # Building the group is CPU-bound. Keep it off the event loop.
+        file_group = await asyncio.to_thread(make_file_group, tree, source, extension)
+        return file_group, None
+
+    try:
+        results = await asyncio.gather(*(analyze(source) for source in sources))
+    finally:
+        await pool.close()
+
+    file_groups = []
+    for source, (file_group, ex) in zip(sources, results):
+        if ex:
+            if skip_parse_errors:
+                logging.warning("Could not parse %r. (%r) Skipping...", source, ex)
+                continue
+            raise ex
+        file_groups.append(file_group)
+    return file_groups
+
+def _run_async(coroutine):
+    """
+    Run a coroutine to completion from synchronous code. If this thread already
+    runs an event loop, e.g. pasta was called from async code, use another thread.
+
+    :param coroutine coroutine:
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+def _make_file_groups(sources, extension, skip_parse_errors, lang_params, jobs, cache):
+    """
+    Steps 1 and 2 of map_it. Parse every source and build its file group.
+    In parallel, external parsers run through _make_file_groups_async and
+    everything else goes through summaries, as it does with a cache.
+
+    :param list[str] sources:
+    :param str extension:
+    :param bool skip_parse_errors:
+    :param LanguageParams lang_params:
+    :param int jobs:
+    :param AnalysisCache|None cache:
+    :rtype: list[Group]
+    """
+    if not cache and jobs > 1 and len(sources) > 1 \
+       and LANGUAGES[extension].parser_command(lang_params):
+        return _run_async(_make_file_groups_async(sources, extension, skip_parse_errors,
+                                                  lang_params, jobs))
+    if cache or (jobs > 1 and len(sources) > 1):
+        return [assemble_file_group(summary) for _, summary in
+                _analyze_sources(sources, extension, skip_parse_errors, lang_params,
+                                 jobs, cache)]
+
+    language = LANGUAGES[extension]
+
+    # 1. Read/parse source ASTs
+    file_ast_trees = []
+    for source in sources:
+        try:
+            file_ast_trees.append((source, language.get_tree(source, lang_params)))
+        except Exception as ex:
+            if skip_parse_errors:
+                logging.warning("Could not parse %r. (%r) Skipping...", source, ex)
+            else:
+                raise ex
+
+    # 2. Find all groups (classes/modules) and nodes (functions) (a lot happens here)
+    file_groups = []
+    for source, file_ast_tree in file_ast_trees:
+        file_group = make_file_group(file_ast_tree, source, extension)
+        file_groups.append(file_group)
+    return file_groups
+
+class SymbolTable():
+    """
+    Lookup structure for linking calls to the nodes they might refer to.
+    Built once per run so that every call is resolved with dictionary
+    lookups rather than a scan over every function node.
+    """
+    def __init__(self, function_nodes):
+        """
+        :param function_nodes list[Node]:
+        """
+        self.nodes_by_token = collections.defaultdict(list)
+        self.file_nodes_by_token = collections.defaultdict(list)
+        self.constructors_by_class_token = collections.defaultdict(list)
+        self.nodes_by_parent_and_token = collections.defaultdict(list)
+
+        for node in function_nodes:
+            self.add(node)
+
+    def _indexes_for(self, node):
+        ret = [(self.nodes_by_token, node.token),
+               (self.nodes_by_parent_and_token, (node.parent, node.token))]
+        if isinstance(node.parent, Group) and node.parent.group_type == GROUP_TYPE.FILE:
+            ret.append((self.file_nodes_by_token, node.token))
+        if node.is_constructor:
+            ret.append((self.constructors_by_class_token, node.parent.token))
+        return ret
+
+    def add(self, node):
+        """
+        :param node Node:
+        """
+        for index, key in self._indexes_for(node):
+            index[key].append(node)
+
+    def remove(self, node):
+        """
+        :param node Node:
+        """
+        for index, key in self._indexes_for(node):
+            index[key].remove(node)
+            if not index[key]:
+                del index[key]
+
+    def possible_nodes(self, call, node_a):
+        """
+        Return every node that the call on node_a could be referring to.
+
+        :param call Call:
+        :param node_a Node:
+        :rtype: list[Node]
+        """
+        if call.is_attr():
+            # Excluding nodes from node_a's own file prevents self linkage in cases like
+            # function a() {b = Obj(); b.a()}
+            same_file = self.nodes_by_parent_and_token.get((node_a.file_group(), call.token))
+            candidates = self.nodes_by_token.get(call.token, [])
+            if same_file:
+                return [n for n in candidates if n not in same_file]
+            return list(candidates)
+
+        file_nodes = self.file_nodes_by_token.get(call.token, [])
+        constructors = self.constructors_by_class_token.get(call.token, [])
+        if file_nodes and constructors:
+            # a node matching both ways is still only one candidate
+            return file_nodes + [n for n in constructors if n not in file_nodes]
+        return file_nodes + constructors
+
+
+def _find_link_for_call(child, node_a, symbol_table):
     """
     Given a call that happened on a node (node_a), return the node
     that the call links to and the call itself if >1 node matched.
 
     :param call Call:
     :param node_a Node:
-    :param all_nodes list[Node]:
+    :param symbol_table SymbolTable:
 
     :returns: The node it links to and the call if >1 node matched.
     :rtype: (Node|None, Call|None)
     """
 
-    all_vars = node_a.get_variables(child.line_number)
-    #print('all my vars: ', all_vars)
-    #if node_a.token == 'jobConfirmationFromOperator':
-        #print('JOB_CONFIRMATION_FROM_OPERATOR@@@@@@@@@@@@@@@@@@@@@@@@@@@')
-        #print('node_a calls:  ', node_a.calls)
-        #print('child sent: ', child.line_number)
-        #print('all vars:  ', all_vars)
-        #print('done looking at node_a!!!')
-
-    # not sure why we even do this... we never use vars....
-    #for var in all_vars:
-    #    var_match = child.matches_variable(var)
-    #    if var_match:
-            # Unknown modules (e.g. third party) we don't want to match)
-    #        if var_match == OWNER_CONST.UNKNOWN_MODULE:
-    #            return None, None
-    #        assert isinstance(var_match, Node)
-    #        return var_match, None
-
-    possible_nodes = []
-    #print('child: ', child.token)
-    if child.is_attr():
-        #print('child is_attr!!!: ', child.token)
-        for node in all_nodes:
-            # checking node.parent != node_a.file_group() prevents self linkage in cases like
-            # function a() {b = Obj(); b.a()}
-            if child.token == node.token and node.parent != node_a.file_group():
-                #print('child token: ', child.token)
-                print('possible_node: ', node.token)
-                possible_nodes.append(node)
-    else:
-        for node in all_nodes:
-            
-            #print('node: ', node.token)
-            if child.token == node.token \
-               and isinstance(node.parent, Group)  \
-               and node.parent.group_type == GROUP_TYPE.FILE:
-                print(child.token, ' found: ', node.token)
-                possible_nodes.append(node)
-            elif child.token == node.parent.token and node.is_constructor:
-                print(child.token, ' found: ', node.token)
-                possible_nodes.append(node)
+    possible_nodes = symbol_table.possible_nodes(child, node_a)
 
     if len(possible_nodes) == 1:
         return possible_nodes[0], None
     if len(possible_nodes) > 1:
-        print('bad child!!!!!!!!', len(possible_nodes))
         return None, child
     return None, None
 
-def _find_links(node_a, all_nodes):
+def _find_links(node_a, symbol_table):
     """
     Iterate through the calls on node_a to find everything the node links to.
     This will return a list of tuples of nodes and calls that were ambiguous.
 
     :param Node node_a:
-    :param list[Node] all_nodes:
-    :param BaseLanguage language:
+    :param SymbolTable symbol_table:
     :rtype: list[(Node, Call)]
     """
 
-   
-
-    #print('all nodes: ', all_nodes)
     links = []
     for child in node_a.calls:
-        #print('child to inspect: ', child)
-        lfc = _find_link_for_call(child, node_a, all_nodes)
-        #print('lfc is: ', lfc)
+        lfc = _find_link_for_call(child, node_a, symbol_table)
         assert not isinstance(lfc, Group)
         links.append(lfc)
     return list(filter(None, links))
 
+def _make_detail_edges(all_nodes):
+    """
+    Link function nodes to their If/Try detail nodes and to where they jump,
+    and those detail nodes to their branches. Nodes reference each other by uid so this indexes every
+    node by uid once and resolves each reference with a lookup.
+    References to uids that don't exist (e.g. the node was excluded) are logged.
+
+    :param list[Node|IfNode|TryNode] all_nodes:
+    :rtype: list[Edge]
+    """
+    nodes_by_uid = {}
+    for node in all_nodes:
+        if node.uid in nodes_by_uid:
+            logging.warning("Duplicate node uid %r for %r and %r. Only linking the first.",
+                            node.uid, nodes_by_uid[node.uid].name(), node.name())
+            continue
+        nodes_by_uid[node.uid] = node
+
+    detail_edges = []
+
+    def link(node_a, uid, attribute, **kwargs):
+        if uid is None:
+            return
+        node_b = nodes_by_uid.get(uid)
+        if node_b is None:
+            logging.warning("Could not find node %r referenced by %s of %r. Skipping edge.",
+                            uid, attribute, node_a.name())
+            return
+        detail_edges.append(Edge(node_a, node_b, **kwargs))
+
+    for node_a in all_nodes:
+        if type(node_a) == Node:
+            link(node_a, node_a.detailNode, 'detailNode', kind=EDGE_KIND.DETAIL)
+            link(node_a, node_a.jumpID, 'jumpID', color='blue', lineStyle='dotted',
+                 tailLabel=node_a.jumpKind.lower() if node_a.jumpKind else '',
+                 kind=node_a.jumpKind)
+        elif type(node_a) == IfNode:
+            link(node_a, node_a.ifTrueID, 'ifTrueID', color='green', lineStyle='dashed', tailLabel='',
+                 kind=EDGE_KIND.IF_TRUE)
+            link(node_a, node_a.ifFalseID, 'ifFalseID', color='red', lineStyle='dashed', tailLabel='',
+                 kind=EDGE_KIND.IF_FALSE)
+            link(node_a, node_a.ifContID, 'ifContID', tailLabel='', kind=EDGE_KIND.IF_CONT)
+        elif type(node_a) == TryNode:
+            link(node_a, node_a.tryBodyID, 'tryBodyID', color='orange', lineStyle='solid',
+                 tailLabel='', kind=EDGE_KIND.TRY_BODY)
+            for expt in node_a.exceptBodyIDs or []:
+                link(node_a, expt, 'exceptBodyIDs', color='red', lineStyle='dashed', tailLabel='',
+                     kind=EDGE_KIND.EXCEPT)
+            link(node_a, node_a.tryContID, 'tryContID', tailLabel='', kind=EDGE_KIND.TRY_CONT)
+    return detail_edges
+
+def _nodes_by_subgroup_token(all_subgroups, warn=True):
+    """
+    Map every group token to the nodes of all groups with that token.
+    Used to resolve inheritance.
+
+    :param list[Group] all_subgroups:
+    :param bool warn: log duplicate group names
+    :rtype: dict[str, list[Node]]
+    """
+    nodes_by_subgroup_token = collections.defaultdict(list)
+    for subgroup in all_subgroups:
+        if warn and subgroup.token in nodes_by_subgroup_token:
+            logging.warning("Duplicate group name %r. Naming collision possible.",
+                            subgroup.token)
+        nodes_by_subgroup_token[subgroup.token] += subgroup.nodes
+    return nodes_by_subgroup_token
+
+def _resolve_inherits(subgroups, nodes_by_subgroup_token):
+    """
+    Point the inherits of each subgroup to the inherited nodes and make those
+    nodes available as variables to the subgroup's own nodes.
+
+    :param list[Group] subgroups:
+    :param dict[str, list[Node]] nodes_by_subgroup_token:
+    :rtype: None
+    """
+    # These variables point to nodes so resolve_variables never changes them.
+    # Every class inheriting the same group can share one set.
+    inherited_variables = {}
+    for subgroup in subgroups:
+        subgroup.inherits = [nodes_by_subgroup_token.get(g) for g in subgroup.inherits]
+        subgroup.inherits = list(filter(None, subgroup.inherits))
+        for inherit_nodes in subgroup.inherits:
+            variables = inherited_variables.get(id(inherit_nodes))
+            if variables is None:
+                variables = [Variable(n.token, n, n.line_number)
+                             for n in inherit_nodes if type(n) == Node]
+                inherited_variables[id(inherit_nodes)] = variables
+            for node in subgroup.nodes:
+                if type(node) == Node:
+                    node.variables += variables
+
+def _log_bad_calls(bad_calls):
+    """
+    :param list[Call] bad_calls: calls that linked to multiple function definitions
+    :rtype: None
+    """
+    bad_calls_strings = set()
+    for bad_call in bad_calls:
+        bad_calls_strings.add(bad_call.to_string())
+    bad_calls_strings = list(sorted(list(bad_calls_strings)))
+    if bad_calls_strings:
+        logging.info("Skipped processing these calls because the algorithm "
+                     "linked them to multiple function definitions: %r." % bad_calls_strings)
+
 def map_it(sources, extension, no_trimming, exclude_namespaces, exclude_functions,
            include_only_namespaces, include_only_functions,
-           skip_parse_errors, lang_params):
+           skip_parse_errors, lang_params, jobs=1, cache=None, metrics=None):
     '''
     Given a language implementation and a list of filenames, do these things:
     1. Read/parse source ASTs
@@ -456,63 +817,66 @@ def map_it(sources, extension, no_trimming, exclude_namespaces, exclude_function
     :param list include_only_functions:
     :param bool skip_parse_errors:
     :param LanguageParams lang_params:
+    :param int jobs: number of processes to parse with. 0 means one per CPU
+    :param AnalysisCache|None cache: per-file analysis cache
+    :param PipelineMetrics|None metrics: records the cost of each step and what it found
 
     :rtype: (list[Group], list[Node], list[Edge])
     '''
 
     language = LANGUAGES[extension]
+    metrics = metrics or PipelineMetrics()
 
     # 0. Assert dependencies
     language.assert_dependencies()
 
-    # 1. Read/parse source ASTs
-    file_ast_trees = []
-    for source in sources:
-        try:
-            file_ast_trees.append((source, language.get_tree(source, lang_params)))
-        except Exception as ex:
-            if skip_parse_errors:
-                logging.warning("Could not parse %r. (%r) Skipping...", source, ex)
-            else:
-                raise ex
+    # 1 & 2. Read/parse source ASTs, then find all groups (classes/modules)
+    # and nodes (functions) (a lot happens here)
+    jobs = jobs or os.cpu_count() or 1
+    with metrics.stage('parse'):
+        file_groups = _make_file_groups(sources, extension, skip_parse_errors, lang_params,
+                                        jobs, cache)
+        _resolve_uid_collisions(file_groups)
 
-    # 2. Find all groups (classes/modules) and nodes (functions) (a lot happens here)
-    file_groups = []
-    for source, file_ast_tree in file_ast_trees:
-        file_group = make_file_group(file_ast_tree, source, extension)
-        file_groups.append(file_group)
+    return _map_file_groups(file_groups, sources, no_trimming, exclude_namespaces,
+                            exclude_functions, include_only_namespaces, include_only_functions,
+                            metrics)
 
+def _map_file_groups(file_groups, sources, no_trimming, exclude_namespaces, exclude_functions,
+                     include_only_namespaces, include_only_functions, metrics):
+    '''
+    Steps 3 through 8 of map_it, once every file group is built.
+    See map_it for the parameters.
+
+    :param list[Group] file_groups:
+    :param list[str] sources:
+    :param PipelineMetrics metrics:
+    :rtype: (list[Group], list[Node], list[Edge])
+    '''
     # 3. Trim namespaces / functions to exactly what we want
-    if exclude_namespaces or include_only_namespaces:
-        file_groups = _limit_namespaces(file_groups, exclude_namespaces, include_only_namespaces)
-    if exclude_functions or include_only_functions:
-        file_groups = _limit_functions(file_groups, exclude_functions, include_only_functions)
+    with metrics.stage('trim'):
+        if exclude_namespaces or include_only_namespaces:
+            file_groups = _limit_namespaces(file_groups, exclude_namespaces,
+                                            include_only_namespaces)
+        if exclude_functions or include_only_functions:
+            file_groups = _limit_functions(file_groups, exclude_functions,
+                                           include_only_functions)
 
     # 4. Consolidate structures
-    all_subgroups = flatten(g.all_groups() for g in file_groups)
-    all_nodes = flatten(g.all_nodes() for g in file_groups)
-    function_nodes = list(filter(lambda node: type(node) == Node, all_nodes))
-    if_nodes = list(filter(lambda node: type(node) == IfNode, all_nodes))
-    try_nodes = list(filter(lambda node: type(node) == TryNode, all_nodes))
- 
-    nodes_by_subgroup_token = collections.defaultdict(list)
-    for subgroup in all_subgroups:
-        if subgroup.token in nodes_by_subgroup_token:
-            logging.warning("Duplicate group name %r. Naming collision possible.",
-                            subgroup.token)
-        nodes_by_subgroup_token[subgroup.token] += subgroup.nodes
+    with metrics.stage('consolidate'):
+        all_subgroups = flatten(g.all_groups() for g in file_groups)
+        all_nodes = flatten(g.all_nodes() for g in file_groups)
+        function_nodes = list(filter(lambda node: type(node) == Node, all_nodes))
 
-    for group in file_groups:
-        for subgroup in group.all_groups():
-            subgroup.inherits = [nodes_by_subgroup_token.get(g) for g in subgroup.inherits]
-            subgroup.inherits = list(filter(None, subgroup.inherits))
-            for inherit_nodes in subgroup.inherits:
-                for node in subgroup.nodes:
-                    node.variables += [Variable(n.token, n, n.line_number) for n in inherit_nodes]
+        nodes_by_subgroup_token = _nodes_by_subgroup_token(all_subgroups)
+        _resolve_inherits(all_subgroups, nodes_by_subgroup_token)
+        import_index = make_import_index(file_groups)
+        group_index = make_group_index(file_groups)
 
     # 5. Attempt to resolve the variables (point them to a node or group)
-    for node in function_nodes:
-        node.resolve_variables(file_groups)
+    with metrics.stage('resolve_variables'):
+        for node in function_nodes:
+            node.resolve_variables(file_groups, import_index, group_index)
 
     # Not a step. Just log what we know so far
     #logging.info("Found groups %r." % [g.label() for g in all_subgroups])
@@ -523,88 +887,42 @@ def map_it(sources, extension, no_trimming, exclude_namespaces, exclude_function
     #                                                     flatten(n.variables for n in all_nodes)))))
 
     # 6. Find all calls between all nodes
-    bad_calls = []
-    edges = []
-   
-    for node_a in function_nodes:
-            links = _find_links(node_a, function_nodes)
+    with metrics.stage('link'):
+        bad_calls = []
+        edges = []
+        symbol_table = SymbolTable(function_nodes)
+
+        for node_a in function_nodes:
+            links = _find_links(node_a, symbol_table)
             for node_b, bad_call in links:
                 if bad_call:
                     bad_calls.append(bad_call)
                 if not node_b:
                     continue
-                edges.append(Edge(node_a, node_b, color='blue', lineStyle='dashed', tailLabel='CALL'))
-
-    # if_edges = []
-    # for node_a in all_nodes:
-    #     if type(node_a) == Node:
-    #         if node_a.ifNode != None:
-    #             for node_b in if_nodes:
-    #                 if node_b.uid == node_a.ifNode:
-    #                     if_edges.append(Edge(node_a, node_b))
-    #     if type(node_a) == IfNode:
-    #         for node_b in all_nodes:
-    #             if node_a.ifTrueID == node_b.uid:
-    #                 if_edges.append(Edge(node_a, node_b, color='green', lineStyle='dashed'))
-    #             if node_a.ifFalseID == node_b.uid:
-    #                 if_edges.append(Edge(node_a, node_b, color='red', lineStyle='dashed'))
-    #             if node_a.ifContID == node_b.uid:
-    #                 if_edges.append(Edge(node_a, node_b))
-                
-    # edges += if_edges
-
-    # try_edges = []
-    # for node_a in all_nodes:
-    #     if type(node_a) == Node:
-    #         if node_a.ifNode != None:
-    #             for node_b in try_nodes:
-    #                 if node_b.uid == node_a.ifNode:
-    #                     try_edges.append(Edge(node_a, node_b))
-    #     if type(node_a) == TryNode:
-    #         for
-
-    detail_edges = []
-    for node_a in all_nodes:
-        if type(node_a) == Node:
-            if node_a.detailNode != None:
-                for node_b in all_nodes:
-                    if node_b.uid == node_a.detailNode:
-                        detail_edges.append(Edge(node_a, node_b))
-        if type(node_a) != Node:
-            for node_b in all_nodes:
-                if type(node_a) == IfNode:
-                    if node_a.ifTrueID == node_b.uid:
-                        detail_edges.append(Edge(node_a, node_b, color='green', lineStyle='dashed', tailLabel=''))
-                    if node_a.ifFalseID == node_b.uid:
-                        detail_edges.append(Edge(node_a, node_b, color='red', lineStyle='dashed', tailLabel=''))
-                    if node_a.ifContID == node_b.uid:
-                        detail_edges.append(Edge(node_a, node_b, tailLabel=''))
-                if type(node_a) == TryNode:
-                    if node_a.tryBodyID == node_b.uid:
-                        detail_edges.append(Edge(node_a, node_b, color='orange', lineStyle='solid', tailLabel=''))
-                    if node_a.exceptBodyIDs != []:
-                        for expt in node_a.exceptBodyIDs:
-                            if expt == node_b.uid:
-                                detail_edges.append(Edge(node_a, node_b, color='red', lineStyle='dashed', tailLabel=''))
-                    if node_a.tryContID == node_b.uid:
-                        detail_edges.append(Edge(node_a, node_b, tailLabel=''))
-
-    edges += detail_edges
-
-
-    print('found this many detail_edges: ', len(detail_edges))
-    print('I found the bad calls:   ', bad_calls)
-    print('I found this many edges:  ', len(edges))
-    print('but I have this many nodes:  ', len(all_nodes))
+                edges.append(Edge(node_a, node_b, color='blue', lineStyle='dashed',
+                                  tailLabel='CALL'))
+
+        num_call_edges = len(edges)
+        detail_edges = _make_detail_edges(all_nodes)
+        edges += detail_edges
+
+    metrics.counts.update({
+        'files': len(sources),
+        'groups': len(all_subgroups),
+        'nodes': len(all_nodes),
+        'calls': sum(len(node.calls) for node in function_nodes),
+        'variables': sum(len(node.variables) for node in function_nodes),
+        'resolved_calls': num_call_edges,
+        'ambiguous_calls': len(bad_calls),
+    })
+    metrics.edges_by_kind = dict(collections.Counter(edge.kind for edge in edges))
+
+    logging.debug("Found %d detail edges, %d edges and %d ambiguous calls for %d nodes.",
+                  len(detail_edges), len(edges), len(bad_calls), len(all_nodes))
 
     # 7. Loudly complain about duplicate edges that were skipped
-    bad_calls_strings = set()
-    for bad_call in bad_calls:
-        bad_calls_strings.add(bad_call.to_string())
-    bad_calls_strings = list(sorted(list(bad_calls_strings)))
-    if bad_calls_strings:
-        logging.info("Skipped processing these calls because the algorithm "
-                     "linked them to multiple function definitions: %r." % bad_calls_strings)
+    with metrics.stage('log_bad_calls'):
+        _log_bad_calls(bad_calls)
 
     if no_trimming:
         return file_groups, all_nodes, edges
@@ -638,13 +956,262 @@ def map_it(sources, extension, no_trimming, exclude_namespaces, exclude_function
 
     return file_groups, all_nodes, edges
 
-def _limit_namespaces(file_groups, exclude_namespaces, include_only_namespaces):
+async def map_it_async(sources, extension, no_trimming, exclude_namespaces, exclude_functions,
+                       include_only_namespaces, include_only_functions,
+                       skip_parse_errors, lang_params, jobs=1, cache=None, metrics=None):
+    '''
+    map_it for asyncio. Files of languages with an external parser are parsed
+    by up to `jobs` parser processes at once and each file group is built as
+    soon as its file is parsed. Everything else runs in a thread so that the
+    event loop isn't blocked. See map_it for the parameters.
+
+    :rtype: (list[Group], list[Node], list[Edge])
+    '''
+    language = LANGUAGES[extension]
+    metrics = metrics or PipelineMetrics()
+    language.assert_dependencies()
+
+    jobs = jobs or os.cpu_count() or 1
+    with metrics.stage('parse'):
+        if language.parser_command(lang_params) and not cache:
+            file_groups = await _make_file_groups_async(sources, extension, skip_parse_errors,
+                                                        lang_params, jobs)
+        else:
+            file_groups = await asyncio.to_thread(_make_file_groups, sources, extension,
+                                                  skip_parse_errors, lang_params, jobs, cache)
+        _resolve_uid_collisions(file_groups)
+
+    return await asyncio.to_thread(_map_file_groups, file_groups, sources, no_trimming,
+                                   exclude_namespaces, exclude_functions,
+                                   include_only_namespaces, include_only_functions, metrics)
+
+def _content_hash(source):
+    """
+    :param str source:
+    :rtype: str
+    """
+    with open(source, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _call_targets(function_nodes):
+    """
+    Call tokens that could resolve to any of these nodes. See SymbolTable.
+
+    :param list[Node] function_nodes:
+    :rtype: set[str]
+    """
+    ret = set()
+    for node in function_nodes:
+        ret.add(node.token)
+        if node.is_constructor:
+            ret.add(node.parent.token)
+    return ret
+
+class _FileState():
+    """
+    Everything IncrementalModel keeps for a single source file.
+    """
+    def __init__(self, summary, content_hash):
+        self.summary = summary
+        self.content_hash = content_hash
+        self.groups, self.nodes = assemble_objects(summary)
+        self.file_group = self.groups[0]
+        self.defined_tokens = defined_tokens(summary)
+        self.referenced_tokens = referenced_tokens(summary)
+        self.detail_edges = []
+
+    def function_nodes(self):
+        """
+        Function nodes still in the file group (i.e. after trimming)
+        :rtype: list[Node]
+        """
+        return [n for n in self.file_group.all_nodes() if type(n) == Node]
+
+class IncrementalModel():
+    """
+    map_it for --watch. The analyzed model stays in memory along with the
+    summary of every file. When files change, only those files are parsed again
+    and only the variables and edges that touch their symbols are recomputed:
+
+    - Other files are relinked (steps 4 & 5) only if they inherit from, import
+      or construct something by a token that the changed files define.
+    - Calls are relinked (step 6) only from the changed files' nodes and from
+      nodes making a call whose token matched or now matches a changed node.
+    """
+    def __init__(self, extension, exclude_namespaces, exclude_functions,
+                 include_only_namespaces, include_only_functions,
+                 skip_parse_errors, lang_params, jobs=1, cache=None):
+        """
+        See map_it for parameters
+        """
+        self.extension = extension
+        self.exclude_namespaces = exclude_namespaces
+        self.exclude_functions = exclude_functions
+        self.include_only_namespaces = include_only_namespaces
+        self.include_only_functions = include_only_functions
+        self.skip_parse_errors = skip_parse_errors
+        self.lang_params = lang_params
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cache = cache
+
+        self.sources = []
+        self.files = {}
+        self.symbol_table = SymbolTable([])
+        self.callers_by_token = collections.defaultdict(dict)
+        self.call_edges = {}
+        self.bad_calls = {}
+
+    def update(self, sources, changed_paths=None):
+        """
+        Bring the model up to date with sources.
+
+        :param list[str] sources: every source file, as from get_sources_and_language
+        :param set[str]|None changed_paths: files that might have changed. None means all.
+        :returns: the same as map_it or None if nothing changed
+        :rtype: (list[Group], list[Node], list[Edge])|None
+        """
+        first_update = not self.files
+        if first_update:
+            LANGUAGES[self.extension].assert_dependencies()
+
+        source_set = set(sources)
+        removed = [s for s in self.sources if s not in source_set]
+        maybe_changed = [s for s in sources if s not in self.files
+                         or changed_paths is None or s in changed_paths]
+        content_hashes = {s: _content_hash(s) for s in maybe_changed}
+        to_analyze = [s for s in maybe_changed
+                      if s not in self.files or self.files[s].content_hash != content_hashes[s]]
+        if not removed and not to_analyze:
+            return None
+
+        # 1 & 2. Nothing is modified until every changed file is parsed successfully
+        summaries = _analyze_sources(to_analyze, self.extension, self.skip_parse_errors,
+                                     self.lang_params, self.jobs, self.cache)
+        # Files that couldn't be parsed (with skip_parse_errors) drop out
+        removed += [s for s in to_analyze if s in self.files
+                    and s not in dict(summaries)]
+        logging.info("Updating %d changed and %d removed file(s)...",
+                     len(summaries), len(removed))
+
+        # Take out the old version of everything that changed
+        touched_tokens = set()
+        old_function_nodes = []
+        for source in removed + [s for s, _ in summaries if s in self.files]:
+            state = self.files.pop(source)
+            touched_tokens |= state.defined_tokens
+            old_function_nodes += state.function_nodes()
+        for node in old_function_nodes:
+            self._remove_function_node(node)
+
+        new_states = []
+        for source, summary in summaries:
+            state = _FileState(summary, content_hashes[source])
+            touched_tokens |= state.defined_tokens
+            self.files[source] = state
+            new_states.append(state)
+        self.sources = [s for s in sources if s in self.files]
+        file_groups = [self.files[s].file_group for s in self.sources]
+        _resolve_uid_collisions(file_groups)
+
+        # Unchanged files which referred to something that changed are relinked from scratch
+        relink_states = list(new_states)
+        for source in self.sources:
+            state = self.files[source]
+            if state not in new_states and state.referenced_tokens & touched_tokens:
+                restore_links(state.summary, state.groups, state.nodes)
+                relink_states.append(state)
+
+        # 3. Trim namespaces / functions to exactly what we want. Only the
+        # first update sees every file so only it warns about what wasn't found
+        new_file_groups = [s.file_group for s in new_states]
+        if self.exclude_namespaces or self.include_only_namespaces:
+            _limit_namespaces(new_file_groups, self.exclude_namespaces,
+                              self.include_only_namespaces, warn=first_update)
+        if self.exclude_functions or self.include_only_functions:
+            _limit_functions(new_file_groups, self.exclude_functions,
+                             self.include_only_functions, warn=first_update)
+
+        # 4. Consolidate structures
+        all_subgroups = flatten(g.all_groups() for g in file_groups)
+        nodes_by_subgroup_token = _nodes_by_subgroup_token(all_subgroups, warn=first_update)
+        _resolve_inherits(flatten(s.file_group.all_groups() for s in relink_states),
+                          nodes_by_subgroup_token)
+        import_index = make_import_index(file_groups)
+        group_index = make_group_index(file_groups)
+
+        # 5. Attempt to resolve the variables (point them to a node or group)
+        for state in relink_states:
+            for node in state.function_nodes():
+                node.resolve_variables(file_groups, import_index, group_index)
+
+        # 6. Find calls from new nodes and calls that could have resolved differently
+        new_function_nodes = flatten(s.function_nodes() for s in new_states)
+        for node in new_function_nodes:
+            self._add_function_node(node)
+        to_link = dict.fromkeys(flatten(s.function_nodes() for s in relink_states))
+        for token in _call_targets(old_function_nodes) | _call_targets(new_function_nodes):
+            to_link.update(self.callers_by_token.get(token, {}))
+        for node_a in to_link:
+            self._link(node_a)
+        for state in new_states:
+            state.detail_edges = _make_detail_edges(state.file_group.all_nodes())
+        logging.info("Relinked %d file(s) and the calls of %d node(s).",
+                     len(relink_states), len(to_link))
+
+        # 7. Loudly complain about duplicate edges that were skipped
+        _log_bad_calls(flatten(self.bad_calls.values()))
+
+        all_nodes = flatten(g.all_nodes() for g in file_groups)
+        edges = (flatten(self.call_edges.values())
+                 + flatten(self.files[s].detail_edges for s in self.sources))
+
+        # Edges mark their nodes as not being leaves / trunks. Since edges come
+        # and go here, recompute that for everything
+        for node in all_nodes:
+            node.is_leaf = True
+            node.is_trunk = True
+        for edge in edges:
+            edge.node0.is_leaf = False
+            edge.node1.is_trunk = False
+
+        return file_groups, all_nodes, edges
+
+    def _add_function_node(self, node):
+        self.symbol_table.add(node)
+        for call in node.calls:
+            self.callers_by_token[call.token][node] = None
+
+    def _remove_function_node(self, node):
+        self.symbol_table.remove(node)
+        for call in node.calls:
+            callers = self.callers_by_token.get(call.token)
+            if callers is not None:
+                callers.pop(node, None)
+                if not callers:
+                    del self.callers_by_token[call.token]
+        self.call_edges.pop(node, None)
+        self.bad_calls.pop(node, None)
+
+    def _link(self, node_a):
+        edges = []
+        bad_calls = []
+        for node_b, bad_call in _find_links(node_a, self.symbol_table):
+            if bad_call:
+                bad_calls.append(bad_call)
+            if not node_b:
+                continue
+            edges.append(Edge(node_a, node_b, color='blue', lineStyle='dashed', tailLabel='CALL'))
+        self.call_edges[node_a] = edges
+        self.bad_calls[node_a] = bad_calls
+
+def _limit_namespaces(file_groups, exclude_namespaces, include_only_namespaces, warn=True):
     """
     Exclude namespaces (classes/modules) which match any of the exclude_namespaces
 
     :param list[Group] file_groups:
     :param list exclude_namespaces:
     :param list include_only_namespaces:
+    :param bool warn: log namespaces that could not be excluded
     :rtype: list[Group]
     """
 
@@ -661,7 +1228,7 @@ def _limit_namespaces(file_groups, exclude_namespaces, include_only_namespaces):
             removed_namespaces.add(group.token)
 
         for subgroup in group.all_groups():
-            print(subgroup, subgroup.all_parents())
+            logging.debug("Filtering %r in %r", subgroup, subgroup.all_parents())
             if subgroup.token in exclude_namespaces:
                 for node in subgroup.all_nodes():
                     node.remove_from_parent()
@@ -674,18 +1241,19 @@ def _limit_namespaces(file_groups, exclude_namespaces, include_only_namespaces):
                 removed_namespaces.add(group.token)
 
     for namespace in exclude_namespaces:
-        if namespace not in removed_namespaces:
+        if warn and namespace not in removed_namespaces:
             logging.warning(f"Could not exclude namespace '{namespace}' "
                              "because it was not found.")
     return file_groups
 
-def _limit_functions(file_groups, exclude_functions, include_only_functions):
+def _limit_functions(file_groups, exclude_functions, include_only_functions, warn=True):
     """
     Exclude nodes (functions) which match any of the exclude_functions
 
     :param list[Group] file_groups:
     :param list exclude_functions:
     :param list include_only_functions:
+    :param bool warn: log functions that could not be excluded
     :rtype: list[Group]
     """
 
@@ -699,7 +1267,7 @@ def _limit_functions(file_groups, exclude_functions, include_only_functions):
                 removed_functions.add(node.token)
 
     for function_name in exclude_functions:
-        if function_name not in removed_functions:
+        if warn and function_name not in removed_functions:
             logging.warning(f"Could not exclude function '{function_name}' "
                              "because it was not found.")
     return file_groups
@@ -738,7 +1306,9 @@ def pasta(raw_source_paths, output_file, language=None, hide_legend=True,
               exclude_namespaces=None, exclude_functions=None,
               include_only_namespaces=None, include_only_functions=None,
               no_grouping=False, no_trimming=False, skip_parse_errors=False,
-              lang_params=None, subset_params=None, level=logging.INFO):
+              lang_params=None, subset_params=None, jobs=1, cache_dir=None,
+              cache_max_bytes=DEFAULT_MAX_BYTES, watch=False, lean_json=False,
+              metrics_out=None, level=logging.INFO):
     """
     Top-level function. Generate a diagram based on source code.
     Can generate either a dotfile or an image.
@@ -756,6 +1326,13 @@ def pasta(raw_source_paths, output_file, language=None, hide_legend=True,
     :param bool skip_parse_errors: If a language parser fails to parse a file, skip it
     :param lang_params LanguageParams: Object to store lang-specific params
     :param subset_params SubsetParams: Object to store subset-specific params
+    :param int jobs: Number of processes to parse with. 0 means one per CPU
+    :param str cache_dir: Directory to cache per-file analysis in between runs
+    :param int cache_max_bytes: Evict the oldest cache entries beyond this size
+    :param bool watch: Keep running and update the output whenever the sources change
+    :param bool lean_json: For json / ndjson output, write structured fields instead of labels
+    :param str metrics_out: Write the time spent in each stage and what it found here.
+                            json or, for .prom files, a Prometheus textfile
     :param int level: logging level
     :rtype: None
     """
@@ -764,7 +1341,120 @@ def pasta(raw_source_paths, output_file, language=None, hide_legend=True,
     if not isinstance(raw_source_paths, list):
         raw_source_paths = [raw_source_paths]
     lang_params = lang_params or LanguageParams()
+    exclude_namespaces, exclude_functions, include_only_namespaces, include_only_functions = \
+        _check_filters(exclude_namespaces, exclude_functions,
+                       include_only_namespaces, include_only_functions)
+    if jobs < 0:
+        raise AssertionError("--jobs must be >= 0")
+    if watch and subset_params:
+        raise AssertionError("--watch can't be combined with --target-function")
+    if watch and metrics_out:
+        raise AssertionError("--watch can't be combined with --metrics-out")
+
+    logging.basicConfig(format="pasta: %(message)s", level=level)
+
+    sources, language = get_sources_and_language(raw_source_paths, language)
+    output_file, output_ext, final_img_filename = _check_output_file(output_file)
+
+    cache = None
+    if cache_dir:
+        cache = AnalysisCache(cache_dir, VERSION, max_bytes=cache_max_bytes)
+
+    if watch:
+        _watch(raw_source_paths, language, output_file, output_ext, final_img_filename,
+               hide_legend, exclude_namespaces, exclude_functions,
+               include_only_namespaces, include_only_functions, no_grouping,
+               skip_parse_errors, lang_params, jobs, cache, lean_json)
+        return
+
+    metrics = PipelineMetrics()
+    file_groups, all_nodes, edges = map_it(sources, language, no_trimming,
+                                           exclude_namespaces, exclude_functions,
+                                           include_only_namespaces, include_only_functions,
+                                           skip_parse_errors, lang_params, jobs, cache, metrics)
+
+    if subset_params:
+        logging.info("Filtering into subset...")
+        with metrics.stage('subset'):
+            file_groups, all_nodes, edges = _filter_for_subset(subset_params, all_nodes, edges,
+                                                               file_groups)
+
+    _write_output(output_file, output_ext, final_img_filename, file_groups, all_nodes, edges,
+                  hide_legend, no_grouping, lean_json, metrics)
+    logging.info("pasta finished processing in %.2f seconds." % (time.time() - start_time))
+
+    if metrics_out:
+        metrics.write(metrics_out, VERSION)
+        logging.info("Wrote metrics to %r.", metrics_out)
+
+async def pasta_async(raw_source_paths, output_file, language=None, hide_legend=True,
+                      exclude_namespaces=None, exclude_functions=None,
+                      include_only_namespaces=None, include_only_functions=None,
+                      no_grouping=False, no_trimming=False, skip_parse_errors=False,
+                      lang_params=None, subset_params=None, jobs=1, cache_dir=None,
+                      cache_max_bytes=DEFAULT_MAX_BYTES, lean_json=False,
+                      metrics_out=None, level=logging.INFO):
+    """
+    pasta for asyncio services. The model is built by map_it_async so the
+    external parsers of a run are driven from the event loop. The subset and
+    the output file are made in a thread. Takes the same parameters as pasta
+    except for watch.
+
+    :param list[str] raw_source_paths: file or directory paths
+    :param str|file output_file: path to the output file. SVG/PNG will generate an image.
+    :rtype: None
+    """
+    start_time = time.time()
+
+    if not isinstance(raw_source_paths, list):
+        raw_source_paths = [raw_source_paths]
+    lang_params = lang_params or LanguageParams()
+    exclude_namespaces, exclude_functions, include_only_namespaces, include_only_functions = \
+        _check_filters(exclude_namespaces, exclude_functions,
+                       include_only_namespaces, include_only_functions)
+    if jobs < 0:
+        raise AssertionError("--jobs must be >= 0")
+
+    logging.basicConfig(format="pasta: %(message)s", level=level)
+
+    sources, language = get_sources_and_language(raw_source_paths, language)
+    output_file, output_ext, final_img_filename = _check_output_file(output_file)
+
+    cache = None
+    if cache_dir:
+        cache = AnalysisCache(cache_dir, VERSION, max_bytes=cache_max_bytes)
+
+    metrics = PipelineMetrics()
+    file_groups, all_nodes, edges = await map_it_async(
+        sources, language, no_trimming, exclude_namespaces, exclude_functions,
+        include_only_namespaces, include_only_functions, skip_parse_errors, lang_params,
+        jobs, cache, metrics)
+
+    if subset_params:
+        logging.info("Filtering into subset...")
+
+        def subset():
+            with metrics.stage('subset'):
+                return _filter_for_subset(subset_params, all_nodes, edges, file_groups)
+
+        file_groups, all_nodes, edges = await asyncio.to_thread(subset)
+
+    await asyncio.to_thread(_write_output, output_file, output_ext, final_img_filename,
+                            file_groups, all_nodes, edges, hide_legend, no_grouping,
+                            lean_json, metrics)
+    logging.info("pasta finished processing in %.2f seconds." % (time.time() - start_time))
+
+    if metrics_out:
+        metrics.write(metrics_out, VERSION)
+        logging.info("Wrote metrics to %r.", metrics_out)
 
+def _check_filters(exclude_namespaces, exclude_functions, include_only_namespaces,
+                   include_only_functions):
+    """
+    Default the namespace / function filters of pasta to empty lists.
+
+    :rtype: (list, list, list, list)
+    """
     exclude_namespaces = exclude_namespaces or []
     assert isinstance(exclude_namespaces, list)
     exclude_functions = exclude_functions or []
@@ -773,15 +1463,24 @@ def pasta(raw_source_paths, output_file, language=None, hide_legend=True,
     assert isinstance(include_only_namespaces, list)
     include_only_functions = include_only_functions or []
     assert isinstance(include_only_functions, list)
+    return exclude_namespaces, exclude_functions, include_only_namespaces, include_only_functions
 
-    logging.basicConfig(format="pasta: %(message)s", level=level)
-
-    sources, language = get_sources_and_language(raw_source_paths, language)
+def _check_output_file(output_file):
+    """
+    Work out the format from the output filename. Images are written as a
+    .gv file first and then translated by graphviz.
 
+    :param str|file output_file:
+    :returns: the file to write, its extension and the image to translate it to
+    :rtype: (str|file, str|None, str|None)
+    """
     output_ext = None
     if isinstance(output_file, str):
         assert '.' in output_file, "Output filename must end in one of: %r." % set(VALID_EXTENSIONS)
         output_ext = output_file.rsplit('.', 1)[1] or ''
+        for gzip_ext in GZIP_EXTENSIONS:
+            if output_file.endswith('.' + gzip_ext):
+                output_ext = gzip_ext
         assert output_ext in VALID_EXTENSIONS, "Output filename must end in one of: %r." % \
                                                set(VALID_EXTENSIONS)
 
@@ -794,44 +1493,90 @@ def pasta(raw_source_paths, output_file, language=None, hide_legend=True,
                 "or, if you just want an intermediate text file, set your --output "
                 "file to use a supported text extension: %r" % set(TEXT_EXTENSIONS))
         final_img_filename = output_file
-        output_file, extension = output_file.rsplit('.', 1)
-        output_file += '.gv'
+        output_file = output_file.rsplit('.', 1)[0] + '.gv'
+    return output_file, output_ext, final_img_filename
 
-    file_groups, all_nodes, edges = map_it(sources, language, no_trimming,
-                                           exclude_namespaces, exclude_functions,
-                                           include_only_namespaces, include_only_functions,
-                                           skip_parse_errors, lang_params)
-
-    if subset_params:
-        logging.info("Filtering into subset...")
-        file_groups, all_nodes, edges = _filter_for_subset(subset_params, all_nodes, edges, file_groups)
-
-    file_groups.sort()
-    all_nodes.sort()
-    edges.sort()
+def _write_output(output_file, output_ext, final_img_filename, file_groups, all_nodes, edges,
+                  hide_legend, no_grouping, lean_json, metrics=None):
+    """
+    Write the output file and translate it to an image if that was requested.
+    See pasta for parameters.
 
-    logging.info("Generating output file...")
+    :param PipelineMetrics|None metrics: records the time spent writing and in graphviz
 
-    if isinstance(output_file, str):
-        with open(output_file, 'w') as fh:
-            as_json = output_ext == 'json'
-            write_file(fh, nodes=all_nodes, edges=edges,
+    :rtype: None
+    """
+    metrics = metrics or PipelineMetrics()
+    with metrics.stage('write_output'):
+        file_groups = sorted(file_groups)
+        all_nodes = sorted(all_nodes)
+        edges = sorted(edges)
+
+        logging.info("Generating output file...")
+
+        if isinstance(output_file, str):
+            opener = gzip.open if output_ext in GZIP_EXTENSIONS else open
+            with opener(output_file, 'wt') as fh:
+                write_file(fh, nodes=all_nodes, edges=edges,
+                           groups=file_groups, hide_legend=hide_legend,
+                           no_grouping=no_grouping, as_json=output_ext == 'json',
+                           as_ndjson=output_ext == 'ndjson', lean_json=lean_json)
+        else:
+            write_file(output_file, nodes=all_nodes, edges=edges,
                        groups=file_groups, hide_legend=hide_legend,
-                       no_grouping=no_grouping, as_json=as_json)
-    else:
-        write_file(output_file, nodes=all_nodes, edges=edges,
-                   groups=file_groups, hide_legend=hide_legend,
-                   no_grouping=no_grouping)
+                       no_grouping=no_grouping)
 
     logging.info("Wrote output file %r with %d nodes and %d edges.",
                  output_file, len(all_nodes), len(edges))
-    if not output_ext == 'json':
+    if output_ext not in ('json', 'ndjson'):
         logging.info("For better machine readability, you can also try outputting in a json format.")
-    logging.info("pasta finished processing in %.2f seconds." % (time.time() - start_time))
 
     # translate to an image if that was requested
     if final_img_filename:
-        _generate_final_img(output_file, extension, final_img_filename, len(edges))
+        extension = final_img_filename.rsplit('.', 1)[1]
+        with metrics.stage('graphviz'):
+            _generate_final_img(output_file, extension, final_img_filename, len(edges))
+
+def _watch(raw_source_paths, language, output_file, output_ext, final_img_filename,
+           hide_legend, exclude_namespaces, exclude_functions,
+           include_only_namespaces, include_only_functions, no_grouping,
+           skip_parse_errors, lang_params, jobs, cache, lean_json):
+    """
+    Write the output, then rewrite it every time the sources change until interrupted.
+    See pasta for parameters.
+
+    :rtype: None
+    """
+    model = IncrementalModel(language, exclude_namespaces, exclude_functions,
+                             include_only_namespaces, include_only_functions,
+                             skip_parse_errors, lang_params, jobs, cache)
+    sources, _ = get_sources_and_language(raw_source_paths, language)
+    _write_output(output_file, output_ext, final_img_filename, *model.update(sources),
+                  hide_legend, no_grouping, lean_json)
+
+    watcher = make_watcher(raw_source_paths)
+    logging.info("Watching %r for changes. Press Ctrl+C to stop.", raw_source_paths)
+    try:
+        while True:
+            changed_paths = watcher.wait()
+            start_time = time.time()
+            try:
+                sources, _ = get_sources_and_language(raw_source_paths, language)
+                result = model.update(sources, changed_paths)
+            except Exception as ex:
+                logging.warning("Could not update (%r). Keeping the previous output.", ex)
+                continue
+            # Nothing to do when no source changed. This also ignores writes
+            # to the output file if it is inside a watched directory.
+            if result is None:
+                continue
+            _write_output(output_file, output_ext, final_img_filename, *result,
+                          hide_legend, no_grouping, lean_json)
+            logging.info("pasta updated in %.2f seconds." % (time.time() - start_time))
+    except KeyboardInterrupt:
+        logging.info("Stopped watching.")
+    finally:
+        watcher.close()
 
 def main(sys_argv=None):
     """
@@ -854,15 +1599,15 @@ def main(sys_argv=None):
              'If omitted, use the suffix of the first source file.')
     parser.add_argument(
         '--target-function',
-        help='output a subset of the graph centered on this function. '
+        help='output a subset of the graph centered on these functions. Comma delimited. '
              'Valid formats include `func`, `class.func`, and `file::class.func`. '
              'Requires --upstream-depth and/or --downstream-depth. ')
     parser.add_argument(
-        '--upstream-depth', type=int, default=0,
-        help='include n nodes upstream of --target-function.')
+        '--upstream-depth', type=_depth, default=0,
+        help='include n nodes upstream of --target-function. `all` for no limit.')
     parser.add_argument(
-        '--downstream-depth', type=int, default=0,
-        help='include n nodes downstream of --target-function.')
+        '--downstream-depth', type=_depth, default=0,
+        help='include n nodes downstream of --target-function. `all` for no limit.')
     parser.add_argument(
         '--exclude-functions',
         help='exclude functions from the output. Comma delimited.')
@@ -881,18 +1626,53 @@ def main(sys_argv=None):
     parser.add_argument(
         '--no-trimming', action='store_true',
         help='show all functions/namespaces whether or not they connect to anything.')
+    parser.add_argument(
+        '--lean-json', action='store_true',
+        help='for json / ndjson output, write structured fields (file, qualified '
+             'name, line, args, variables, edge kind) instead of html labels.')
     parser.add_argument(
         '--hide-legend', action='store_true',
         help='by default, pasta generates a small legend. This flag hides it.')
     parser.add_argument(
         '--skip-parse-errors', action='store_true',
         help='skip files that the language parser fails on.')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=1,
+        help='parse files across this many processes. 0 uses one per CPU. For js, php '
+             'and rb, this many parsers run at once instead.')
+    parser.add_argument(
+        '--cache-dir',
+        help='cache the analysis of each file in this directory. Unchanged '
+             'files are not parsed again on the next run.')
+    parser.add_argument(
+        '--cache-max-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help='size limit of --cache-dir in megabytes. The least recently used '
+             'entries are evicted beyond this.')
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='keep running and update the output whenever a source file changes. '
+             'Only the changed files are parsed again.')
+    parser.add_argument(
+        '--metrics-out',
+        help='write the time spent in each stage, counts of what was found and the peak '
+             'memory to this json file. A filename ending in .prom gets a Prometheus textfile.')
+    parser.add_argument(
+        '--profile', choices=PROFILE_MODES,
+        help='profile pasta itself. cpu writes cProfile stats and mem writes the '
+             'functions holding the most memory. See --profile-out.')
+    parser.add_argument(
+        '--profile-out',
+        help='where --profile writes. Defaults to %s for cpu and %s for mem.' % (
+            DEFAULT_OUTPUT['cpu'], DEFAULT_OUTPUT['mem']))
+    parser.add_argument(
+        '--profile-top', type=int, default=DEFAULT_TOP,
+        help='how many functions --profile reports.')
     parser.add_argument(
         '--source-type', choices=['script', 'module'], default='script',
         help='js only. Parse the source as scripts (commonJS) or modules (es6)')
     parser.add_argument(
         '--ruby-version', default='27',
-        help='ruby only. Which ruby version to parse? This is passed directly into ruby-parse. '
+        help='ruby only. Which ruby version to parse? This selects the grammar of the parser gem. '
              'Use numbers like 25, 27, or 31.')
     parser.add_argument(
         '--quiet', '-q', action='store_true',
@@ -904,6 +1684,10 @@ def main(sys_argv=None):
         '--version', action='version', version='%(prog)s ' + VERSION)
 
     sys_argv = sys_argv or sys.argv[1:]
+    if sys_argv and sys_argv[0] == 'serve':
+        from .serve import main as serve_main
+        serve_main(sys_argv[1:])
+        return
     args = parser.parse_args(sys_argv)
     level = logging.INFO
     if args.verbose and args.quiet:
@@ -919,10 +1703,12 @@ def main(sys_argv=None):
     include_only_functions = list(filter(None, (args.include_only_functions or "").split(',')))
 
     lang_params = LanguageParams(args.source_type, args.ruby_version)
-    subset_params = SubsetParams.generate(args.target_function, args.upstream_depth,
+    target_functions = list(filter(None, (args.target_function or "").split(',')))
+    subset_params = SubsetParams.generate(target_functions, args.upstream_depth,
                                           args.downstream_depth)
 
-    pasta(
+    run = functools.partial(
+        pasta,
         raw_source_paths=args.sources,
         output_file=args.output,
         language=args.language,
@@ -932,9 +1718,21 @@ def main(sys_argv=None):
         include_only_namespaces=include_only_namespaces,
         include_only_functions=include_only_functions,
         no_grouping=args.no_grouping,
+        lean_json=args.lean_json,
         no_trimming=args.no_trimming,
         skip_parse_errors=args.skip_parse_errors,
         lang_params=lang_params,
         subset_params=subset_params,
+        jobs=args.jobs,
+        cache_dir=args.cache_dir,
+        cache_max_bytes=args.cache_max_size * 1024 * 1024,
+        watch=args.watch,
+        metrics_out=args.metrics_out,
         level=level,
     )
+    if args.profile:
+        if args.watch:
+            raise AssertionError("--watch can't be combined with --profile")
+        run_profiled(args.profile, run, args.profile_out, args.profile_top)
+    else:
+        run()
@@ -1,9 +1,27 @@
 const fs = require('fs');
+const readline = require('readline');
 const {Parser} = require("acorn")
 
 const sourceType = process.argv[2]
-const src = fs.readFileSync(process.argv[3], 'utf8')
-const tree = Parser.parse(src, {'locations': true, 'sourceType': sourceType,
-                                'ecmaVersion': '2020'})
 
-process.stdout.write(JSON.stringify(tree))
+function parse(filename) {
+    const src = fs.readFileSync(filename, 'utf8')
+    return Parser.parse(src, {'locations': true, 'sourceType': sourceType,
+                              'ecmaVersion': '2020'})
+}
+
+if (process.argv[3] === '--batch') {
+    // One JSON-encoded filename per line in, one JSON response per line out
+    const lines = readline.createInterface({input: process.stdin, terminal: false})
+    lines.on('line', (line) => {
+        let response
+        try {
+            response = JSON.stringify({'tree': parse(JSON.parse(line))})
+        } catch (e) {
+            response = JSON.stringify({'error': String(e)})
+        }
+        process.stdout.write(response + '\n')
+    })
+} else {
+    process.stdout.write(JSON.stringify(parse(process.argv[3])))
+}
@@ -5,9 +5,33 @@ use PhpParser\Error;
 use PhpParser\NodeDumper;
 use PhpParser\ParserFactory;
 
-$code = file_get_contents($argv[1]);
 $parser = (new ParserFactory)->create(ParserFactory::PREFER_PHP7);
 
+if ($argv[1] === '--batch') {
+    // One JSON-encoded filename per line in, one JSON response per line out.
+    // Warnings must not end up in the responses.
+    ini_set('display_errors', 'stderr');
+    while (($line = fgets(STDIN)) !== false) {
+        try {
+            $code = file_get_contents(json_decode($line));
+            if ($code === false) {
+                throw new Exception('Could not read file');
+            }
+            $response = json_encode(['tree' => $parser->parse($code)]);
+            if ($response === false) {
+                throw new Exception(json_last_error_msg());
+            }
+        } catch (Throwable $e) {
+            $response = json_encode(['error' => $e->getMessage()]);
+        }
+        echo $response, "\n";
+        fflush(STDOUT);
+    }
+    exit(0);
+}
+
+$code = file_get_contents($argv[1]);
+
 try {
     $stmts = $parser->parse($code);
     echo json_encode($stmts, JSON_PRETTY_PRINT), "\n";
@@ -0,0 +1,36 @@
+# The same output as `ruby-parse --emit-json --<version> <file>` but with a
+# --batch mode so that many files can be parsed by one ruby process.
+#   ruby get_ast.rb <version> <file>
+#   ruby get_ast.rb <version> --batch
+require 'json'
+
+version = ARGV[0]
+require "parser/ruby#{version}"
+PARSER_CLASS = Parser.const_get("Ruby#{version}")
+# ruby-parse emits the modern AST by default
+Parser::Builders::Default.modernize
+
+def parse(filename)
+  parser = PARSER_CLASS.new
+  parser.diagnostics.all_errors_are_fatal = true
+  parser.diagnostics.ignore_warnings = true
+  buffer = Parser::Source::Buffer.new(filename)
+  buffer.read
+  ast = parser.parse(buffer)
+  ast ? ast.to_sexp_array : nil
+end
+
+if ARGV[1] == '--batch'
+  # One JSON-encoded filename per line in, one JSON response per line out
+  STDOUT.sync = true
+  STDIN.each_line do |line|
+    begin
+      response = JSON.generate({'tree' => parse(JSON.parse(line))})
+    rescue StandardError => e
+      response = JSON.generate({'error' => e.message})
+    end
+    puts response
+  end
+else
+  puts JSON.generate(parse(ARGV[1]))
+end
@@ -0,0 +1,205 @@
+"""
+Adjacency-indexed call graph for subset and reachability queries.
+
+The graph is built once from the nodes and edges that map_it returns. Edges
+are stored CSR-style (compressed sparse rows): every node gets a slice of one
+flat array holding the indexes of the nodes it calls, and another for the nodes
+that call it. Queries then only touch the slices of the nodes they visit
+instead of passing over every edge.
+"""
+
+import array
+import collections
+
+from .model import Node
+
+# Depth for walking as far as the graph goes
+ALL_DEPTHS = float('inf')
+
+
+def _csr(num_nodes, pairs):
+    """
+    :param int num_nodes:
+    :param list[(int, int)] pairs: (from, to) node indexes, one per edge
+    :returns: offsets, neighbours and edge positions. The neighbours of node i
+        are neighbours[offsets[i]:offsets[i + 1]], in edge order.
+    :rtype: (array, array, array)
+    """
+    offsets = array.array('q', bytes(8 * (num_nodes + 1)))
+    for a, _ in pairs:
+        offsets[a + 1] += 1
+    for i in range(num_nodes):
+        offsets[i + 1] += offsets[i]
+
+    fill = array.array('q', offsets)
+    neighbours = array.array('q', bytes(8 * len(pairs)))
+    edge_ids = array.array('q', bytes(8 * len(pairs)))
+    for edge_id, (a, b) in enumerate(pairs):
+        slot = fill[a]
+        fill[a] += 1
+        neighbours[slot] = b
+        edge_ids[slot] = edge_id
+    return offsets, neighbours, edge_ids
+
+
+class CallGraph():
+    """
+    Callers, callees and names of every node, indexed for repeated queries.
+    The graph doesn't follow changes to the nodes or edges it was built from.
+    """
+    def __init__(self, nodes, edges):
+        """
+        :param list[Node] nodes:
+        :param list[Edge] edges:
+        """
+        self.nodes = list(nodes)
+        self.edges = list(edges)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        for edge in self.edges:
+            for node in (edge.node0, edge.node1):
+                if node not in self.index:
+                    self.index[node] = len(self.nodes)
+                    self.nodes.append(node)
+
+        pairs = [(self.index[e.node0], self.index[e.node1]) for e in self.edges]
+        self._callees = _csr(len(self.nodes), pairs)
+        self._callers = _csr(len(self.nodes), [(b, a) for a, b in pairs])
+
+        # Functions can be found by `func`, `class.func` or `file::class.func`.
+        # Their If / Try / loop nodes share those names so they aren't indexed.
+        self.names = collections.defaultdict(list)
+        for i, node in enumerate(self.nodes):
+            if type(node) != Node:
+                continue
+            for name in {node.token, node.token_with_ownership(), node.name()}:
+                self.names[name].append(i)
+
+    def find(self, name):
+        """
+        Nodes matching `func`, `class.func` or `file::class.func`
+
+        :param str name:
+        :rtype: list[Node]
+        """
+        return [self.nodes[i] for i in self.names.get(name, [])]
+
+    def find_one(self, name):
+        """
+        Like find but there must be exactly one match
+
+        :param str name:
+        :rtype: Node
+        """
+        nodes = self.find(name)
+        if not nodes:
+            raise AssertionError("Could not find node %r to build a subset." % name)
+        if len(nodes) > 1:
+            raise AssertionError("Found multiple nodes for %r: %r. Try either a `class.func` or "
+                                 "`filename::class.func`." % (name, nodes))
+        return nodes[0]
+
+    def _neighbours(self, csr, node):
+        offsets, neighbours, _ = csr
+        i = self.index[node]
+        return [self.nodes[j] for j in neighbours[offsets[i]:offsets[i + 1]]]
+
+    def callees(self, node):
+        """
+        :param Node node:
+        :rtype: list[Node]
+        """
+        return self._neighbours(self._callees, node)
+
+    def callers(self, node):
+        """
+        :param Node node:
+        :rtype: list[Node]
+        """
+        return self._neighbours(self._callers, node)
+
+    def _walk(self, csr, starts, depth):
+        """
+        Breadth-first search from all the starts at once
+
+        :param tuple csr:
+        :param set[int] starts: node indexes
+        :param int|float depth: steps to take. ALL_DEPTHS for no limit
+        :rtype: set[int]
+        """
+        offsets, neighbours, _ = csr
+        seen = set(starts)
+        frontier = list(starts)
+        level = 0
+        while frontier and level < depth:
+            next_frontier = []
+            for i in frontier:
+                for j in neighbours[offsets[i]:offsets[i + 1]]:
+                    if j not in seen:
+                        seen.add(j)
+                        next_frontier.append(j)
+            frontier = next_frontier
+            level += 1
+        return seen
+
+    def reachable(self, targets, downstream_depth=0, upstream_depth=0):
+        """
+        The targets along with every node within downstream_depth calls from
+        any of them and every node within upstream_depth calls to any of them.
+
+        :param list[Node] targets:
+        :param int|float downstream_depth: ALL_DEPTHS for no limit
+        :param int|float upstream_depth: ALL_DEPTHS for no limit
+        :rtype: set[Node]
+        """
+        starts = {self.index[node] for node in targets}
+        found = self._walk(self._callees, starts, downstream_depth)
+        found |= self._walk(self._callers, starts, upstream_depth)
+        return {self.nodes[i] for i in found}
+
+    def edges_between(self, nodes):
+        """
+        Edges with both ends in nodes, in their original order
+
+        :param set[Node] nodes:
+        :rtype: list[Edge]
+        """
+        offsets, neighbours, edge_ids = self._callees
+        keep = {self.index[node] for node in nodes if node in self.index}
+        ids = []
+        for i in keep:
+            for slot in range(offsets[i], offsets[i + 1]):
+                if neighbours[slot] in keep:
+                    ids.append(edge_ids[slot])
+        ids.sort()
+        return [self.edges[e] for e in ids]
+
+    def shortest_path(self, source, target):
+        """
+        Fewest calls it takes to get from source to target.
+        When there are several shortest paths, this picks one deterministically.
+
+        :param Node source:
+        :param Node target:
+        :returns: source, ..., target or None if target can't be reached
+        :rtype: list[Node]|None
+        """
+        offsets, neighbours, _ = self._callees
+        start, goal = self.index[source], self.index[target]
+        came_from = {start: None}
+        frontier = [start]
+        while frontier and goal not in came_from:
+            next_frontier = []
+            for i in frontier:
+                for j in neighbours[offsets[i]:offsets[i + 1]]:
+                    if j not in came_from:
+                        came_from[j] = i
+                        next_frontier.append(j)
+            frontier = next_frontier
+        if goal not in came_from:
+            return None
+        path = []
+        i = goal
+        while i is not None:
+            path.append(self.nodes[i])
+            i = came_from[i]
+        return path[::-1]
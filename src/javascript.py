@@ -1,10 +1,10 @@
 import logging
 import os
-import json
 import subprocess
 
 from .model import (Group, Node, Call, Variable, BaseLanguage,
-                    OWNER_CONST, GROUP_TYPE, is_installed, djoin, flatten)
+                    OWNER_CONST, GROUP_TYPE, is_installed, djoin, flatten, iter_preorder)
+from .parser_pool import parse_file
 
 
 def lineno(el):
@@ -21,26 +21,29 @@ def lineno(el):
     return ret
 
 
+def _walk_children(tree):
+    """
+    Elements directly below this one, including those in lists
+    :param ast tree:
+    :rtype: iterator[ast]
+    """
+    values = tree if type(tree) == list else tree.values()
+    for v in values:
+        if type(v) == dict and v.get('type'):
+            yield v
+        elif type(v) == list and type(tree) == dict:
+            for el in v:
+                if type(el) == dict and el.get('type'):
+                    yield el
+
+
 def walk(tree):
     """
-    Walk through the ast tree and return all nodes
+    Walk through the ast tree and yield all nodes below it, depth-first
     :param ast tree:
-    :rtype: list[ast]
+    :rtype: iterator[ast]
     """
-    ret = []
-    if type(tree) == list:
-        for el in tree:
-            if el.get('type'):
-                ret.append(el)
-                ret += walk(el)
-    elif type(tree) == dict:
-        for k, v in tree.items():
-            if type(v) == dict and v.get('type'):
-                ret.append(v)
-                ret += walk(v)
-            if type(v) == list:
-                ret += walk(v)
-    return ret
+    return iter_preorder(_walk_children(tree), _walk_children)
 
 
 def resolve_owner(callee):
@@ -94,15 +97,22 @@ def get_call_from_func_element(func):
     return None
 
 
-def make_calls(body):
+def make_calls_and_variables(tree, parent):
     """
-    Given a list of lines, find all calls in this list.
+    Given the lines of a function, find all calls in them and the variables
+    of the function in one pass. Variables are tokens and what they link to.
+    In this case, what it links to is just a string. However, that is resolved
+    later.
 
-    :param list|dict body:
-    :rtype: list[Call]
+    Also return variables for the outer scope parent
+
+    :param list|dict tree:
+    :param parent Group:
+    :rtype: (list[Call], list[Variable])
     """
     calls = []
-    for element in walk(body):
+    variables = []
+    for element in walk(tree):
         if element['type'] == 'CallExpression':
             call = get_call_from_func_element(element)
             if call:
@@ -110,7 +120,15 @@ def make_calls(body):
         elif element['type'] == 'NewExpression' and element['callee']['type'] == 'Identifier':
             calls.append(Call(token=element['callee']['name'],
                               line_number=lineno(element)))
-    return calls
+        elif element['type'] == 'VariableDeclaration':
+            variables += process_assign(element)
+
+    # Make a 'this' variable for use anywhere we need it that points to the class
+    if tree and isinstance(parent, Group) and parent.group_type == GROUP_TYPE.CLASS:
+        variables.append(Variable('this', parent, lineno(tree)))
+
+    variables = list(filter(None, variables))
+    return calls, variables
 
 
 def process_assign(element):
@@ -171,35 +189,6 @@ def process_assign(element):
     return []
 
 
-def make_local_variables(tree, parent):
-    """
-    Given an ast of all the lines in a function, generate a list of
-    variables in that function. Variables are tokens and what they link to.
-    In this case, what it links to is just a string. However, that is resolved
-    later.
-
-    Also return variables for the outer scope parent
-
-    :param tree list|dict:
-    :param parent Group:
-    :rtype: list[Variable]
-    """
-    if not tree:
-        return []
-
-    variables = []
-    for element in walk(tree):
-        if element['type'] == 'VariableDeclaration':
-            variables += process_assign(element)
-
-    # Make a 'this' variable for use anywhere we need it that points to the class
-    if isinstance(parent, Group) and parent.group_type == GROUP_TYPE.CLASS:
-        variables.append(Variable('this', parent, lineno(tree)))
-
-    variables = list(filter(None, variables))
-    return variables
-
-
 def children(tree):
     """
     The acorn AST is tricky. This returns all the children of an element
@@ -266,12 +255,29 @@ class Javascript(BaseLanguage):
         :param lang_params LanguageParams:
         :rtype: ast
         """
+        tree, error = parse_file(Javascript.parser_command(lang_params), filename)
+        return Javascript.tree_from_parser(filename, tree, error)
+
+    @staticmethod
+    def parser_command(lang_params):
+        """
+        :param lang_params LanguageParams:
+        :rtype: list[str]
+        """
         script_loc = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                                   "get_ast.js")
-        cmd = ["node", script_loc, lang_params.source_type, filename]
-        try:
-            output = subprocess.check_output(cmd, stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError:
+        return ["node", script_loc, lang_params.source_type, "--batch"]
+
+    @staticmethod
+    def tree_from_parser(filename, tree, error):
+        """
+        :param filename str:
+        :param tree dict|None:
+        :param error str|None:
+        :rtype: ast
+        """
+        if error:
+            logging.debug("Acorn error for %r: %s", filename, error)
             raise AssertionError(
                 "Acorn could not parse file %r. You may have a JS syntax error or "
                 "if this is an es6-style source, you may need to run pasta "
@@ -279,8 +285,7 @@ class Javascript(BaseLanguage):
                 "For more detail, try running the command "
                 "\n  acorn %s\n"
                 "Warning: Acorn CANNOT parse all javascript files. See their docs. " %
-                (filename, filename)) from None
-        tree = json.loads(output)
+                (filename, filename))
         assert isinstance(tree, dict)
         assert tree['type'] == 'Program'
         return tree
@@ -350,8 +355,7 @@ class Javascript(BaseLanguage):
             logging.warning("Skipping class defined within a function!")
 
         line_number = lineno(tree)
-        calls = make_calls(this_scope_body)
-        variables = make_local_variables(this_scope_body, parent)
+        calls, variables = make_calls_and_variables(this_scope_body, parent)
         node = Node(token, calls, variables, parent=parent, line_number=line_number,
                     is_constructor=is_constructor)
         subnodes = flatten([Javascript.make_nodes(t, node) for t in subnode_trees])
@@ -369,8 +373,7 @@ class Javascript(BaseLanguage):
         :rtype: Node
         """
         token = "(global)"
-        calls = make_calls(lines)
-        variables = make_local_variables(lines, parent)
+        calls, variables = make_calls_and_variables(lines, parent)
         root_node = Node(token, calls, variables,
                          line_number=0, parent=parent)
         return root_node
@@ -0,0 +1,151 @@
+"""
+What each stage of the pipeline costs, for --metrics-out.
+
+The report is json or, if the filename ends in .prom, a Prometheus textfile
+that node_exporter's textfile collector can pick up.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+from . import profiling
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROMETHEUS_EXTENSION = '.prom'
+
+# Descriptions of the counts that map_it records, in report order
+COUNTS = {
+    'files': "Source files passed to pasta.",
+    'groups': "Files, classes and other namespaces found.",
+    'nodes': "Function and control flow nodes found.",
+    'calls': "Calls found inside of functions.",
+    'variables': "Variables found inside of functions.",
+    'resolved_calls': "Calls linked to exactly one function.",
+    'ambiguous_calls': "Calls skipped because they matched several functions.",
+}
+
+
+def _cpu_time():
+    """
+    CPU time of this process and of the child processes it has waited for.
+    That covers --jobs workers but not the JS / PHP / Ruby parsers, which
+    keep running until pasta exits.
+
+    :rtype: float
+    """
+    children = os.times()
+    return time.process_time() + children.children_user + children.children_system
+
+
+def peak_rss_bytes():
+    """
+    :returns: the most memory this process has had resident, if the platform says
+    :rtype: int|None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PipelineMetrics():
+    """
+    Wall and CPU time spent in each named stage, in the order the stages first
+    ran, along with counts of what was found. Running a stage again adds to
+    its time.
+    """
+    def __init__(self):
+        self.wall_seconds = {}
+        self.cpu_seconds = {}
+        self.counts = {}
+        self.edges_by_kind = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        :param str name:
+        """
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_time()
+        try:
+            yield
+        finally:
+            self.wall_seconds[name] = (self.wall_seconds.get(name, 0.0)
+                                       + time.perf_counter() - wall_start)
+            self.cpu_seconds[name] = self.cpu_seconds.get(name, 0.0) + _cpu_time() - cpu_start
+            profiling.checkpoint(name)
+
+    def to_dict(self, version):
+        """
+        :param str version: pasta version
+        :rtype: dict
+        """
+        return {
+            'pasta_version': version,
+            'stages': {name: {'wall_seconds': seconds,
+                              'cpu_seconds': self.cpu_seconds[name]}
+                       for name, seconds in self.wall_seconds.items()},
+            'counts': dict(self.counts),
+            'edges_by_kind': dict(self.edges_by_kind),
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+
+    def to_prometheus(self, version):
+        """
+        :param str version: pasta version
+        :rtype: str
+        """
+        report = self.to_dict(version)
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append('# HELP pasta_%s %s' % (name, help_text))
+            lines.append('# TYPE pasta_%s gauge' % name)
+            for labels, value in samples:
+                label_str = ','.join('%s="%s"' % (k, v) for k, v in labels)
+                lines.append('pasta_%s%s %r' % (name, '{%s}' % label_str if label_str else '',
+                                                value))
+
+        metric('info', "Version of pasta that wrote these metrics.",
+               [((('version', version),), 1)])
+        metric('stage_wall_seconds', "Wall time spent in each stage.",
+               [((('stage', name),), stage['wall_seconds'])
+                for name, stage in report['stages'].items()])
+        metric('stage_cpu_seconds', "CPU time spent in each stage.",
+               [((('stage', name),), stage['cpu_seconds'])
+                for name, stage in report['stages'].items()])
+        for name, help_text in COUNTS.items():
+            if name in report['counts']:
+                metric(name, help_text, [((), report['counts'][name])])
+        metric('edges', "Edges in the output by kind.",
+               [((('kind', kind),), num) for kind, num in report['edges_by_kind'].items()])
+        if report['peak_rss_bytes'] is not None:
+            metric('peak_rss_bytes', "Most memory pasta had resident.",
+                   [((), report['peak_rss_bytes'])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename, version):
+        """
+        Write the report as json or, for .prom files, as a Prometheus textfile.
+        The file is replaced in one step so that collectors never read half of it.
+
+        :param str filename:
+        :param str version: pasta version
+        :rtype: None
+        """
+        if filename.endswith(PROMETHEUS_EXTENSION):
+            content = self.to_prometheus(version)
+        else:
+            content = json.dumps(self.to_dict(version), indent=2) + '\n'
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(content)
+        os.replace(tmp_filename, filename)
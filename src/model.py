@@ -1,5 +1,12 @@
 import abc
+import collections
+import functools
+import hashlib
+import html
+import io
+import itertools
 import os
+import sys
 import ast
 
 TRUNK_COLOR = '#966F33'
@@ -23,6 +30,124 @@ class Namespace(dict):
 
 OWNER_CONST = Namespace("UNKNOWN_VAR", "UNKNOWN_MODULE")
 GROUP_TYPE = Namespace("FILE", "CLASS", "NAMESPACE")
+EDGE_KIND = Namespace("CALL", "DETAIL", "IF_TRUE", "IF_FALSE", "IF_CONT",
+                      "TRY_BODY", "EXCEPT", "TRY_CONT",
+                      "RETURN", "BREAK", "CONTINUE", "LOOP_BACK")
+
+_placeholder_uids = itertools.count()
+
+# Marks the end of an iterator in iter_preorder
+_EXHAUSTED = object()
+
+# Bumped whenever any group gains or loses a node or subgroup.
+# Group.all_nodes() and Group.all_groups() are cached for one generation.
+# Drawn from a counter because file groups can be built in several threads.
+_tree_generations = itertools.count()
+_tree_generation = next(_tree_generations)
+
+def _tree_changed():
+    global _tree_generation
+    _tree_generation = next(_tree_generations)
+
+def _intern(token):
+    """
+    Tokens repeat across thousands of nodes, variables and calls (self,
+    __init__, common method names). Interning keeps one copy of each.
+
+    :param str|None token:
+    :rtype: str|None
+    """
+    if type(token) == str:
+        return sys.intern(token)
+    return token
+
+def placeholder_uid(prefix='node'):
+    """
+    A uid that is only unique within this process. make_file_group replaces
+    these with stable uids. See assign_stable_uids.
+
+    :param str prefix:
+    :rtype: str
+    """
+    return '%s_%x' % (prefix, next(_placeholder_uids))
+
+def make_stable_uid(prefix, parts, taken):
+    """
+    Derive a uid from parts. If it is already taken (a hash collision), derive
+    another one with a salt until it isn't.
+
+    :param str prefix:
+    :param tuple parts: strs, ints and Nones
+    :param set[str] taken: uids in use. The new uid is added to it.
+    :rtype: str
+    """
+    for salt in itertools.count():
+        digest = hashlib.blake2b(repr(parts + (salt,)).encode(), digest_size=8).hexdigest()
+        uid = prefix + '_' + digest
+        if uid not in taken:
+            taken.add(uid)
+            return uid
+
+def _qualified_token(obj):
+    tokens = []
+    while obj is not None:
+        tokens.append(obj.token)
+        obj = obj.parent
+    return '.'.join(reversed(tokens))
+
+def assign_stable_uids(file_group, path):
+    """
+    Replace every uid in the file group with one derived from the file path,
+    the qualified name, the line and the branch. Objects that would share all
+    of those are told apart by the order they appear in.
+    The same source therefore always gets the same uids.
+
+    :param Group file_group:
+    :param str path: path of the source file
+    :rtype: None
+    """
+    path = os.path.normpath(path)
+    mapping = {}
+    taken = set()
+    occurrences = collections.Counter()
+    for group in file_group.all_groups():
+        key = ('Group', _qualified_token(group), group.line_number)
+        occurrences[key] += 1
+        mapping[group.uid] = make_stable_uid('cluster', (path,) + key + (occurrences[key],), taken)
+    for node in file_group.all_nodes():
+        if type(node) == Node:
+            key = ('Node', _qualified_token(node), node.line_number, node.branch)
+        else:
+            key = (type(node).__name__, _qualified_token(node), node.lineno, None)
+        occurrences[key] += 1
+        mapping[node.uid] = make_stable_uid('node', (path,) + key + (occurrences[key],), taken)
+    remap_uids(file_group, mapping)
+
+def remap_uids(file_group, mapping):
+    """
+    Change uids along with every reference to them in the file group.
+    Uids not in mapping are left alone.
+
+    :param Group file_group:
+    :param dict[str, str] mapping: old uid -> new uid
+    :rtype: None
+    """
+    for group in file_group.all_groups():
+        group.uid = mapping.get(group.uid, group.uid)
+    for node in file_group.all_nodes():
+        node.uid = mapping.get(node.uid, node.uid)
+        if type(node) == Node:
+            node.detailNode = mapping.get(node.detailNode, node.detailNode)
+            node.jumpID = mapping.get(node.jumpID, node.jumpID)
+        elif type(node) == IfNode:
+            node.ifTrueID = mapping.get(node.ifTrueID, node.ifTrueID)
+            node.ifFalseID = mapping.get(node.ifFalseID, node.ifFalseID)
+            node.ifContID = mapping.get(node.ifContID, node.ifContID)
+        elif type(node) == TryNode:
+            node.tryBodyID = mapping.get(node.tryBodyID, node.tryBodyID)
+            if node.exceptBodyIDs is not None:
+                node.exceptBodyIDs = [mapping.get(u, u) for u in node.exceptBodyIDs]
+            node.tryContID = mapping.get(node.tryContID, node.tryContID)
 
 def is_installed(executable_cmd):
     """
@@ -55,26 +180,69 @@ def flatten(list_of_lists):
     """
     return [el for sublist in list_of_lists for el in sublist]
 
-def _resolve_str_variable(variable, file_groups):
+def iter_preorder(roots, children):
     """
-    String variables are when variable.points_to is a string
-    This happens ONLY when we have imports that we delayed processing for
+    Yield every root and everything below it, depth-first with each element
+    before its children, in the same order as a recursive walk. This keeps an
+    explicit stack so deeply nested trees don't hit the recursion limit.
 
-    This function looks through all files to see if any particular node matches
-    the variable.points_to string
+    :param iterable roots:
+    :param function children: returns the children of an element
+    :rtype: iterator
+    """
+    stack = [iter(roots)]
+    while stack:
+        el = next(stack[-1], _EXHAUSTED)
+        if el is _EXHAUSTED:
+            stack.pop()
+            continue
+        yield el
+        stack.append(iter(children(el)))
+
+def make_import_index(file_groups):
+    """
+    Map every import token to the node or group that it refers to.
+    When more than one matches, the first wins in the same order that a
+    search would find it: file by file, nodes before groups.
 
-    :param Variable variable:
     :param list[Group] file_groups:
-    :rtype: Node|Group|str
+    :rtype: dict[str, Node|Group]
     """
+    import_index = {}
     for file_group in file_groups:
         for node in file_group.all_nodes():
-            if any(ot == variable.points_to for ot in node.import_tokens):
-                return node
+            for token in node.import_tokens:
+                import_index.setdefault(token, node)
         for group in file_group.all_groups():
-            if any(ot == variable.points_to for ot in group.import_tokens):
-                return group
-    return OWNER_CONST.UNKNOWN_MODULE
+            for token in group.import_tokens:
+                import_index.setdefault(token, group)
+    return import_index
+
+def make_group_index(file_groups):
+    """
+    Map every group token to the group that constructor calls with that token
+    resolve to. When more than one matches, the last one wins, file by file.
+
+    :param list[Group] file_groups:
+    :rtype: dict[str, Group]
+    """
+    return {group.token: group
+            for file_group in file_groups
+            for group in file_group.all_groups()}
+
+def _resolve_str_variable(variable, import_index):
+    """
+    String variables are when variable.points_to is a string
+    This happens ONLY when we have imports that we delayed processing for
+
+    This function looks up the node which the variable.points_to string
+    was imported as
+
+    :param Variable variable:
+    :param dict[str, Node|Group] import_index: from make_import_index
+    :rtype: Node|Group|str
+    """
+    return import_index.get(variable.points_to, OWNER_CONST.UNKNOWN_MODULE)
 
 class BaseLanguage(abc.ABC):
     """
@@ -101,6 +269,19 @@ class BaseLanguage(abc.ABC):
         :rtype: Tree
         """
 
+    @staticmethod
+    def parser_command(lang_params):
+        """
+        Command that starts this language's external parser in --batch mode.
+        None for languages that are parsed in-process. Languages with a command
+        also have `tree_from_parser(filename, tree, error)`, which checks what
+        the parser returned for a file and gives the tree to process.
+
+        :param lang_params LanguageParams:
+        :rtype: list[str]|None
+        """
+        return None
+
     @staticmethod
     @abc.abstractmethod
     def separate_namespaces(tree):
@@ -136,12 +317,67 @@ class BaseLanguage(abc.ABC):
         :rtype: Group
         """
 
+# Templates for Node labels. See Node.label
+_LABEL_TEMPLATE = """<<TABLE BGCOLOR='WHITE' CELLSPACING='0' CELLPADDING='10' BORDER='0'>
+                    <TR>%(name_cell)s%(line_cell)s%(details)s</TABLE>>"""
+_LABEL_NAME_CELL = "<TD COLSPAN='1' ALIGN='left' BORDER='1' SIDES='TLB'><B>%(name)s</B></TD>"
+_LABEL_BRANCH_NAME_CELL = ("<TD BGCOLOR='WHITE' COLSPAN='1' ALIGN='left' BORDER='1' SIDES='TLB'>"
+                           "<B><FONT COLOR='%(color)s'>%(branch)s</FONT></B><BR ALIGN='left'/>%(name)s</TD>")
+_LABEL_ICON_LINE_CELL = """<TD BGCOLOR='WHITE' ALIGN='right' BORDER='1' SIDES='TBR'>
+                                <TABLE BORDER='0'>
+                                    <TR><TD ALIGN='right'><IMG SRC='assets/%(icon)s'/></TD></TR>
+                                    <TR><TD ALIGN='right'>Ln: %(line)s</TD></TR>
+                                </TABLE>
+                        </TD></TR>"""
+_LABEL_LINE_CELL = "<TD BGCOLOR='WHITE' ALIGN='right' BORDER='1' SIDES='TBR'>Ln: %(line)s</TD></TR>"
+_LABEL_ARGS_AND_VARIABLES = """<TR>       
+                                <TD ALIGN='TEXT' BORDER='1'><B>Arguments:</B></TD>
+                                <TD ALIGN='TEXT' BORDER='1'><B>Variables:</B></TD>
+                            </TR>
+                            <TR>        
+                                <TD BORDER='1' COLSPAN='1' VALIGN='TOP'>%(args)s</TD><TD BORDER='1' VALIGN='TOP'>%(variables)s</TD>
+                        </TR>"""
+_LABEL_LIST = """<TR>       
+                                <TD COLSPAN='2' ALIGN='TEXT' BORDER='1'><B>%(title)s:</B></TD>
+                            </TR>
+                            <TR>        
+                                <TD COLSPAN='2' VALIGN='TOP' BORDER='1'>%(rows)s</TD>
+                        </TR>"""
+_LABEL_ROW = "<BR ALIGN='LEFT'/>"
+
+def _escape(value):
+    """
+    Escape a value for a graphviz HTML label
+    :param value:
+    :rtype: str
+    """
+    return html.escape(str(value), quote=False)
+
+@functools.lru_cache(maxsize=1 << 16)
+def _label_row(token):
+    """
+    Argument and variable names repeat across many labels so each row is
+    escaped once and reused.
+    :param str token:
+    :rtype: str
+    """
+    return _escape(token) + _LABEL_ROW
+
+def _label_rows(values):
+    """
+    :param iterable values:
+    :rtype: str
+    """
+    return ''.join([_label_row(str(v)) for v in values])
+
 class Variable():
     """
     Variables represent named tokens that are accessible to their scope.
     They may either point to a string or, once resolved, a Group/Node.
     Not all variables can be resolved
     """
+    __slots__ = ('token', 'points_to', 'line_number')
+
     def __init__(self, token, points_to, line_number=None):
         """
         :param str token:
@@ -150,7 +386,7 @@ class Variable():
         """
         assert token
         assert points_to
-        self.token = token
+        self.token = _intern(token)
         self.points_to = points_to
         self.line_number = line_number
 
@@ -166,6 +402,26 @@ class Variable():
             return f'{self.token}->{self.points_to.token}'
         return f'{self.token}->{self.points_to}'
 
+    def to_lean_dict(self):
+        """
+        Output for lean json files. Resolved variables point to a node uid
+        or a group token.
+        :rtype: dict
+        """
+        if isinstance(self.points_to, Node):
+            points_to = self.points_to.uid
+        elif isinstance(self.points_to, Group):
+            points_to = self.points_to.token
+        elif isinstance(self.points_to, Call):
+            points_to = self.points_to.to_string()
+        else:
+            points_to = self.points_to
+        return {
+            'token': self.token,
+            'points_to': points_to,
+            'line': self.line_number,
+        }
+
 class Call():
     """
     calls represent function call expressions.
@@ -175,9 +431,11 @@ class Call():
         do_something()
 
     """
+    __slots__ = ('token', 'owner_token', 'line_number', 'definite_constructor')
+
     def __init__(self, token, line_number=None, owner_token=None, definite_constructor=False):
-        self.token = token
-        self.owner_token = owner_token
+        self.token = _intern(token)
+        self.owner_token = _intern(owner_token)
         self.line_number = line_number
         self.definite_constructor = definite_constructor
 
@@ -250,25 +508,54 @@ class Call():
         return None
 
 class Node():
+    """
+    Nodes are what ends up on the graph. There are many of them so every
+    attribute is a slot and whatever doesn't change after parsing (calls, args,
+    import_tokens) is a tuple. Empty ones all share the same () and inherited
+    variables are shared between the nodes of a class. See _resolve_inherits.
+
+    Memory budget, measured with benchmarks/bench_memory.py: a finished model
+    keeps about 1.6KB per node, counting its share of groups, variables, calls
+    and edges. map_it peaks at about 9.5KB per node while it runs, most of
+    which is the ASTs.
+    """
+    __slots__ = ('token', 'nodeName', 'args', 'line_number', 'variables', 'calls',
+                 'import_tokens', 'parent', 'is_constructor', 'detailNode', 'branch',
+                 'jumpID', 'jumpKind', 'uid', '_name', '_qualified_name', 'is_leaf', 'is_trunk',
+                 '_label', '_label_state', '_label_variables')
+
     def __init__(self, token, nodeName, calls, variables, parent, import_tokens=None,
-                 line_number=None, is_constructor=False, args=[], detailNode=None, branch=None, uid=None):
-        self.token = token
+                 line_number=None, is_constructor=False, args=(), detailNode=None, branch=None, uid=None,
+                 jumpID=None, jumpKind=None):
+        self.token = _intern(token)
         self.nodeName = nodeName
-        self.args = args
+        self.args = tuple(args)
         self.line_number = line_number
         self.variables = variables
-        self.calls = calls
-        self.import_tokens = import_tokens or []
+        self.calls = tuple(calls)
+        self.import_tokens = import_tokens or ()
         self.parent = parent
         self.is_constructor = is_constructor
         self.detailNode = detailNode
         self.branch = branch
+        # Where the flow goes instead of falling through. See build_blocks
+        self.jumpID = jumpID
+        self.jumpKind = jumpKind
 
         if uid == None:
-            self.uid = "node_" + os.urandom(4).hex()
+            self.uid = placeholder_uid()
         else:
             self.uid = uid
 
+        # Set once this is added to a group. See cache_names
+        self._name = None
+        self._qualified_name = None
+
+        # Set by label()
+        self._label = None
+        self._label_state = None
+        self._label_variables = None
+
         # Assume it is a leaf and a trunk. These are modified later
         self.is_leaf = True  # it calls nothing else
         self.is_trunk = True  # nothing calls it
@@ -277,15 +564,28 @@ class Node():
         return f"<Node token={self.token} parent={self.parent}>"
 
     def __lt__(self, other):
-            return self.name() < other.name()
+        return self.name() < other.name()
 
     def name(self):
         """
         Names exist largely for unit tests and deterministic node sorting
         :rtype: str
         """
+        if self._name is not None:
+            return self._name
         return f"{self.first_group().filename()}::{self.token_with_ownership()}"
 
+    def cache_names(self):
+        """
+        Compute name() and token_with_ownership() once. Groups call this when
+        the node is added. The parent chain is fixed from then on, including
+        after remove_from_parent, so these never go stale.
+        :rtype: None
+        """
+        self._name = self._qualified_name = None
+        self._qualified_name = self.token_with_ownership()
+        self._name = self.name()
+
     def first_group(self):
         """
         The first group that contains this node.
@@ -320,6 +620,8 @@ class Node():
         Token which includes what group this is a part of
         :rtype: str
         """
+        if self._qualified_name is not None:
+            return self._qualified_name
         if self.is_attr():
             return djoin(self.parent.token, self.token)
         return self.token
@@ -346,93 +648,64 @@ class Node():
             style = 'orange'
         elif self.branch == 'EXCEPT':
             style = 'red'
+        elif self.branch in ('LOOP', 'CASE'):
+            style = 'green'
+        elif self.branch == 'LOOP ELSE':
+            style = 'red'
         else:
             style = 'black'
 
         return style
 
     def label(self):
-        
         """
-        Labels are what you see on the graph
+        Labels are what you see on the graph. They are rendered once and
+        reused until the node changes in a way that shows up in them:
+        an edge to or from it (is_leaf / is_trunk) or new variables.
+        :rtype: str
+        """
+        state = (self.is_leaf, self.is_trunk, len(self.variables))
+        if self._label is None or self._label_state != state \
+           or self._label_variables is not self.variables:
+            self._label = self._render_label()
+            self._label_state = state
+            self._label_variables = self.variables
+        return self._label
+
+    def _render_label(self):
+        """
+        Fill in the label templates. Everything substituted in is escaped first.
         :rtype: str
         """
         if self.line_number != None:
-            tbl = f"""<<TABLE BGCOLOR='WHITE' CELLSPACING='0' CELLPADDING='10' BORDER='0'>
-                    <TR>"""
-                        
+            name = _escape(self.nodeName)
             if self.branch == None:
-                tbl += f"""<TD COLSPAN='1' ALIGN='left' BORDER='1' SIDES='TLB'><B>{self.nodeName}</B></TD>"""
+                name_cell = _LABEL_NAME_CELL % {'name': name}
             else:
-                tbl += f"""<TD BGCOLOR='WHITE' COLSPAN='1' ALIGN='left' BORDER='1' SIDES='TLB'><B><FONT COLOR='{self.branchStyle()}'>{self.branch}</FONT></B><BR ALIGN='left'/>{self.nodeName}</TD>"""
-                
-            if self.is_trunk:
-                tbl += f"""<TD BGCOLOR='WHITE' ALIGN='right' BORDER='1' SIDES='TBR'>
-                                <TABLE BORDER='0'>
-                                    <TR><TD ALIGN='right'><IMG SRC='assets/trunk.png'/></TD></TR>
-                                    <TR><TD ALIGN='right'>Ln: {self.line_number}</TD></TR>
-                                </TABLE>
-                        </TD></TR>"""
+                name_cell = _LABEL_BRANCH_NAME_CELL % {
+                    'color': self.branchStyle(), 'branch': _escape(self.branch), 'name': name}
 
+            if self.is_trunk:
+                line_cell = _LABEL_ICON_LINE_CELL % {'icon': 'trunk.png', 'line': self.line_number}
             elif self.is_leaf:
-                tbl += f"""<TD BGCOLOR='WHITE' ALIGN='right' BORDER='1' SIDES='TBR'>
-                                <TABLE BORDER='0'>
-                                    <TR><TD ALIGN='right'><IMG SRC='assets/green.png'/></TD></TR>
-                                    <TR><TD ALIGN='right'>Ln: {self.line_number}</TD></TR>
-                                </TABLE>
-                        </TD></TR>"""
-
+                line_cell = _LABEL_ICON_LINE_CELL % {'icon': 'green.png', 'line': self.line_number}
             else:
-                tbl += f"""<TD BGCOLOR='WHITE' ALIGN='right' BORDER='1' SIDES='TBR'>Ln: {self.line_number}</TD></TR>"""
-
-
-            if self.variables != [] and self.args != []:
-                tbl += """<TR>       
-                                <TD ALIGN='TEXT' BORDER='1'><B>Arguments:</B></TD>
-                                <TD ALIGN='TEXT' BORDER='1'><B>Variables:</B></TD>
-                            </TR>
-                            <TR>        
-                                <TD BORDER='1' COLSPAN='1' VALIGN='TOP'>"""
-
-                for arg in self.args:
-                    tbl += f"""{arg.arg}<BR ALIGN='LEFT'/>"""
-
-                tbl += """</TD><TD BORDER='1' VALIGN='TOP'>"""
-
-                for var in self.variables:
-                    tbl += f"""{var.token}<BR ALIGN='LEFT'/>"""
-
-                tbl += """</TD>
-                        </TR>"""
-
-            elif self.variables != []:
-                tbl += """<TR>       
-                                <TD COLSPAN='2' ALIGN='TEXT' BORDER='1'><B>Variables:</B></TD>
-                            </TR>
-                            <TR>        
-                                <TD COLSPAN='2' VALIGN='TOP' BORDER='1'>"""
-
-                for var in self.variables:
-                    tbl += f"""{var.token}<BR ALIGN='LEFT'/>"""
-
-                tbl += """</TD>
-                        </TR>"""
-
-            elif self.args != []:
-                tbl += """<TR>       
-                                <TD COLSPAN='2' ALIGN='TEXT' BORDER='1'><B>Arguments:</B></TD>
-                            </TR>
-                            <TR>        
-                                <TD COLSPAN='2' VALIGN='TOP' BORDER='1'>"""
-
-                for arg in self.args:
-                    tbl += f"""{arg.arg}<BR ALIGN='LEFT'/>"""
-
-                tbl += """</TD>
-                        </TR>"""
-
-            tbl += """</TABLE>>"""
+                line_cell = _LABEL_LINE_CELL % {'line': self.line_number}
+
+            if self.variables and self.args:
+                details = _LABEL_ARGS_AND_VARIABLES % {
+                    'args': _label_rows(self.args),
+                    'variables': _label_rows([v.token for v in self.variables])}
+            elif self.variables:
+                details = _LABEL_LIST % {
+                    'title': 'Variables', 'rows': _label_rows([v.token for v in self.variables])}
+            elif self.args:
+                details = _LABEL_LIST % {'title': 'Arguments', 'rows': _label_rows(self.args)}
+            else:
+                details = ''
 
+            tbl = _LABEL_TEMPLATE % {'name_cell': name_cell, 'line_cell': line_cell,
+                                     'details': details}
             return tbl.strip('"')
                 
         return f"{self.token}()"
@@ -443,6 +716,7 @@ class Node():
         :rtype: None
         """
         self.first_group().nodes = [n for n in self.first_group().nodes if n != self]
+        _tree_changed()
 
     def get_variables(self, line_number=None):
         """
@@ -463,17 +737,24 @@ class Node():
             parent = parent.parent
         return ret
 
-    def resolve_variables(self, file_groups):
+    def resolve_variables(self, file_groups, import_index=None, group_index=None):
         """
         For all variables, attempt to resolve the Node/Group on points_to.
         There is a good chance this will be unsuccessful.
 
         :param list[Group] file_groups:
+        :param dict[str, Node|Group]|None import_index: from make_import_index.
+            Pass it in when resolving many nodes against the same file_groups.
+        :param dict[str, Group]|None group_index: from make_group_index. Same.
         :rtype: None
         """
+        if import_index is None:
+            import_index = make_import_index(file_groups)
+        if group_index is None:
+            group_index = make_group_index(file_groups)
         for variable in self.variables:
             if isinstance(variable.points_to, str):
-                variable.points_to = _resolve_str_variable(variable, file_groups)
+                variable.points_to = _resolve_str_variable(variable, import_index)
             elif isinstance(variable.points_to, Call):
                 # else, this is a call variable
                 call = variable.points_to
@@ -481,11 +762,9 @@ class Node():
                 if call.is_attr() and not call.definite_constructor:
                     continue
                 # Else, assume the call is a constructor.
-                # iterate through to find the right group
-                for file_group in file_groups:
-                    for group in file_group.all_groups():
-                        if group.token == call.token:
-                            variable.points_to = group
+                # find the right group
+                if call.token in group_index:
+                    variable.points_to = group_index[call.token]
             else:
                 assert isinstance(variable.points_to, (Node, Group))
 
@@ -528,9 +807,30 @@ class Node():
             'name': self.name(),
         }
 
+    def to_lean_dict(self):
+        """
+        Output for lean json files. Structured fields instead of the label markup
+        :rtype: dict
+        """
+        return {
+            'uid': self.uid,
+            'kind': 'FUNCTION',
+            'name': self.name(),
+            'file': self.first_group().filename(),
+            'qualified_name': self.token_with_ownership(),
+            'line': self.line_number,
+            'branch': self.branch,
+            'args': list(self.args),
+            'variables': [v.to_lean_dict() for v in self.variables],
+        }
+
 class IfNode():
+    __slots__ = ('token', 'nodeName', 'condition', 'ifTrueID', 'ifFalseID', 'ifContID',
+                 'parent', 'lineno', 'import_tokens', 'uid', '_name', '_qualified_name',
+                 'is_leaf', 'is_trunk')
+
     def __init__(self, token, nodeName, condition, ifTrueID, parent, ifFalseID=None, ifContID=None, uid=None, lineno=None, import_tokens=None):
-        self.token = token
+        self.token = _intern(token)
         self.nodeName = nodeName
         self.condition = condition
         self.ifTrueID = ifTrueID
@@ -538,13 +838,17 @@ class IfNode():
         self.ifContID = ifContID
         self.parent = parent
         self.lineno = lineno
-        self.import_tokens = import_tokens or []
+        self.import_tokens = import_tokens or ()
 
         if uid == None:
-            self.uid = "node_" + os.urandom(4).hex()
+            self.uid = placeholder_uid()
         else:
             self.uid = uid
 
+        # Set once this is added to a group. See cache_names
+        self._name = None
+        self._qualified_name = None
+
         # Assume it is a leaf and a trunk. These are modified later
         self.is_leaf = True  # it calls nothing else
         self.is_trunk = True  # nothing calls it
@@ -557,33 +861,56 @@ class IfNode():
         Labels are what you see on the graph
         :rtype: str
         """
-        tbl = f"""<<TABLE CELLSPACING='0' CELLPADDING='4' BORDER='1'>
-                    <TR>
-                        <TD COLSPAN='1' ALIGN='LEFT' BORDER='0'><B>IF STATEMENT ID: {self.token}</B></TD>
-                    </TR>
-                    <TR>
-                        <TD COLSPAN='1' ALIGN='LEFT' BORDER='0'><B>IF TRUE ID: {self.ifTrueID}</B></TD>
-                    </TR>
-                    <TR>
-                        <TD COLSPAN='1' ALIGN='LEFT' BORDER='0'><B>IF FALSE ID: {self.ifFalseID}</B></TD>
-                    </TR>
-                    <TR>
-                        <TD COLSPAN='1' ALIGN='LEFT' BORDER='0'><B>IF CONT ID: {self.ifContID}</B></TD>
-                    </TR>
-                </TABLE>>"""
-        
-
-        lbl = f"IF &#92;n {self.condition} &#92;n Ln: {self.lineno}"
+        lbl = f"{self.nodeName} &#92;n {self.condition} &#92;n Ln: {self.lineno}"
         
         return lbl
 
+    def to_dict(self):
+        """
+        Output for json files (json graph specification)
+        :rtype: dict
+        """
+        return {
+            'uid': self.uid,
+            'label': self.label(),
+            'name': self.name(),
+        }
+
+    def to_lean_dict(self):
+        """
+        Output for lean json files. Structured fields instead of the label markup
+        :rtype: dict
+        """
+        return {
+            'uid': self.uid,
+            'kind': self.nodeName,
+            'name': self.name(),
+            'file': self.first_group().filename(),
+            'qualified_name': self.token_with_ownership(),
+            'line': self.lineno,
+            'condition': self.condition,
+        }
+
     def name(self):
         """
         Names exist largely for unit tests and deterministic node sorting
         :rtype: str
         """
+        if self._name is not None:
+            return self._name
         return f"{self.first_group().filename()}::{self.token_with_ownership()}"
 
+    def cache_names(self):
+        """
+        Compute name() and token_with_ownership() once. Groups call this when
+        the node is added. The parent chain is fixed from then on, including
+        after remove_from_parent, so these never go stale.
+        :rtype: None
+        """
+        self._name = self._qualified_name = None
+        self._qualified_name = self.token_with_ownership()
+        self._name = self.name()
+
     def first_group(self):
         """
         The first group that contains this node.
@@ -600,6 +927,7 @@ class IfNode():
         :rtype: None
         """
         self.first_group().nodes = [n for n in self.first_group().nodes if n != self]
+        _tree_changed()
 
     def to_dot(self):
         """
@@ -621,10 +949,9 @@ class IfNode():
 
         ret = self.uid + ' ['
         for k, v in attributes.items():
-            if k == 'label':
-                ret += f'{k}="{v}" '
-            else:
-                ret += f'{k}="{v}" '
+            # conditions can have quotes e.g. `case "a":`
+            v = str(v).replace('"', '\\"')
+            ret += f'{k}="{v}" '
         ret += ']'
         return ret
 
@@ -633,6 +960,8 @@ class IfNode():
         Token which includes what group this is a part of
         :rtype: str
         """
+        if self._qualified_name is not None:
+            return self._qualified_name
         if self.is_attr():
             return djoin(self.parent.token, self.token)
         return self.token
@@ -647,21 +976,29 @@ class IfNode():
                 and self.parent.group_type in (GROUP_TYPE.CLASS, GROUP_TYPE.NAMESPACE))
 
 class TryNode():
+    __slots__ = ('token', 'nodeName', 'tryBodyID', 'exceptBodyIDs', 'tryContID',
+                 'parent', 'lineno', 'import_tokens', 'uid', '_name', '_qualified_name',
+                 'is_leaf', 'is_trunk')
+
     def __init__(self, token, nodeName, tryBodyID, parent, exceptBodyIDs=None, tryContID=None, uid=None, lineno=None, import_tokens=None):
-        self.token = token
+        self.token = _intern(token)
         self.nodeName = nodeName
         self.tryBodyID = tryBodyID
         self.exceptBodyIDs = exceptBodyIDs
         self.tryContID = tryContID
         self.parent = parent
         self.lineno = lineno
-        self.import_tokens = import_tokens or []
+        self.import_tokens = import_tokens or ()
 
         if uid == None:
-            self.uid = "node_" + os.urandom(4).hex()
+            self.uid = placeholder_uid()
         else:
             self.uid = uid
 
+        # Set once this is added to a group. See cache_names
+        self._name = None
+        self._qualified_name = None
+
         # Assume it is a leaf and a trunk. These are modified later
         self.is_leaf = True  # it calls nothing else
         self.is_trunk = True  # nothing calls it
@@ -679,13 +1016,51 @@ class TryNode():
         
         return lbl
 
+    def to_dict(self):
+        """
+        Output for json files (json graph specification)
+        :rtype: dict
+        """
+        return {
+            'uid': self.uid,
+            'label': self.label(),
+            'name': self.name(),
+        }
+
+    def to_lean_dict(self):
+        """
+        Output for lean json files. Structured fields instead of the label markup
+        :rtype: dict
+        """
+        return {
+            'uid': self.uid,
+            'kind': 'TRY',
+            'name': self.name(),
+            'file': self.first_group().filename(),
+            'qualified_name': self.token_with_ownership(),
+            'line': self.lineno,
+        }
+
     def name(self):
         """
         Names exist largely for unit tests and deterministic node sorting
         :rtype: str
         """
+        if self._name is not None:
+            return self._name
         return f"{self.first_group().filename()}::{self.token_with_ownership()}"
 
+    def cache_names(self):
+        """
+        Compute name() and token_with_ownership() once. Groups call this when
+        the node is added. The parent chain is fixed from then on, including
+        after remove_from_parent, so these never go stale.
+        :rtype: None
+        """
+        self._name = self._qualified_name = None
+        self._qualified_name = self.token_with_ownership()
+        self._name = self.name()
+
     def first_group(self):
         """
         The first group that contains this node.
@@ -702,6 +1077,7 @@ class TryNode():
         :rtype: None
         """
         self.first_group().nodes = [n for n in self.first_group().nodes if n != self]
+        _tree_changed()
 
     def to_dot(self):
         """
@@ -735,6 +1111,8 @@ class TryNode():
         Token which includes what group this is a part of
         :rtype: str
         """
+        if self._qualified_name is not None:
+            return self._qualified_name
         if self.is_attr():
             return djoin(self.parent.token, self.token)
         return self.token
@@ -762,12 +1140,16 @@ def _wrap_as_variables(sequence):
     return [Variable(el.token, el, el.line_number) for el in new_seq]
 
 class Edge():
-    def __init__(self, node0, node1, color='black', lineStyle='solid', tailLabel='', ):
+    __slots__ = ('node0', 'node1', 'color', 'lineStyle', 'tailLabel', 'kind')
+
+    def __init__(self, node0, node1, color='black', lineStyle='solid', tailLabel='',
+                 kind=EDGE_KIND.CALL):
         self.node0 = node0
         self.node1 = node1
         self.color = color
         self.lineStyle = lineStyle
         self.tailLabel = tailLabel
+        self.kind = kind
 
         # When we draw the edge, we know the calling function is definitely not a leaf...
         # and the called function is definitely not a trunk
@@ -779,8 +1161,8 @@ class Edge():
 
     def __lt__(self, other):
         if self.node0 == other.node0:
-            return self.node1 < other.node1
-        return self.node0 < other.node0
+            return self.node1.name() < other.node1.name()
+        return self.node0.name() < other.node0.name()
 
     def to_dot(self):
         '''
@@ -803,6 +1185,17 @@ class Edge():
             'directed': True,
         }
 
+    def to_lean_dict(self):
+        """
+        Output for lean json files
+        :rtype: dict
+        """
+        return {
+            'source': self.node0.uid,
+            'target': self.node1.uid,
+            'kind': self.kind,
+        }
+
 class Group():
     """
     Groups represent namespaces (classes and modules/files)
@@ -821,7 +1214,12 @@ class Group():
         self.inherits = inherits or []
         assert group_type in GROUP_TYPE
 
-        self.uid = "cluster_" + os.urandom(4).hex()  # group doesn't work by syntax rules
+        # Set by all_nodes() / all_groups()
+        self._all_nodes = None
+        self._all_groups = None
+        self._generation = _tree_generation
+
+        self.uid = placeholder_uid('cluster')  # group doesn't work by syntax rules
 
     def __repr__(self):
         return f"<Group token={self.token} type={self.display_type}>"
@@ -851,6 +1249,7 @@ class Group():
         :param sg Group:
         """
         self.subgroups.append(sg)
+        _tree_changed()
 
     def add_node(self, node, is_root=False):
         """
@@ -858,19 +1257,41 @@ class Group():
         :param node Node:
         :param is_root bool:
         """
+        node.cache_names()
         self.nodes.append(node)
         if is_root:
             self.root_node = node
+        _tree_changed()
+
+    def _check_generation(self):
+        """
+        Drop the all_nodes() / all_groups() caches if the tree has changed
+        since they were built.
+        :rtype: None
+        """
+        if self._generation != _tree_generation:
+            self._all_nodes = None
+            self._all_groups = None
+            self._generation = _tree_generation
+
+    def iter_nodes(self):
+        """
+        Lazily yield the nodes of this group + all subgroups, in all_nodes() order
+        :rtype: iterator[Node]
+        """
+        for group in self.iter_groups():
+            yield from group.nodes
 
     def all_nodes(self):
         """
-        List of nodes that are part of this group + all subgroups
+        List of nodes that are part of this group + all subgroups.
+        The list is shared until the tree changes so don't modify it.
         :rtype: list[Node]
         """
-        ret = list(self.nodes)
-        for subgroup in self.subgroups:
-            ret += subgroup.all_nodes()
-        return ret
+        self._check_generation()
+        if self._all_nodes is None:
+            self._all_nodes = list(self.iter_nodes())
+        return self._all_nodes
 
     def get_constructor(self):
         """
@@ -884,15 +1305,27 @@ class Group():
         if constructors:
             return constructors[0]
 
+    def iter_groups(self):
+        """
+        Lazily yield this group + all subgroups, parents before their children
+        :rtype: iterator[Group]
+        """
+        stack = [self]
+        while stack:
+            group = stack.pop()
+            yield group
+            stack.extend(reversed(group.subgroups))
+
     def all_groups(self):
         """
-        List of groups that are part of this group + all subgroups
+        List of groups that are part of this group + all subgroups.
+        The list is shared until the tree changes so don't modify it.
         :rtype: list[Group]
         """
-        ret = [self]
-        for subgroup in self.subgroups:
-            ret += subgroup.all_groups()
-        return ret
+        self._check_generation()
+        if self._all_groups is None:
+            self._all_groups = list(self.iter_groups())
+        return self._all_groups
 
     def get_variables(self, line_number=None):
         """
@@ -921,6 +1354,7 @@ class Group():
         """
         if self.parent:
             self.parent.subgroups = [g for g in self.parent.subgroups if g != self]
+            _tree_changed()
 
     def all_parents(self):
         """
@@ -946,21 +1380,44 @@ class Group():
         :rtype: str
         """
 
-        ret = 'subgraph ' + self.uid + ' {\n'
-        if self.nodes:
-            ret += '    '
-            ret += ' '.join(node.uid for node in self.nodes)
-            ret += ';\n'
+        ret = io.StringIO()
+        self.write_dot(ret)
+        return ret.getvalue()
+
+    def write_dot(self, outfile, indent='', only_nodes=None):
+        """
+        Write to_dot straight to a file. Subgroups are written in place, one
+        level further indented, instead of being rendered and re-indented.
+
+        :param outfile File:
+        :param str indent: prefix for every line, including those inside labels
+        :param set[Node]|None only_nodes: write only these nodes and skip groups
+            without any of them. The groups themselves are left alone.
+        :rtype: None
+        """
+        if only_nodes is None:
+            nodes = self.nodes
+        elif any(node in only_nodes for node in self.iter_nodes()):
+            nodes = [node for node in self.nodes if node in only_nodes]
+        else:
+            return
+
+        def write_line(line):
+            if indent:
+                line = indent + line.replace('\n', '\n' + indent)
+            outfile.write(line + '\n')
+
+        write_line('subgraph ' + self.uid + ' {')
+        if nodes:
+            write_line('    ' + ' '.join(node.uid for node in nodes) + ';')
         attributes = {
             'label': self.label(),
             'name': self.token,
             'style': 'filled',
         }
         for k, v in attributes.items():
-            ret += f'    {k}="{v}";\n'
-        ret += '    graph[style=dotted];\n'
+            write_line(f'    {k}="{v}";')
+        write_line('    graph[style=dotted];')
         for subgroup in self.subgroups:
-            ret += '    ' + ('\n'.join('    ' + ln for ln in
-                                       subgroup.to_dot().split('\n'))).strip() + '\n'
-        ret += '};\n'
-        return ret
+            subgroup.write_dot(outfile, indent + '    ', only_nodes)
+        write_line('};')
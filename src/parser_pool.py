@@ -0,0 +1,342 @@
+"""
+Long-lived external parser processes for the JS, PHP and Ruby frontends.
+
+Starting node / php / ruby for every file costs more than the parsing itself.
+Instead, each parser script has a --batch mode which stays running and reads
+one JSON-encoded filename per line on stdin. For each, it writes back one
+JSON object per line on stdout: {"tree": ...} if the file parsed or
+{"error": "..."} if it didn't.
+
+Workers are started on first use and kept until the process exits. A worker
+that crashes or takes longer than its timeout on a file only fails that file,
+with whatever the worker wrote to stderr in the error. The next file gets a
+fresh worker.
+
+AsyncParserPool speaks the same protocol from an asyncio event loop so that
+several files can be parsing while the caller works on the ones that are done.
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import subprocess
+import tempfile
+import threading
+
+SHUTDOWN_TIMEOUT = 5
+PARSE_TIMEOUT = 600
+
+# How much of a worker's stderr goes into an error
+STDERR_LIMIT = 4096
+
+# asyncio refuses to read lines longer than its buffer limit and one line
+# holds the whole tree of a file
+ASYNC_LINE_LIMIT = 1 << 30
+
+
+def _stderr_since(stderr, start):
+    """
+    What a worker wrote to its stderr file since start, ready to append to an error
+
+    :param file stderr:
+    :param int start: file size before the parse
+    :rtype: str
+    """
+    stderr.seek(start)
+    text = stderr.read().decode(errors='replace').strip()
+    if not text:
+        return ''
+    if len(text) > STDERR_LIMIT:
+        text = '...' + text[-STDERR_LIMIT:]
+    return '\n' + text
+
+
+class ParserWorker():
+    """
+    A single parser process running in --batch mode.
+    """
+    def __init__(self, cmd, timeout=PARSE_TIMEOUT):
+        """
+        :param list[str] cmd: command that starts the parser in --batch mode
+        :param float timeout: seconds to wait for one file before killing the worker
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.proc = None
+        self.stderr = None
+
+    def parse(self, filename):
+        """
+        :param str filename:
+        :returns: the tree and None or, if it couldn't be parsed, None and the error
+        :rtype: (object, str|None)
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            self.close()
+            # A file rather than a pipe so that a chatty worker can't block on a full pipe
+            self.stderr = tempfile.TemporaryFile()
+            self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=self.stderr)
+        stderr_start = os.fstat(self.stderr.fileno()).st_size
+        timed_out = threading.Event()
+
+        def kill(proc=self.proc):
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(self.timeout, kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            self.proc.stdin.write(json.dumps(filename).encode() + b'\n')
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        except OSError:
+            line = b''
+        finally:
+            timer.cancel()
+
+        if not line:
+            stderr = _stderr_since(self.stderr, stderr_start)
+            returncode = self.close()
+            if timed_out.is_set():
+                return None, "Parser timed out after %ss while parsing %r%s" % (
+                    self.timeout, filename, stderr)
+            return None, "Parser exited with code %r while parsing %r%s" % (
+                returncode, filename, stderr)
+        try:
+            response = json.loads(line)
+        except ValueError:
+            # Out of sync with the worker. Don't trust anything else it says.
+            stderr = _stderr_since(self.stderr, stderr_start)
+            self.close()
+            return None, "Parser returned invalid output for %r%s" % (filename, stderr)
+        if 'error' in response:
+            return None, response['error']
+        return response['tree'], None
+
+    def close(self):
+        """
+        Stop the process if it is running.
+
+        :rtype: int|None
+        :returns: the return code of the process
+        """
+        if self.proc is None:
+            return None
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            returncode = proc.wait(timeout=SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            returncode = proc.wait()
+        proc.stdout.close()
+        self.stderr.close()
+        return returncode
+
+
+class ParserPool():
+    """
+    Workers for one parser command. Every parse borrows an idle worker so that
+    up to `size` files can be parsed concurrently from different threads.
+    """
+    def __init__(self, cmd, size=1, timeout=PARSE_TIMEOUT):
+        """
+        :param list[str] cmd: command that starts the parser in --batch mode
+        :param int size: maximum number of workers
+        :param float timeout: seconds to wait for one file
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.workers = []
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+
+    def parse(self, filename):
+        """
+        :param str filename:
+        :rtype: (object, str|None)
+        """
+        with self._slots:
+            with self._lock:
+                if self._idle:
+                    worker = self._idle.pop()
+                else:
+                    worker = ParserWorker(self.cmd, self.timeout)
+                    self.workers.append(worker)
+            try:
+                return worker.parse(filename)
+            finally:
+                with self._lock:
+                    self._idle.append(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+class AsyncParserWorker():
+    """
+    Like ParserWorker but driven from an asyncio event loop.
+    """
+    def __init__(self, cmd, timeout=PARSE_TIMEOUT):
+        """
+        :param list[str] cmd: command that starts the parser in --batch mode
+        :param float timeout: seconds to wait for one file before killing the worker
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.proc = None
+        self.stderr = None
+
+    async def parse(self, filename):
+        """
+        :param str filename:
+        :returns: the tree and None or, if it couldn't be parsed, None and the error
+        :rtype: (object, str|None)
+        """
+        if self.proc is None or self.proc.returncode is not None:
+            await self.close()
+            self.stderr = tempfile.TemporaryFile()
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                stderr=self.stderr, limit=ASYNC_LINE_LIMIT)
+        stderr_start = os.fstat(self.stderr.fileno()).st_size
+        timed_out = False
+        try:
+            self.proc.stdin.write(json.dumps(filename).encode() + b'\n')
+            await self.proc.stdin.drain()
+            line = await asyncio.wait_for(self.proc.stdout.readline(), self.timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            self.proc.kill()
+            line = b''
+        except (OSError, ValueError):
+            line = b''
+
+        if not line:
+            stderr = _stderr_since(self.stderr, stderr_start)
+            returncode = await self.close()
+            if timed_out:
+                return None, "Parser timed out after %ss while parsing %r%s" % (
+                    self.timeout, filename, stderr)
+            return None, "Parser exited with code %r while parsing %r%s" % (
+                returncode, filename, stderr)
+        try:
+            response = json.loads(line)
+        except ValueError:
+            # Out of sync with the worker. Don't trust anything else it says.
+            stderr = _stderr_since(self.stderr, stderr_start)
+            await self.close()
+            return None, "Parser returned invalid output for %r%s" % (filename, stderr)
+        if 'error' in response:
+            return None, response['error']
+        return response['tree'], None
+
+    async def close(self):
+        """
+        Stop the process if it is running.
+
+        :rtype: int|None
+        :returns: the return code of the process
+        """
+        if self.proc is None:
+            return None
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            return await asyncio.wait_for(proc.wait(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            return await proc.wait()
+        finally:
+            self.stderr.close()
+
+
+class AsyncParserPool():
+    """
+    Up to `size` AsyncParserWorkers for one parser command. Every parse
+    borrows an idle worker so at most `size` files are parsing at once.
+    Unlike ParserPool, this belongs to one event loop and must be closed
+    before the loop ends.
+    """
+    def __init__(self, cmd, size=1, timeout=PARSE_TIMEOUT):
+        """
+        :param list[str] cmd: command that starts the parser in --batch mode
+        :param int size: maximum number of workers
+        :param float timeout: seconds to wait for one file
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.workers = []
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def parse(self, filename):
+        """
+        :param str filename:
+        :rtype: (object, str|None)
+        """
+        async with self._slots:
+            if self._idle:
+                worker = self._idle.pop()
+            else:
+                worker = AsyncParserWorker(self.cmd, self.timeout)
+                self.workers.append(worker)
+            try:
+                return await worker.parse(filename)
+            finally:
+                self._idle.append(worker)
+
+    async def close(self):
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def parse_file(cmd, filename):
+    """
+    Parse a file with the pool for this command, starting it if needed.
+    With --jobs, every worker process gets its own pool.
+
+    :param list[str] cmd: command that starts the parser in --batch mode
+    :param str filename:
+    :rtype: (object, str|None)
+    """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # A forked child must not share the parent's pipes. The parent
+            # closes those so just forget them.
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(tuple(cmd))
+        if pool is None:
+            pool = _pools[tuple(cmd)] = ParserPool(cmd)
+    return pool.parse(filename)
+
+
+@atexit.register
+def close_pools():
+    """
+    Stop every parser worker started by this process.
+
+    :rtype: None
+    """
+    with _pools_lock:
+        if _pools_pid == os.getpid():
+            for pool in _pools.values():
+                pool.close()
+        _pools.clear()
@@ -1,9 +1,10 @@
-import json
+import logging
 import os
 import subprocess
 
 from .model import (Group, Node, Call, Variable, BaseLanguage,
-                    OWNER_CONST, GROUP_TYPE, is_installed, flatten, djoin)
+                    OWNER_CONST, GROUP_TYPE, is_installed, flatten, djoin, iter_preorder)
+from .parser_pool import parse_file
 
 
 def lineno(tree):
@@ -78,34 +79,28 @@ def get_call_from_expr(func_expr):
     return ret
 
 
+def _walk_children(tree):
+    if tree['nodeType'] == 'Expr_BinaryOp_Concat':
+        return ()
+    return children(tree)
+
+
 def walk(tree):
     """
-    Given an ast tree walk it to get every node. For PHP, the exception
-    is that we return Expr_BinaryOp_Concat which has internal nodes but
-    is important to process as a whole.
+    Given an ast tree walk it to get every node, depth-first. For PHP, the
+    exception is that we return Expr_BinaryOp_Concat which has internal nodes
+    but is important to process as a whole.
 
     :param tree_el ast:
-    :rtype: list[ast]
+    :rtype: iterator[ast]
     """
-
     if isinstance(tree, list):
-        ret = []
-        for el in tree:
-            if isinstance(el, dict) and el.get('nodeType'):
-                ret += walk(el)
-        return ret
-
-    assert isinstance(tree, dict)
-    assert tree['nodeType']
-    ret = [tree]
-
-    if tree['nodeType'] == 'Expr_BinaryOp_Concat':
-        return ret
-
-    for v in tree.values():
-        if isinstance(v, list) or (isinstance(v, dict) and v.get('nodeType')):
-            ret += walk(v)
-    return ret
+        roots = [el for el in tree if isinstance(el, dict) and el.get('nodeType')]
+    else:
+        assert isinstance(tree, dict)
+        assert tree['nodeType']
+        roots = [tree]
+    return iter_preorder(roots, _walk_children)
 
 
 def children(tree):
@@ -128,20 +123,36 @@ def children(tree):
     return ret
 
 
-def make_calls(body_el):
+def make_calls_and_variables(tree_el, parent):
     """
-    Given a list of lines, find all calls in this list.
+    Given the lines of a function, find all calls in them and the variables
+    of the function in one pass. Variables are tokens and what they link to.
 
-    :param body_el ast:
-    :rtype: list[Call]
+    :param tree_el ast:
+    :param parent Group:
+    :rtype: (list[Call], list[Variable])
     """
     calls = []
-    for expr in walk(body_el):
-        call = get_call_from_expr(expr)
-        calls.append(call)
-    ret = list(filter(None, calls))
+    variables = []
+    for el in walk(tree_el):
+        call = get_call_from_expr(el)
+        if call:
+            calls.append(call)
+        if el['nodeType'] == 'Expr_Assign':
+            variables.append(process_assign(el))
+        if el['nodeType'] == 'Stmt_Use':
+            for use in el['uses']:
+                owner_token = djoin(use['name']['parts'])
+                token = use['alias']['name'] if use['alias'] else owner_token
+                variables.append(Variable(token, points_to=owner_token,
+                                          line_number=lineno(el)))
 
-    return ret
+    # Make a 'this'/'self' variable for use anywhere we need it that points to the class
+    if isinstance(parent, Group) and parent.group_type in GROUP_TYPE.CLASS:
+        variables.append(Variable('this', parent, line_number=parent.line_number))
+        variables.append(Variable('self', parent, line_number=parent.line_number))
+
+    return calls, list(filter(None, variables))
 
 
 def process_assign(assignment_el):
@@ -164,34 +175,6 @@ def process_assign(assignment_el):
     return None
 
 
-def make_local_variables(tree_el, parent):
-    """
-    Given an ast of all the lines in a function, generate a list of
-    variables in that function. Variables are tokens and what they link to.
-
-    :param tree_el ast:
-    :param parent Group:
-    :rtype: list[Variable]
-    """
-    variables = []
-    for el in walk(tree_el):
-        if el['nodeType'] == 'Expr_Assign':
-            variables.append(process_assign(el))
-        if el['nodeType'] == 'Stmt_Use':
-            for use in el['uses']:
-                owner_token = djoin(use['name']['parts'])
-                token = use['alias']['name'] if use['alias'] else owner_token
-                variables.append(Variable(token, points_to=owner_token,
-                                          line_number=lineno(el)))
-
-    # Make a 'this'/'self' variable for use anywhere we need it that points to the class
-    if isinstance(parent, Group) and parent.group_type in GROUP_TYPE.CLASS:
-        variables.append(Variable('this', parent, line_number=parent.line_number))
-        variables.append(Variable('self', parent, line_number=parent.line_number))
-
-    return list(filter(None, variables))
-
-
 def get_inherits(tree):
     """
     Get the various types of inheritances this class/namespace/trait can have
@@ -249,15 +232,34 @@ class PHP(BaseLanguage):
         :param lang_params LanguageParams:
         :rtype: ast
         """
+        tree, error = parse_file(PHP.parser_command(lang_params), filename)
+        return PHP.tree_from_parser(filename, tree, error)
+
+    @staticmethod
+    def parser_command(lang_params):
+        """
+        :param lang_params LanguageParams:
+        :rtype: list[str]
+        """
+        script_loc = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                  "get_ast.php")
+        return ["php", script_loc, "--batch"]
 
-        outp, returncode = run_ast_parser(filename)
-        if returncode:
+    @staticmethod
+    def tree_from_parser(filename, tree, error):
+        """
+        :param filename str:
+        :param tree list|None:
+        :param error str|None:
+        :rtype: ast
+        """
+        if error:
+            logging.debug("PHP parser error for %r: %s", filename, error)
             raise AssertionError(
                 "Could not parse file %r. You may have a syntax error. "
                 "For more detail, try running with `php %s`. " %
                 (filename, filename))
 
-        tree = json.loads(outp)
         assert isinstance(tree, list)
         if len(tree) == 1 and tree[0]['nodeType'] == 'Stmt_InlineHTML':
             raise AssertionError("Tried to parse a file that is not likely PHP")
@@ -317,8 +319,7 @@ class PHP(BaseLanguage):
         tree_body = tree['stmts']
         subgroup_trees, subnode_trees, this_scope_body = PHP.separate_namespaces(tree_body)
         assert not subgroup_trees
-        calls = make_calls(this_scope_body)
-        variables = make_local_variables(this_scope_body, parent)
+        calls, variables = make_calls_and_variables(this_scope_body, parent)
 
         if parent.group_type == GROUP_TYPE.CLASS and parent.parent.group_type == GROUP_TYPE.NAMESPACE:
             import_tokens = [djoin(parent.parent.token, parent.token, token)]
@@ -345,8 +346,7 @@ class PHP(BaseLanguage):
         """
         token = "(global)"
         line_number = lineno(lines[0]) if lines else 0
-        calls = make_calls(lines)
-        variables = make_local_variables(lines, parent)
+        calls, variables = make_calls_and_variables(lines, parent)
         root_node = Node(token, calls, variables, parent,
                          line_number=line_number)
         return root_node
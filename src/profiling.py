@@ -0,0 +1,224 @@
+"""
+--profile: run pasta under cProfile or tracemalloc and report on pasta's own
+functions.
+
+`--profile cpu` writes a .pstats file, which can be opened with
+`python -m pstats` or snakeviz, and logs the functions with the most
+cumulative time.
+
+`--profile mem` writes a report of the functions holding the most memory at
+the end of the stage when the most memory was live. tracemalloc only knows
+files and line numbers, so allocations are attributed to the innermost
+pasta function on their traceback, looked up from pasta's source.
+"""
+
+import ast
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import tracemalloc
+
+PROFILE_MODES = ('cpu', 'mem')
+DEFAULT_OUTPUT = {
+    'cpu': 'pasta.pstats',
+    'mem': 'pasta-memory.txt',
+}
+DEFAULT_TOP = 25
+TRACEBACK_FRAMES = 25
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_memory_profile = None
+
+
+@functools.lru_cache(maxsize=None)
+def _function_spans(filename):
+    """
+    :param str filename: a python source file
+    :returns: (first line, last line, qualified name) of every function, outer first
+    :rtype: list[(int, int, str)]
+    """
+    with open(filename) as f:
+        tree = ast.parse(f.read())
+    spans = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = prefix + child.name
+                if not isinstance(child, ast.ClassDef):
+                    first = min([child.lineno] + [d.lineno for d in child.decorator_list])
+                    spans.append((first, child.end_lineno, name))
+                visit(child, name + '.')
+            else:
+                visit(child, prefix)
+    visit(tree, '')
+    return spans
+
+
+def qualified_name(filename, lineno):
+    """
+    Name of the innermost function around this line of pasta's source, like
+    `Python.make_nodes`. None for lines that aren't in pasta or in a function.
+
+    :param str filename:
+    :param int lineno:
+    :rtype: str|None
+    """
+    if not is_pasta_file(filename):
+        return None
+    name = None
+    for first, last, span_name in _function_spans(filename):
+        if first <= lineno <= last:
+            name = span_name
+    return name
+
+
+def is_pasta_file(filename):
+    """
+    :param str filename:
+    :rtype: bool
+    """
+    return filename.endswith('.py') and os.path.abspath(filename).startswith(PACKAGE_DIR + os.sep)
+
+
+def _display_name(filename, lineno, function):
+    """
+    :returns: like `Python.make_nodes (src/python.py)`
+    :rtype: str
+    """
+    name = qualified_name(filename, lineno) or function
+    return '%s (%s)' % (name, os.path.relpath(filename, os.path.dirname(PACKAGE_DIR)))
+
+
+class MemoryProfile():
+    """
+    Keeps a tracemalloc snapshot from whichever checkpoint had the most
+    memory traced.
+    """
+    def __init__(self):
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self.snapshot_label = None
+
+    def checkpoint(self, label):
+        """
+        :param str label: what just finished
+        :rtype: None
+        """
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.snapshot_bytes:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = current
+            self.snapshot_label = label
+
+    def top_functions(self, top):
+        """
+        :param int top:
+        :returns: (size, count, name) of the pasta functions holding the most memory
+        :rtype: list[(int, int, str)]
+        """
+        by_function = {}
+        for stat in self.snapshot.statistics('traceback'):
+            name = '(outside of pasta)'
+            # Innermost frame first
+            for frame in reversed(stat.traceback):
+                if is_pasta_file(frame.filename) and frame.filename != __file__:
+                    name = _display_name(frame.filename, frame.lineno, '(module)')
+                    break
+            size, count = by_function.get(name, (0, 0))
+            by_function[name] = (size + stat.size, count + stat.count)
+        ranked = sorted(((size, count, name) for name, (size, count) in by_function.items()),
+                        reverse=True)
+        return ranked[:top]
+
+
+def checkpoint(label):
+    """
+    Called at the end of every pipeline stage. Does nothing unless running
+    under --profile mem.
+
+    :param str label:
+    :rtype: None
+    """
+    if _memory_profile is not None:
+        _memory_profile.checkpoint(label)
+
+
+def profile_cpu(func, output_file, top=DEFAULT_TOP):
+    """
+    Run func under cProfile and write the stats to output_file.
+
+    :param function func:
+    :param str output_file: .pstats file
+    :param int top: log this many of pasta's functions
+    :returns: whatever func returns
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        profiler.dump_stats(output_file)
+        stats = pstats.Stats(profiler)
+        rows = []
+        for (filename, lineno, function), (_, ncalls, tottime, cumtime, _) in \
+                stats.stats.items():
+            if is_pasta_file(filename):
+                rows.append((cumtime, tottime, ncalls, _display_name(filename, lineno, function)))
+        rows.sort(reverse=True)
+        lines = ["%10s %10s %10s  %s" % ('cumtime', 'tottime', 'calls', 'function')]
+        lines += ["%10.3f %10.3f %10d  %s" % row for row in rows[:top]]
+        logging.info("Wrote the CPU profile to %r. pasta's functions by cumulative time:\n%s",
+                     output_file, '\n'.join(lines))
+
+
+def profile_memory(func, output_file, top=DEFAULT_TOP):
+    """
+    Run func under tracemalloc and write which of pasta's functions hold the
+    most memory to output_file.
+
+    :param function func:
+    :param str output_file: text report
+    :param int top: report this many functions
+    :returns: whatever func returns
+    """
+    global _memory_profile
+    _memory_profile = profile = MemoryProfile()
+    tracemalloc.start(TRACEBACK_FRAMES)
+    try:
+        ret = func()
+        profile.checkpoint('end')
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _memory_profile = None
+
+    lines = ["Peak traced memory: %.1f MB" % (peak / 1e6),
+             "Largest live memory: %.1f MB after %s" % (profile.snapshot_bytes / 1e6,
+                                                        profile.snapshot_label),
+             "",
+             "%10s %10s  %s" % ('MB', 'blocks', 'function')]
+    if profile.snapshot:
+        lines += ["%10.2f %10d  %s" % (size / 1e6, count, name)
+                  for size, count, name in profile.top_functions(top)]
+    with open(output_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    logging.info("Wrote the memory profile to %r.", output_file)
+    return ret
+
+
+def run_profiled(mode, func, output_file=None, top=DEFAULT_TOP):
+    """
+    :param str mode: one of PROFILE_MODES
+    :param function func:
+    :param str|None output_file: defaults to DEFAULT_OUTPUT[mode]
+    :param int top:
+    :returns: whatever func returns
+    """
+    assert mode in PROFILE_MODES, "--profile must be one of %r." % (PROFILE_MODES,)
+    output_file = output_file or DEFAULT_OUTPUT[mode]
+    if mode == 'cpu':
+        return profile_cpu(func, output_file, top)
+    return profile_memory(func, output_file, top)
@@ -3,8 +3,8 @@ import logging
 import os
 import inspect
 
-from .model import (OWNER_CONST, GROUP_TYPE, Group, Node, Call, Variable, IfNode, TryNode,
-                    BaseLanguage, djoin)
+from .model import (OWNER_CONST, GROUP_TYPE, EDGE_KIND, Group, Node, Call, Variable, IfNode,
+                    TryNode, BaseLanguage, djoin, iter_preorder, placeholder_uid)
 
 
 def get_call_from_func_element(func, parent):
@@ -17,8 +17,7 @@ def get_call_from_func_element(func, parent):
     :rtype: Call|None
     """
 
-    
-    assert type(func) in (ast.Attribute, ast.Name, ast.Subscript, ast.Call)
+
     grouptoken = parent.token
     if type(func) == ast.Attribute:
         owner_token = []
@@ -41,27 +40,8 @@ def get_call_from_func_element(func, parent):
         return Call(token=func.attr, line_number=func.lineno, owner_token=owner_token)
     if type(func) == ast.Name:
         return Call(token=func.id, line_number=func.lineno)
-    if type(func) in (ast.Subscript, ast.Call):
-        return None
-
-
-def make_calls(lines, parent):
-    """
-    Given a list of lines, find all calls in this list.
-
-    :param lines list[ast]:
-    :rtype: list[Call]
-    """
-
-    calls = []
-    for tree in lines:
-        for element in ast.iter_child_nodes(tree):
-            if type(element) == ast.Call:
-                call = get_call_from_func_element(element.func, parent)
-                if call:
-                    calls.append(call)
-   
-    return calls
+    # Subscripts, calls, lambdas etc. e.g. array[2](param)
+    return None
 
 
 def process_assign(element, parent):
@@ -122,10 +102,6 @@ def process_import(element):
         ret.append(Variable(token, points_to=rhs, line_number=element.lineno))
     return ret
 
-def process_if(element):
-    ret = []
-    ret.append(Variable())
-
 def make_arguments(arguments):
 
     args_obj_list = arguments.args
@@ -141,47 +117,362 @@ def make_arguments(arguments):
     return arg_name_list
             
         
-def make_local_variables(lines, parent):
+# Nodes that can't contain calls or assignments. Most of any tree is these.
+_LEAF_TYPES = (ast.Name, ast.Constant, ast.expr_context, ast.operator, ast.boolop,
+               ast.cmpop, ast.unaryop, ast.alias)
+_FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
+_IMPORT_TYPES = (ast.Import, ast.ImportFrom)
+
+
+def _scope_children(element):
+    """
+    The children of element that can hold calls, assignments or imports of
+    the same scope. Nested functions and classes are their own scopes so
+    only their decorators, defaults and bases are included.
+
+    :param element ast:
+    :rtype: list[ast]
+    """
+    element_type = type(element)
+    if element_type in _IMPORT_TYPES:
+        return []
+    if element_type in _FUNCTION_TYPES:
+        return element.decorator_list + [element.args]
+    if element_type == ast.ClassDef:
+        return element.decorator_list + element.bases + element.keywords
+    children = []
+    for field in element_type._fields:
+        value = getattr(element, field, None)
+        if type(value) == list:
+            children += [v for v in value
+                         if isinstance(v, ast.AST) and not isinstance(v, _LEAF_TYPES)]
+        elif isinstance(value, ast.AST) and not isinstance(value, _LEAF_TYPES):
+            children.append(value)
+    return children
+
+
+def add_calls_and_variables(elements, parent, calls, variables):
     """
-    Given an ast of all the lines in a function, generate a list of
-    variables in that function. Variables are tokens and what they link to.
+    Walk elements once and add the calls found at any depth, including
+    arguments, loop bodies and comprehensions, and the variables assigned or
+    imported to calls and variables.
+
+    :param elements list[ast]:
+    :param parent Group:
+    :param calls list[Call]:
+    :param variables list[Variable]:
+    :rtype: None
+    """
+    for element in iter_preorder(elements, _scope_children):
+        element_type = type(element)
+        if element_type == ast.Call:
+            call = get_call_from_func_element(element.func, parent)
+            if call:
+                calls.append(call)
+        elif element_type == ast.Assign:
+            variables += process_assign(element, parent)
+        elif element_type in _IMPORT_TYPES:
+            variables += process_import(element)
+        elif element_type == ast.Expr:
+            token = None
+            value = element.value
+            if type(value) == ast.Call:
+                if type(value.func) == ast.Name:
+                    token = value.func.id
+                elif type(value.func) == ast.Attribute:
+                    token = value.func.attr
+            elif type(value) == ast.Subscript:
+                token = getattr(getattr(value.value, 'value', None), 'id', None)
+            elif type(value) == ast.Constant:
+                token = value.value
+            if token is not None:
+                variables.append(Variable(token, parent, element.lineno))
+
+
+def make_calls_and_variables(lines, parent):
+    """
+    Given a list of lines, find all calls in these lines and generate the
+    variables in them. Variables are tokens and what they link to.
     In this case, what it links to is just a string. However, that is resolved
     later.
 
     :param lines list[ast]:
     :param parent Group:
-    :rtype: list[Variable]
+    :rtype: (list[Call], list[Variable])
     """
-
+    calls = []
     variables = []
-    for element in lines:
-        if type(element) == ast.Assign:
-            variables += process_assign(element, parent)
+    add_calls_and_variables(lines, parent, calls, variables)
+    if parent.group_type == GROUP_TYPE.CLASS:
+        variables.append(Variable('self', parent, lines[0].lineno))
 
-        if type(element) in (ast.Import, ast.ImportFrom):
-            variables += process_import(element)
+    variables = list(filter(None, variables))
+    return calls, variables
 
-        if type(element) == ast.Expr:
-            if type(element.value) == ast.Call:
-                if type(element.value.func) == ast.Name:
-                    token = element.value.func.id
-                else:
-                    #assume attr
-                    token = element.value.func.attr
 
-            elif type(element.value) == ast.Subscript:
-                token = element.value.value.value.id
+# Statements after these in the same body never run
+_EXIT_TYPES = (ast.Return, ast.Raise, ast.Break, ast.Continue)
+_WITH_TYPES = (ast.With, ast.AsyncWith)
+_TRY_TYPES = (ast.Try,) + ((ast.TryStar,) if hasattr(ast, 'TryStar') else ())
+_LOOP_TYPES = (ast.For, ast.AsyncFor, ast.While)
+_MATCH_TYPES = (ast.Match,) if hasattr(ast, 'Match') else ()
+_BRANCH_TYPES = (ast.If,) + _TRY_TYPES + _LOOP_TYPES + _MATCH_TYPES
 
-            elif type(element.value) == ast.Constant:
-                token = element.value.value
+# Where the flow goes after each exit statement. A raise has no edge
+_JUMP_KINDS = {ast.Return: EDGE_KIND.RETURN, ast.Break: EDGE_KIND.BREAK,
+               ast.Continue: EDGE_KIND.CONTINUE, ast.Raise: None}
 
-            variables += [Variable(token, parent, element.lineno)]
+# Stands in for the uid of the function's exit block until one is needed
+_EXIT = object()
 
-    if parent.group_type == GROUP_TYPE.CLASS:
-        variables.append(Variable('self', parent, lines[0].lineno))
 
-    variables = list(filter(None, variables))
-    return variables
+def _sequence(body):
+    """
+    The statements of body in the order they run, without branching.
+    With blocks run their body once so they are spliced in after their
+    context expressions, and finally bodies run after their try.
+
+    :param body list[ast]:
+    :rtype: iterator[ast]
+    """
+    stack = [iter(body)]
+    while stack:
+        for element in stack[-1]:
+            if isinstance(element, _WITH_TYPES):
+                for item in element.items:
+                    yield item.context_expr
+                stack.append(iter(element.body))
+                break
+            yield element
+            if isinstance(element, _TRY_TYPES) and element.finalbody:
+                stack.append(iter(element.finalbody))
+                break
+        else:
+            stack.pop()
+
+
+def _loop_condition(element):
+    """
+    :param element ast.For|ast.AsyncFor|ast.While:
+    :rtype: str
+    """
+    if type(element) == ast.While:
+        return Python.make_condition_str(element.test)
+    return Python.make_condition_str(element.target) + ' IN ' + \
+        Python.make_condition_str(element.iter)
+
+
+def _case_condition(case):
+    """
+    :param case ast.match_case:
+    :rtype: str
+    """
+    condition = ast.unparse(case.pattern)
+    if case.guard:
+        condition += ' IF ' + Python.make_condition_str(case.guard)
+    return condition
+
+
+def _headers(element):
+    """
+    The expressions evaluated to decide where a branching statement goes:
+    if / while tests, loop iterables, match subjects and guards and except types.
+
+    :param element ast:
+    :rtype: list[ast]
+    """
+    if isinstance(element, (ast.If, ast.While)):
+        return [element.test]
+    if isinstance(element, _LOOP_TYPES):
+        return [element.iter]
+    if isinstance(element, _TRY_TYPES):
+        return [handler.type for handler in element.handlers if handler.type]
+    return [element.subject] + [case.guard for case in element.cases if case.guard]
+
+
+def _run_for(items, line_number):
+    """
+    The run of plain statements at the end of items, starting a new one if
+    the last item branches.
+
+    :param items list:
+    :param line_number int:
+    :rtype: list
+    """
+    if not items or type(items[-1]) != list:
+        items.append([line_number, [], [], None])
+    return items[-1]
+
+
+def build_blocks(body, parent, branch=None):
+    """
+    Build the control flow graph of a function body in one pass over its
+    statements. Each basic block and each place where the flow splits is
+    one record and the records refer to each other by uid:
+
+        ('BLOCK', uid, branch, is_head, line_number, calls, variables, next_uid, jump)
+        ('BRANCH', uid, kind, line_number, condition, true_uid, false_uid, cont_uid)
+        ('TRY', uid, line_number, body_uid, except_uids, cont_uid)
+
+    The calls and variables of every block are collected while its statements
+    are visited so each expression is walked once.
+
+    The first block of every body is its head. It is empty when the body
+    starts with a branch. Loops branch to their body and their else, and
+    every case of a match branches to its body or the next case.
+    The uid of the very first block is None.
+
+    jump is (edge_kind, uid) when a block doesn't fall through: a return goes
+    to the EXIT block of the function, a break to whatever follows its loop
+    and a continue to the loop. The end of a loop body goes back to the loop
+    too. A return where the function ends anyway has no jump and the EXIT
+    block is only made for functions that return early.
+    Statements after a return, raise, break or continue never run. Their
+    calls and variables are kept in the block that exits.
+
+    :param body list[ast]:
+    :param parent Group:
+    :param branch str|None:
+    :rtype: list[tuple]
+    """
+    records = []
+    in_class = parent.group_type == GROUP_TYPE.CLASS
+    exit_uid = None
+
+    def resolve(uid):
+        nonlocal exit_uid
+        if uid is not _EXIT:
+            return uid
+        if exit_uid is None:
+            exit_uid = placeholder_uid()
+        return exit_uid
+
+    # Bodies still to do and records ready to go, in reverse order.
+    # A body also has where the flow goes after it and, inside a loop,
+    # the uids of the loop and of what follows it.
+    pending = [('BODY', body, branch, None, _EXIT, None)]
+    while pending:
+        task = pending.pop()
+        if task[0] != 'BODY':
+            records.append(task)
+            continue
+        _, statements, branch, uid, after, loop = task
+
+        # Runs of plain statements, as [line_number, calls, variables, exit_type],
+        # separated by the statements that branch.
+        # Calls in a branch's header belong to the run before it.
+        items = []
+        exited = False
+        for element in _sequence(statements):
+            if exited:
+                # The finally body of a try comes next in the sequence
+                if isinstance(element, _TRY_TYPES):
+                    element = element.body + element.handlers + element.orelse
+                else:
+                    element = [element]
+                add_calls_and_variables(element, parent, run[1], run[2])
+                continue
+            if not isinstance(element, _BRANCH_TYPES):
+                run = _run_for(items, element.lineno)
+                add_calls_and_variables([element], parent, run[1], run[2])
+                if isinstance(element, _EXIT_TYPES):
+                    run[3] = type(element)
+                    exited = True
+                continue
+            for header in _headers(element):
+                calls = []
+                add_calls_and_variables([header], parent, calls, [])
+                if calls:
+                    _run_for(items, header.lineno)[1].extend(calls)
+            items.append(element)
+
+        # Like make_calls_and_variables, every run of a method has self
+        if in_class:
+            for item in items:
+                if type(item) == list:
+                    item[2].append(Variable('self', parent, item[0]))
+
+        # The last item of a loop body goes back to the loop
+        end_uid = loop[0] if branch == 'LOOP' else None
+
+        def jump_for(exit_type, is_last):
+            kind = _JUMP_KINDS.get(exit_type)
+            if kind == EDGE_KIND.RETURN:
+                # Unless the function would end here anyway
+                if is_last and after is _EXIT:
+                    return None
+                return (kind, resolve(_EXIT))
+            if kind == EDGE_KIND.BREAK:
+                return (kind, resolve(loop[1]))
+            if kind == EDGE_KIND.CONTINUE:
+                return (kind, loop[0])
+            if exit_type is None and is_last and end_uid:
+                return (EDGE_KIND.LOOP_BACK, end_uid)
+            return None
+
+        todo = []
+        if type(items[0]) == list:
+            line_number, calls, variables, exit_type = items.pop(0)
+        else:
+            line_number, calls, variables, exit_type = items[0].lineno, [], [], None
+        next_uid = placeholder_uid() if items else None
+        todo.append(('BLOCK', uid, branch, True, line_number, calls, variables, next_uid,
+                     jump_for(exit_type, not items)))
+
+        for i, item in enumerate(items):
+            uid = next_uid
+            next_uid = placeholder_uid() if i + 1 < len(items) else None
+            follow = next_uid or after
+            if type(item) == list:
+                line_number, calls, variables, exit_type = item
+                todo.append(('BLOCK', uid, 'CONTINUE', False, line_number, calls, variables,
+                             next_uid, jump_for(exit_type, not next_uid)))
+            elif type(item) == ast.If:
+                true_uid = placeholder_uid()
+                todo.append(('BODY', item.body, 'IF TRUE', true_uid, follow, loop))
+                false_uid = None
+                if item.orelse:
+                    false_uid = placeholder_uid()
+                    todo.append(('BODY', item.orelse, 'IF FALSE', false_uid, follow, loop))
+                todo.append(('BRANCH', uid, 'IF', item.test.lineno,
+                             Python.make_condition_str(item.test), true_uid, false_uid,
+                             next_uid or end_uid))
+            elif isinstance(item, _TRY_TYPES):
+                body_uid = placeholder_uid()
+                # else runs after the body when nothing was raised
+                todo.append(('BODY', item.body + item.orelse, 'TRY', body_uid, follow, loop))
+                except_uids = []
+                for handler in item.handlers:
+                    except_uids.append(placeholder_uid())
+                    todo.append(('BODY', handler.body, 'EXCEPT', except_uids[-1], follow, loop))
+                todo.append(('TRY', uid, item.lineno, body_uid, except_uids,
+                             next_uid or end_uid))
+            elif isinstance(item, _LOOP_TYPES):
+                true_uid = placeholder_uid()
+                todo.append(('BODY', item.body, 'LOOP', true_uid, uid, (uid, follow)))
+                false_uid = None
+                if item.orelse:
+                    false_uid = placeholder_uid()
+                    todo.append(('BODY', item.orelse, 'LOOP ELSE', false_uid, follow, loop))
+                kind = 'WHILE' if type(item) == ast.While else 'FOR'
+                todo.append(('BRANCH', uid, kind, item.lineno, _loop_condition(item),
+                             true_uid, false_uid, next_uid or end_uid))
+            else:
+                # match. Like if / elif, only the first case continues
+                case_uid, cont_uid = uid, next_uid or end_uid
+                for j, case in enumerate(item.cases):
+                    true_uid = placeholder_uid()
+                    todo.append(('BODY', case.body, 'CASE', true_uid, follow, loop))
+                    false_uid = placeholder_uid() if j + 1 < len(item.cases) else None
+                    todo.append(('BRANCH', case_uid, 'CASE', case.pattern.lineno,
+                                 _case_condition(case), true_uid, false_uid, cont_uid))
+                    case_uid, cont_uid = false_uid, None
+        pending += reversed(todo)
+
+    if exit_uid:
+        records.append(('BLOCK', exit_uid, 'EXIT', False, body[-1].end_lineno, [], [], None,
+                        None))
+    return records
 
 
 def get_inherits(tree):
@@ -253,227 +544,56 @@ class Python(BaseLanguage):
         return groups, nodes, body
 
     @staticmethod
-    def eval_funcs(funcs):
-        simple_funcs = funcs
-        complex_funcs = []
-
-        for func in funcs:
-            for el in ast.iter_child_nodes(func):
-                if type(el) == ast.If:
-                    complex_funcs.append(func)
-                    simple_funcs.remove(func)
-                    break
-            
-        return simple_funcs, complex_funcs
-
-    @staticmethod
-    def make_nodes(tree, parent, root_name=None, branch=None, uid=None):
+    def make_nodes(tree, parent):
         """
         Given an ast of all the lines in a function, create the node along with the
-        calls and variables internal to it.
+        calls and variables internal to it. Every block of the function's control
+        flow graph is one more node. See build_blocks
 
         :param tree ast:
         :param parent Group:
-        :rtype: list[Node]
+        :rtype: list[Node|IfNode|TryNode]
         """
+        root_name = tree.name
+        arguments = make_arguments(tree.args)
 
-        if root_name == None:
-            root_name = tree.name
-
-        arguments = []
-        
-        # This first checks what sort of tree is given if it is a list or ast.functionDef
-        # and puts all child elements into a list if necessary (excluding arguments)
-        # if arguments are found it sets the arguments var
-        ungrouped_nodes = []
-        if type(tree) == ast.FunctionDef:
-            for el in ast.iter_child_nodes(tree):
-                if type(el) == ast.arguments:
-                    arguments = el.args
-                else:
-                    ungrouped_nodes.append(el)
-
-        print('these are the args: ', arguments)
-        # if the tree given is a list (body of previous function/if element) then just use the list
-        if type(tree) == list:
-            ungrouped_nodes = tree
-
-        # This looks into the list of nodes and looks for ifs and separates out groups of nodes
-        group = []
-        groups = []
-        for el in ungrouped_nodes:
-            if type(el) == ast.If or type(el) == ast.Try:
-
-                if group != []:
-                    groups.append(group)
-                
-                groups.append([el])
-                group = []
-            else:
-                group.append(el)
-
-        # if an ast.If was last in the ungroup_nodes then group would = [] which we don't need
-        # however if there remains any other elements the last group we need to add it to groups
-        if group != []:
-            groups.append(group)
-
-
-        
-
-        # create head function 
-        # Now we analyize each sub_group of nodes and create new nodes out of them either normal function/body nodes or IfNodes
-        
-        index = 0
         nodes_to_return = []
-        for group in groups:
-            # if the group is a normal node (not an ast.If)
-            if index == 0:
-                # create head function no matter what first group is...
-                
-                if branch == None:
+        for record in build_blocks(tree.body, parent):
+            if record[0] == 'BLOCK':
+                (_, uid, branch, is_head, line_number, calls, variables, next_uid,
+                 jump) = record
+                if not is_head:
+                    token = root_name + '()'
+                elif branch is None:
                     token = root_name
-                    nodeName = root_name + '()'
                 else:
                     token = branch + ' branch: ' + root_name
-                    nodeName = root_name + '()'
 
-                lineno = group[0].lineno
-
-                if type(group[0]) != ast.If and type(group[0]) != ast.Try:
-                    calls = make_calls(group, parent)
-                    variables = make_local_variables(group, parent)
-                else:
-                    # if the first group is an if or try then there are no immediate calls or variables
-                    calls = []
-                    variables = []
-                
-                # assign import tokens
                 import_tokens = []
                 if parent.group_type == GROUP_TYPE.FILE:
                     import_tokens = [djoin(parent.token, token)]
 
-                # assign is_constructor
                 is_constructor = False
                 if parent.group_type == GROUP_TYPE.CLASS and token in ['__init__', '__new__']:
                     is_constructor = True
 
-                # if sub_bodies len is greater than index then assign if as tree.name_if_index(of if)
-                detailNode = None
-
-                # since the current index is a normal node and if the current index is not the last in the sub_bodies list then the next index must be an IF node
-                if len(groups) > 1 or (type(group[0]) == ast.If or type(group[0]) == ast.Try):
-                    print('CREATED HEAD NODE AND WILL CONTINUE!!!')
-                    detailNode = "node_" + os.urandom(4).hex()
-
-                # now create this node and add it to the list of nodes to return.
-                nodes_to_return.append(Node(token, nodeName, calls, variables, parent, import_tokens=import_tokens, line_number=lineno, is_constructor=is_constructor, args=arguments, detailNode=detailNode, branch=branch, uid=uid))
-                uid = detailNode
-                branch = 'CONTINUE'
-
-            if type(group[0]) != ast.If and type(group[0]) != ast.Try and index != 0:
-                # assign token (token = nodeID)
-                # assign nodeName (display name on map)
-                token = root_name + '()'
-                nodeName = root_name + '()'
-                    
-                # assign line number
-                lineno = group[0].lineno
-
-                # assign calls for this node
-                calls = make_calls(group, parent)
-
-                # assign variables for this node
-                variables = make_local_variables(group, parent)
-
-                # assign import tokens
-                import_tokens = []
-                if parent.group_type == GROUP_TYPE.FILE:
-                    import_tokens = [djoin(parent.token, token)]
-
-                # assign is_constructor
-                is_constructor = False
-                if parent.group_type == GROUP_TYPE.CLASS and token in ['__init__', '__new__']:
-                    is_constructor = True
-
-                # if sub_bodies len is greater than index then assign if as tree.name_if_index(of if)
-                detailNode = None
-
-                # since the current index is a normal node and if the current index is not the last in the sub_bodies list then the next index must be an IF node
-                if groups.index(group) + 1 < len(groups):
-                    detailNode = "node_" + os.urandom(4).hex()
-
-                # now create this node and add it to the list of nodes to return.
-                nodes_to_return.append(Node(token, nodeName, calls, variables, parent, import_tokens=import_tokens, line_number=lineno, is_constructor=is_constructor, args=[], detailNode=detailNode, branch=branch, uid=uid))
-                uid = detailNode
-                branch = 'CONTINUE'
-
-            if type(group[0]) == ast.If:
-                # create an if node using tree.name (function name) + index as token
-                # create token
-                token = root_name
-
-                # create name
-                name = 'IF'
-
-                # create condition
-                lineno = group[0].test.lineno
-                condition = Python.make_condition_str(group[0].test)
-                
-                # create ifTrueID
-                ifTrueID = "node_" + os.urandom(4).hex()
-                trueNodes = Python.make_nodes(group[0].body, parent, root_name=root_name, branch='IF TRUE', uid=ifTrueID)
-                nodes_to_return += trueNodes
-
-                # check if ifFalse exists
-                ifFalseID = None
-                if group[0].orelse:
-                    ifFalseID = "node_" + os.urandom(4).hex()
-                    falseNodes = Python.make_nodes(group[0].orelse, parent, root_name=root_name, branch='IF FALSE', uid=ifFalseID)
-                    nodes_to_return += falseNodes
-        
-                # if this IfNode in list sub_bodies is not the last in the list then add cont id and connect to next item
-                ifContID = None
-                if groups.index(group) + 1 < len(groups):
-                    ifContID = "node_" + os.urandom(4).hex()
-                    
-                # add IfNode
-                nodes_to_return.append(IfNode(token, name, condition, ifTrueID, parent, ifFalseID=ifFalseID, ifContID=ifContID, uid=uid, lineno=lineno))
-                uid = ifContID
-                branch = 'CONTINUE'
-
-            if type(group[0]) == ast.Try:
-                token = root_name
-                nodeName = 'TRY'
-                lineno = group[0].lineno # not sure about this working
-
-                # create TryBodyID
-                tryBodyID = "node_" + os.urandom(4).hex()
-                tryNodes = Python.make_nodes(group[0].body, parent, root_name=root_name, branch='TRY', uid=tryBodyID)
-                nodes_to_return += tryNodes
-
-                # create exceptions
-                exceptBodyIDs = []
-                print('how many handlers? ', len(group[0].handlers))
-                i = 0
-                for expt in group[0].handlers:
-                    print('except!!')
-                    exceptBodyID = "node_" + os.urandom(4).hex()
-                    exceptNodes = Python.make_nodes(expt.body, parent, root_name=root_name, branch='EXCEPT', uid=exceptBodyID)
-                    nodes_to_return += exceptNodes
-                    exceptBodyIDs.append(exceptBodyID)
-                    i += 1
-
-                # if this try node in list groups is not the last in the list then add cont id and connect to next item
-                tryContID = None
-                if groups.index(group) + 1 < len(groups):
-                    tryContID = "node_" + os.urandom(4).hex()
-
-                nodes_to_return.append(TryNode(token, nodeName, tryBodyID, parent, exceptBodyIDs=exceptBodyIDs, tryContID=tryContID, lineno=lineno, uid=uid))
-                uid = tryContID
-                branch = 'CONTINUE'
-            
-            index += 1
-
+                args = arguments if is_head and branch is None else []
+                jump_kind, jump_uid = jump or (None, None)
+                nodes_to_return.append(Node(token, root_name + '()', calls, variables, parent,
+                                            import_tokens=import_tokens, line_number=line_number,
+                                            is_constructor=is_constructor, args=args,
+                                            detailNode=next_uid, branch=branch, uid=uid,
+                                            jumpID=jump_uid, jumpKind=jump_kind))
+            elif record[0] == 'BRANCH':
+                _, uid, kind, line_number, condition, true_uid, false_uid, cont_uid = record
+                nodes_to_return.append(IfNode(root_name, kind, condition, true_uid, parent,
+                                              ifFalseID=false_uid, ifContID=cont_uid,
+                                              uid=uid, lineno=line_number))
+            else:
+                _, uid, line_number, body_uid, except_uids, cont_uid = record
+                nodes_to_return.append(TryNode(root_name, 'TRY', body_uid, parent,
+                                               exceptBodyIDs=except_uids, tryContID=cont_uid,
+                                               lineno=line_number, uid=uid))
         return nodes_to_return
 
     @staticmethod
@@ -489,8 +609,7 @@ class Python(BaseLanguage):
         token = "(global)"
         nodeName = token
         line_number = 0
-        calls = make_calls(lines, parent)
-        variables = make_local_variables(lines, parent)
+        calls, variables = make_calls_and_variables(lines, parent)
         return Node(token, nodeName, calls, variables, parent, line_number=line_number)
 
     @staticmethod
@@ -524,7 +643,8 @@ class Python(BaseLanguage):
                                 inherits=inherits, line_number=line_number, parent=parent)
 
             for node_tree in node_trees:
-                class_group.add_node(Python.make_nodes(node_tree, parent=class_group)[0])
+                for new_node in Python.make_nodes(node_tree, parent=class_group):
+                    class_group.add_node(new_node)
 
             for subgroup_tree in subgroup_trees:
                 logging.warning("pasta does not support nested classes. Skipping %r in %r.",
@@ -588,11 +708,14 @@ class Python(BaseLanguage):
                 print('ops is too complicated!!!')
 
             if len(comparators) == 1:
-                if type(comparators[0]) == ast.Constant or type(comparators[0]) == ast.Attribute:
-                    if 'ast' in str(comparators[0].value):
-                        return_str += ' ' + str(comparators[0].value.value.id)
-                    else:
-                        return_str += ' ' + str(comparators[0].value)
+                if type(comparators[0]) == ast.Attribute:
+                    # name the root of the chain e.g. 'a' for a.b.c
+                    owner = comparators[0].value
+                    while type(owner) == ast.Attribute:
+                        owner = owner.value
+                    return_str += ' ' + str(getattr(owner, 'id', 'IDK'))
+                elif type(comparators[0]) == ast.Constant:
+                    return_str += ' ' + str(comparators[0].value)
                 
             else:
                 print('comparators is too complicated!!!')
@@ -641,12 +764,7 @@ class Python(BaseLanguage):
             elif isinstance(op, ast.Invert):
                 op = '~'
 
-            operand = condition.operand
-            
-            if isinstance(operand, ast.Name):
-                operand = operand.id
-
-            return str(op) + ' ' + str(operand)
+            return str(op) + ' ' + Python.make_condition_str(condition.operand)
 
         elif type(condition) == ast.Name:
             return condition.id
@@ -1,8 +1,10 @@
-import json
+import logging
+import os
 import subprocess
 
 from .model import (Group, Node, Call, Variable, BaseLanguage,
-                    OWNER_CONST, GROUP_TYPE, is_installed, flatten)
+                    OWNER_CONST, GROUP_TYPE, is_installed, flatten, iter_preorder)
+from .parser_pool import parse_file
 
 
 def resolve_owner(owner_el):
@@ -55,35 +57,18 @@ def get_call_from_send_el(func_el):
                 owner_token=owner)
 
 
+def _walk_children(tree_el):
+    return [el for el in tree_el if isinstance(el, list) and el]
+
+
 def walk(tree_el):
     """
     Given an ast element (list), walk it in a dfs to get every el (list) out of it
 
     :param tree_el ast:
-    :rtype: list[ast]
-    """
-
-    if not tree_el:
-        return []
-    ret = [tree_el]
-    for el in tree_el:
-        if isinstance(el, list):
-            ret += walk(el)
-    return ret
-
-
-def make_calls(body_el):
-    """
-    Given a list of lines, find all calls in this list.
-
-    :param body_el ast:
-    :rtype: list[Call]
+    :rtype: iterator[ast]
     """
-    calls = []
-    for el in walk(body_el):
-        if el[0] == 'send':
-            calls.append(get_call_from_send_el(el))
-    return calls
+    return iter_preorder([tree_el] if tree_el else [], _walk_children)
 
 
 def process_assign(assignment_el):
@@ -105,30 +90,35 @@ def process_assign(assignment_el):
     return None
 
 
-def make_local_variables(tree_el, parent):
+def make_calls_and_variables(tree_el, parent):
     """
-    Given an ast of all the lines in a function, generate a list of
-    variables in that function. Variables are tokens and what they link to.
-    In this case, what it links to is just a string. However, that is resolved
-    later.
+    Given an ast of all the lines in a function, find all calls in them and
+    the variables of the function in one pass. Variables are tokens and what
+    they link to. In this case, what it links to is just a string. However,
+    that is resolved later.
 
     Also return variables for the outer scope parent
 
     :param tree_el ast:
     :param parent Group:
-    :rtype: list[Variable]
+    :rtype: (list[Call], list[Variable])
     """
+    calls = []
     variables = []
-    for el in tree_el:
-        if el[0] == 'lvasgn':
-            variables.append(process_assign(el))
+    for line in _walk_children(tree_el) if tree_el else []:
+        # Only assignments directly in the body are variables of the function
+        if line[0] == 'lvasgn':
+            variables.append(process_assign(line))
+        for el in walk(line):
+            if el[0] == 'send':
+                calls.append(get_call_from_send_el(el))
 
     # Make a 'self' variable for use anywhere we need it that points to the class
     if isinstance(parent, Group) and parent.group_type == GROUP_TYPE.CLASS:
         variables.append(Variable('self', parent))
 
     variables = list(filter(None, variables))
-    return variables
+    return calls, variables
 
 
 def as_lines(tree_el):
@@ -194,11 +184,13 @@ def get_inherits(tree, body_tree):
 class Ruby(BaseLanguage):
     @staticmethod
     def assert_dependencies():
-        """Assert that ruby-parse is installed"""
-        assert is_installed('ruby-parse'), "The 'parser' gem is requred to " \
-                                           "parse ruby files but was not found " \
-                                           "on the path. Install it from gem " \
-                                           "and try again."
+        """Assert that ruby and its parser gem are installed"""
+        assert is_installed('ruby'), "Ruby is required to parse ruby files " \
+                                     "but was not found on the path."
+        proc = subprocess.run(["ruby", "-e", "require 'parser'"], capture_output=True)
+        assert not proc.returncode, "The 'parser' gem is required to parse ruby " \
+                                    "files but ruby could not load it. Install it " \
+                                    "with `gem install parser` and try again."
 
     @staticmethod
     def get_tree(filename, lang_params):
@@ -209,16 +201,35 @@ class Ruby(BaseLanguage):
         :param lang_params LanguageParams:
         :rtype: ast
         """
-        version_flag = "--" + lang_params.ruby_version
-        cmd = ["ruby-parse", "--emit-json", version_flag, filename]
-        output = subprocess.check_output(cmd, stderr=subprocess.PIPE)
-        try:
-            tree = json.loads(output)
-        except json.decoder.JSONDecodeError:
+        tree, error = parse_file(Ruby.parser_command(lang_params), filename)
+        return Ruby.tree_from_parser(filename, tree, error)
+
+    @staticmethod
+    def parser_command(lang_params):
+        """
+        :param lang_params LanguageParams:
+        :rtype: list[str]
+        """
+        script_loc = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                  "get_ast.rb")
+        return ["ruby", script_loc, lang_params.ruby_version, "--batch"]
+
+    @staticmethod
+    def tree_from_parser(filename, tree, error):
+        """
+        :param filename str:
+        :param tree list|None:
+        :param error str|None:
+        :rtype: ast
+        """
+        if error:
+            logging.debug("Ruby parser error for %r: %s", filename, error)
+            script_loc = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                      "get_ast.rb")
             raise AssertionError(
-                "Ruby-parse could not parse file %r. You may have a syntax error. "
-                "For more detail, try running the command `ruby-parse %s`. " %
-                (filename, filename)) from None
+                "Ruby could not parse file %r. You may have a syntax error. (%s) "
+                "For more detail, try running the command `ruby %s <ruby version> %s`. " %
+                (filename, error, script_loc, filename))
         assert isinstance(tree, list)
 
         if tree[0] not in ('module', 'begin'):
@@ -271,8 +282,7 @@ class Ruby(BaseLanguage):
         tree_body = get_tree_body(tree)
         subgroup_trees, subnode_trees, this_scope_body = Ruby.separate_namespaces(tree_body)
         assert not subgroup_trees
-        calls = make_calls(this_scope_body)
-        variables = make_local_variables(this_scope_body, parent)
+        calls, variables = make_calls_and_variables(this_scope_body, parent)
         node = Node(token, calls, variables,
                     parent=parent, is_constructor=is_constructor)
 
@@ -292,8 +302,7 @@ class Ruby(BaseLanguage):
         :rtype: Node
         """
         token = "(global)"
-        calls = make_calls(lines)
-        variables = make_local_variables(lines, parent)
+        calls, variables = make_calls_and_variables(lines, parent)
         root_node = Node(token, calls, variables, parent=parent)
         return root_node
 
@@ -0,0 +1,451 @@
+"""
+`pasta serve`: analyze a codebase once and answer questions about it.
+
+The analyzed model is kept in memory and queried over HTTP, either on a
+localhost port or on a Unix socket:
+
+    pasta serve project/directory --socket /tmp/pasta.sock
+    curl --unix-socket /tmp/pasta.sock 'http://localhost/callers?function=my_func'
+
+GET queries:
+    /subset?function=a,b&upstream=1&downstream=all   like --target-function
+    /callers?function=f     f and everything that calls it
+    /callees?function=f     f and everything it calls
+    /path?from=a&to=b       the shortest chain of calls from a to b
+    /orphans                functions that nothing calls
+    /stats                  counts of files, nodes and edges
+
+Graph queries answer with format=json (the default), lean-json or dot. For
+dot, hide_legend=1 and no_grouping=1 work like the CLI flags.
+
+POST /reload analyzes the sources again. Queries keep being answered from the
+previous model until the new one is ready.
+
+A model is never modified once it is built, so any number of queries can run
+at once. Logging is configured once for the whole server. Every log line that
+a query causes is tagged with that query's request id.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .cache import AnalysisCache, DEFAULT_MAX_BYTES
+from .engine import (VERSION, LanguageParams, SubsetParams, _depth, _filter_nodes_for_subset,
+                     get_sources_and_language, map_it, write_file)
+from .graph import CallGraph
+
+DEFAULT_PORT = 8765
+GRAPH_FORMATS = ('json', 'lean-json', 'dot')
+
+_request_ids = itertools.count(1)
+_request_context = threading.local()
+
+
+class _RequestIdFilter(logging.Filter):
+    """
+    Adds the id of the request being handled on this thread to log records
+    as %(request)s.
+    """
+    def filter(self, record):
+        record.request = getattr(_request_context, 'request_id', None) or '-'
+        return True
+
+
+class QueryError(Exception):
+    """
+    A query that can't be answered. Reported to the client with this status.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Snapshot():
+    """
+    One analysis of the sources along with the indexes that queries use.
+    Never modified once built.
+    """
+    def __init__(self, file_groups, all_nodes, edges, num_files):
+        """
+        :param list[Group] file_groups:
+        :param list[Node] all_nodes:
+        :param list[Edge] edges:
+        :param int num_files:
+        """
+        self.file_groups = file_groups
+        self.nodes = sorted(all_nodes)
+        self.edges = sorted(edges)
+        self.graph = CallGraph(self.nodes, self.edges)
+        self.orphans = [n for n in self.nodes if not self.graph.callers(n)]
+        self.num_files = num_files
+        self.created = time.time()
+
+    def find(self, name):
+        """
+        :param str name:
+        :rtype: Node
+        """
+        try:
+            return self.graph.find_one(name)
+        except AssertionError as ex:
+            raise QueryError(404, str(ex))
+
+    def write(self, outfile, nodes, fmt, hide_legend=False, no_grouping=False):
+        """
+        Write nodes and the edges between them like the CLI would.
+
+        :param File outfile:
+        :param iterable[Node] nodes:
+        :param str fmt: one of GRAPH_FORMATS
+        :param bool hide_legend:
+        :param bool no_grouping:
+        :rtype: None
+        """
+        nodes = sorted(nodes)
+        edges = self.graph.edges_between(set(nodes))
+        if fmt == 'dot':
+            write_file(outfile, nodes, edges, self.file_groups, hide_legend=hide_legend,
+                       no_grouping=no_grouping, only_nodes=set(nodes))
+        else:
+            write_file(outfile, nodes, edges, self.file_groups, as_json=True,
+                       lean_json=(fmt == 'lean-json'))
+
+
+def _flag(params, name):
+    return params.get(name, '') not in ('', '0', 'false')
+
+
+def _required(params, name):
+    if not params.get(name):
+        raise QueryError(400, "Missing the %r parameter." % name)
+    return params[name]
+
+
+def _param_depth(params, name):
+    try:
+        return _depth(params.get(name, '0'))
+    except ValueError:
+        raise QueryError(400, "%r must be a number or 'all'." % name)
+
+
+class QueryApp():
+    """
+    Holds the current Snapshot and turns requests into answers.
+    """
+    def __init__(self, load):
+        """
+        :param function load: returns a new Snapshot. Called now and on /reload
+        """
+        self._load = load
+        self._reload_lock = threading.Lock()
+        self.snapshot = load()
+
+    def reload(self):
+        """
+        Build a new snapshot and swap it in. Only one reload runs at a time.
+        :rtype: Snapshot
+        """
+        with self._reload_lock:
+            self.snapshot = self._load()
+        return self.snapshot
+
+    def handle(self, method, path):
+        """
+        :param str method: GET or POST
+        :param str path: the request path, including the query string
+        :returns: status, content type and body
+        :rtype: (int, str, bytes)
+        """
+        url = urllib.parse.urlsplit(path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        route = url.path.rstrip('/') or '/stats'
+
+        try:
+            if method == 'POST':
+                if route != '/reload':
+                    raise QueryError(404, "Unknown query %r." % route)
+                return self._json(self._stats(self.reload()))
+            if route == '/stats':
+                return self._json(self._stats(self.snapshot))
+            return self._graph_query(route, params)
+        except QueryError as ex:
+            return self._json({'error': str(ex)}, status=ex.status)
+
+    def _graph_query(self, route, params):
+        # Queries all use the snapshot as it was when they started
+        snapshot = self.snapshot
+        graph = snapshot.graph
+
+        if route == '/subset':
+            functions = list(filter(None, _required(params, 'function').split(',')))
+            try:
+                subset_params = SubsetParams.generate(functions,
+                                                      _param_depth(params, 'upstream'),
+                                                      _param_depth(params, 'downstream'))
+            except AssertionError as ex:
+                raise QueryError(400, str(ex))
+            for name in functions:
+                snapshot.find(name)
+            nodes = _filter_nodes_for_subset(subset_params, graph)
+        elif route == '/callers':
+            node = snapshot.find(_required(params, 'function'))
+            nodes = [node] + graph.callers(node)
+        elif route == '/callees':
+            node = snapshot.find(_required(params, 'function'))
+            nodes = [node] + graph.callees(node)
+        elif route == '/path':
+            source = snapshot.find(_required(params, 'from'))
+            target = snapshot.find(_required(params, 'to'))
+            nodes = graph.shortest_path(source, target)
+            if nodes is None:
+                raise QueryError(404, "No path from %r to %r." % (params['from'], params['to']))
+        elif route == '/orphans':
+            nodes = snapshot.orphans
+        else:
+            raise QueryError(404, "Unknown query %r." % route)
+
+        fmt = params.get('format', 'json')
+        if fmt not in GRAPH_FORMATS:
+            raise QueryError(400, "format must be one of %r." % (GRAPH_FORMATS,))
+        body = io.StringIO()
+        snapshot.write(body, set(nodes), fmt, hide_legend=_flag(params, 'hide_legend'),
+                       no_grouping=_flag(params, 'no_grouping'))
+        content_type = 'text/vnd.graphviz' if fmt == 'dot' else 'application/json'
+        return 200, content_type, body.getvalue().encode()
+
+    @staticmethod
+    def _stats(snapshot):
+        return {
+            'files': snapshot.num_files,
+            'nodes': len(snapshot.nodes),
+            'edges': len(snapshot.edges),
+            'loaded': snapshot.created,
+        }
+
+    @staticmethod
+    def _json(obj, status=200):
+        return status, 'application/json', json.dumps(obj).encode()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'pasta/' + VERSION
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+    def _respond(self, method):
+        _request_context.request_id = next(_request_ids)
+        start = time.perf_counter()
+        try:
+            try:
+                status, content_type, body = self.server.app.handle(method, self.path)
+            except Exception:
+                logging.exception("Failed to answer %s %s", method, self.path)
+                status, content_type, body = 500, 'application/json', b'{"error": "internal error"}'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            logging.info("%s %s -> %d in %.1fms", method, self.path, status,
+                         (time.perf_counter() - start) * 1000)
+        finally:
+            _request_context.request_id = None
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        # Requests are already logged by _respond
+        logging.debug(format, *args)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def make_server(app, socket_path=None, port=DEFAULT_PORT):
+    """
+    Serve app on a Unix socket or, without one, on a localhost port.
+    Call serve_forever on the result.
+
+    :param QueryApp app:
+    :param str|None socket_path:
+    :param int port: 0 picks a free port
+    :rtype: socketserver.BaseServer
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise AssertionError("%r exists and is not a socket." % socket_path)
+            os.unlink(socket_path)
+        server = _UnixServer(socket_path, _RequestHandler)
+    else:
+        server = _TCPServer(('127.0.0.1', port), _RequestHandler)
+    server.app = app
+    return server
+
+
+def make_loader(raw_source_paths, language=None, exclude_namespaces=None,
+                exclude_functions=None, include_only_namespaces=None,
+                include_only_functions=None, no_trimming=False, skip_parse_errors=False,
+                lang_params=None, jobs=1, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Return a function that analyzes the sources and returns a Snapshot.
+    Sources are listed again on every call so that new files are picked up.
+    See pasta for the parameters.
+
+    :rtype: function
+    """
+    lang_params = lang_params or LanguageParams()
+    cache = None
+    if cache_dir:
+        cache = AnalysisCache(cache_dir, VERSION, max_bytes=cache_max_bytes)
+
+    def load():
+        start = time.time()
+        sources, lang = get_sources_and_language(raw_source_paths, language)
+        file_groups, all_nodes, edges = map_it(
+            sources, lang, no_trimming, exclude_namespaces or [], exclude_functions or [],
+            include_only_namespaces or [], include_only_functions or [],
+            skip_parse_errors, lang_params, jobs, cache)
+        snapshot = Snapshot(file_groups, all_nodes, edges, len(sources))
+        logging.info("Loaded %d nodes and %d edges in %.2f seconds.",
+                     len(snapshot.nodes), len(snapshot.edges), time.time() - start)
+        return snapshot
+    return load
+
+
+def configure_logging(level):
+    """
+    Set up logging once for the whole server with request ids in every line.
+
+    :param int level:
+    :rtype: None
+    """
+    logging.basicConfig(format="pasta [%(request)s]: %(message)s", level=level)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(_RequestIdFilter())
+
+
+def main(sys_argv):
+    """
+    CLI interface for `pasta serve`.
+
+    :param list[str] sys_argv: arguments after `serve`
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        prog='pasta serve',
+        description="Analyze the sources once and answer queries about them "
+                    "over HTTP. See src/serve.py for the queries.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        'sources', metavar='sources', nargs='+',
+        help='source code file/directory paths.')
+    parser.add_argument(
+        '--socket',
+        help='listen on this Unix socket instead of a localhost port.')
+    parser.add_argument(
+        '--port', type=int, default=DEFAULT_PORT,
+        help='localhost port to listen on.')
+    parser.add_argument(
+        '--language', choices=['py', 'js', 'rb', 'php'],
+        help='process this language and ignore all other files.'
+             'If omitted, use the suffix of the first source file.')
+    parser.add_argument(
+        '--exclude-functions',
+        help='exclude functions from the model. Comma delimited.')
+    parser.add_argument(
+        '--exclude-namespaces',
+        help='exclude namespaces (Classes, modules, etc) from the model. Comma delimited.')
+    parser.add_argument(
+        '--include-only-functions',
+        help='include only functions in the model. Comma delimited.')
+    parser.add_argument(
+        '--include-only-namespaces',
+        help='include only namespaces (Classes, modules, etc) in the model. Comma delimited.')
+    parser.add_argument(
+        '--no-trimming', action='store_true',
+        help='keep all functions/namespaces whether or not they connect to anything.')
+    parser.add_argument(
+        '--skip-parse-errors', action='store_true',
+        help='skip files that the language parser fails on.')
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=1,
+        help='parse files across this many processes. 0 uses one per CPU.')
+    parser.add_argument(
+        '--cache-dir',
+        help='cache the analysis of each file in this directory. Unchanged '
+             'files are not parsed again on startup or /reload.')
+    parser.add_argument(
+        '--cache-max-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help='size limit of --cache-dir in megabytes.')
+    parser.add_argument(
+        '--source-type', choices=['script', 'module'], default='script',
+        help='js only. Parse the source as scripts (commonJS) or modules (es6)')
+    parser.add_argument(
+        '--ruby-version', default='27',
+        help='ruby only. Which ruby version to parse? This selects the grammar of the parser gem.')
+    parser.add_argument(
+        '--quiet', '-q', action='store_true',
+        help='suppress most logging')
+    parser.add_argument(
+        '--verbose', '-v', action='store_true',
+        help='add more logging')
+
+    args = parser.parse_args(sys_argv)
+    if args.verbose and args.quiet:
+        raise AssertionError("Passed both --verbose and --quiet flags")
+    if args.jobs < 0:
+        raise AssertionError("--jobs must be >= 0")
+    level = logging.INFO
+    if args.verbose:
+        level = logging.DEBUG
+    if args.quiet:
+        level = logging.WARNING
+    configure_logging(level)
+
+    load = make_loader(
+        args.sources, language=args.language,
+        exclude_namespaces=list(filter(None, (args.exclude_namespaces or "").split(','))),
+        exclude_functions=list(filter(None, (args.exclude_functions or "").split(','))),
+        include_only_namespaces=list(filter(None, (args.include_only_namespaces or "").split(','))),
+        include_only_functions=list(filter(None, (args.include_only_functions or "").split(','))),
+        no_trimming=args.no_trimming, skip_parse_errors=args.skip_parse_errors,
+        lang_params=LanguageParams(args.source_type, args.ruby_version), jobs=args.jobs,
+        cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_size * 1024 * 1024)
+    server = make_server(QueryApp(load), socket_path=args.socket, port=args.port)
+    logging.warning("Listening on %s", args.socket or 'http://127.0.0.1:%d' % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,268 @@
+"""
+Per-file analysis summaries.
+
+A summary is a compact, picklable encoding of a file group produced by
+make_file_group: its groups, nodes, calls and variables as plain tuples.
+Summaries let the expensive per-file work (parsing + building the file group)
+happen somewhere else, like a worker process, and be reassembled into the
+regular Group / Node model afterwards.
+
+References between objects inside a file (a node's parent, a variable that
+points to a class) are stored as indexes into the flat group / node lists.
+At this stage of map_it, nothing references another file so that is enough.
+"""
+
+from .model import Call, Group, IfNode, Node, TryNode, Variable
+
+# Part of the cache key. Bump it whenever the layout of the records changes.
+# Changes to what the frontends produce are caught by the code hash in cache.py.
+SUMMARY_VERSION = 5
+
+_GROUP_REF = 'g'
+_NODE_REF = 'n'
+_STR = 's'
+_CALL = 'c'
+
+
+def _encode_call(call):
+    """
+    :param call Call:
+    :rtype: tuple
+    """
+    return (call.token, call.line_number, call.owner_token, call.definite_constructor)
+
+
+def _decode_call(tup):
+    """
+    :param tup tuple:
+    :rtype: Call
+    """
+    token, line_number, owner_token, definite_constructor = tup
+    return Call(token, line_number=line_number, owner_token=owner_token,
+                definite_constructor=definite_constructor)
+
+
+def summarize_file_group(file_group):
+    """
+    Encode a file group, along with everything in it, as a summary.
+
+    :param file_group Group:
+    :rtype: tuple
+    """
+    groups = file_group.all_groups()
+    nodes = file_group.all_nodes()
+    group_index = {id(g): i for i, g in enumerate(groups)}
+    node_index = {id(n): i for i, n in enumerate(nodes)}
+
+    def ref(obj):
+        if obj is None:
+            return None
+        if id(obj) in group_index:
+            return (_GROUP_REF, group_index[id(obj)])
+        return (_NODE_REF, node_index[id(obj)])
+
+    def encode_variable(variable):
+        points_to = variable.points_to
+        if isinstance(points_to, str):
+            points_to = (_STR, points_to)
+        elif isinstance(points_to, Call):
+            points_to = (_CALL, _encode_call(points_to))
+        else:
+            points_to = ref(points_to)
+        return (variable.token, points_to, variable.line_number)
+
+    group_records = []
+    for group in groups:
+        group_records.append((
+            group.token, group.group_type, group.display_type, group.import_tokens,
+            group.line_number, ref(group.parent), group.inherits, group.uid,
+            [node_index[id(n)] for n in group.nodes],
+            node_index[id(group.root_node)] if group.root_node else None,
+            [group_index[id(g)] for g in group.subgroups],
+        ))
+
+    node_records = []
+    for node in nodes:
+        if type(node) == IfNode:
+            node_records.append((
+                'IfNode', node.token, node.nodeName, node.condition, node.ifTrueID,
+                ref(node.parent), node.ifFalseID, node.ifContID, node.uid, node.lineno,
+                node.import_tokens))
+        elif type(node) == TryNode:
+            node_records.append((
+                'TryNode', node.token, node.nodeName, node.tryBodyID, ref(node.parent),
+                node.exceptBodyIDs, node.tryContID, node.uid, node.lineno,
+                node.import_tokens))
+        else:
+            node_records.append((
+                'Node', node.token, node.nodeName,
+                [_encode_call(c) for c in node.calls],
+                [encode_variable(v) for v in node.variables],
+                ref(node.parent), node.import_tokens, node.line_number,
+                node.is_constructor, list(node.args), node.detailNode, node.branch,
+                node.uid, node.jumpID, node.jumpKind))
+
+    return (SUMMARY_VERSION, group_records, node_records)
+
+
+def _decode_variables(record, deref):
+    """
+    :param record tuple: node record
+    :param deref function: turns a reference back into a Group / Node
+    :rtype: list[Variable]
+    """
+    variables = []
+    for token, points_to, line_number in record[4]:
+        if points_to[0] == _STR:
+            points_to = points_to[1]
+        elif points_to[0] == _CALL:
+            points_to = _decode_call(points_to[1])
+        else:
+            points_to = deref(points_to)
+        variables.append(Variable(token, points_to, line_number))
+    return variables
+
+
+def _dereferencer(groups, nodes):
+    def deref(tup):
+        if tup is None:
+            return None
+        kind, i = tup
+        return groups[i] if kind == _GROUP_REF else nodes[i]
+    return deref
+
+
+def assemble_objects(summary):
+    """
+    Rebuild every group and node that a summary was made from.
+    Both lists are in summary order and the file group is always groups[0].
+
+    :param summary tuple:
+    :rtype: (list[Group], list[Node|IfNode|TryNode])
+    """
+    version, group_records, node_records = summary
+    assert version == SUMMARY_VERSION, "Unsupported summary version %r" % version
+
+    groups = []
+    nodes = []
+    deref = _dereferencer(groups, nodes)
+
+    # Groups are listed parents-first so each parent exists before its children.
+    for (token, group_type, display_type, import_tokens, line_number, parent,
+         inherits, uid, _, _, _) in group_records:
+        group = Group(token, group_type, display_type, import_tokens=import_tokens,
+                      line_number=line_number, parent=deref(parent), inherits=list(inherits))
+        group.uid = uid
+        groups.append(group)
+
+    # Nodes can be parented by nodes further down the list so parents and
+    # variables are attached in a second pass.
+    for record in node_records:
+        if record[0] == 'IfNode':
+            (_, token, node_name, condition, if_true_id, _, if_false_id, if_cont_id,
+             uid, lineno, import_tokens) = record
+            nodes.append(IfNode(token, node_name, condition, if_true_id, None,
+                                ifFalseID=if_false_id, ifContID=if_cont_id, uid=uid,
+                                lineno=lineno, import_tokens=import_tokens))
+        elif record[0] == 'TryNode':
+            (_, token, node_name, try_body_id, _, except_body_ids, try_cont_id, uid,
+             lineno, import_tokens) = record
+            nodes.append(TryNode(token, node_name, try_body_id, None,
+                                 exceptBodyIDs=except_body_ids, tryContID=try_cont_id,
+                                 uid=uid, lineno=lineno, import_tokens=import_tokens))
+        else:
+            (_, token, node_name, calls, _, _, import_tokens, line_number,
+             is_constructor, args, detail_node, branch, uid, jump_id, jump_kind) = record
+            nodes.append(Node(token, node_name, [_decode_call(c) for c in calls], [], None,
+                              import_tokens=import_tokens, line_number=line_number,
+                              is_constructor=is_constructor, args=args,
+                              detailNode=detail_node, branch=branch, uid=uid,
+                              jumpID=jump_id, jumpKind=jump_kind))
+
+    for node, record in zip(nodes, node_records):
+        if record[0] == 'IfNode':
+            node.parent = deref(record[5])
+        elif record[0] == 'TryNode':
+            node.parent = deref(record[4])
+        else:
+            node.parent = deref(record[5])
+            node.variables = _decode_variables(record, deref)
+
+    for group, record in zip(groups, group_records):
+        node_indexes, root_index, subgroup_indexes = record[8:]
+        for i in node_indexes:
+            group.add_node(nodes[i], is_root=(i == root_index))
+        for i in subgroup_indexes:
+            group.add_subgroup(groups[i])
+
+    return groups, nodes
+
+
+def assemble_file_group(summary):
+    """
+    Rebuild the file group that a summary was made from.
+
+    :param summary tuple:
+    :rtype: Group
+    """
+    return assemble_objects(summary)[0][0]
+
+
+def restore_links(summary, groups, nodes):
+    """
+    Linking (steps 4 and 5 of map_it) rewrites inherits and variables in place.
+    Put those back the way they were in the summary, keeping the same Group and
+    Node objects, so that the groups can be linked again.
+
+    :param summary tuple:
+    :param list[Group] groups: as returned by assemble_objects
+    :param list[Node|IfNode|TryNode] nodes: as returned by assemble_objects
+    """
+    _, group_records, node_records = summary
+    deref = _dereferencer(groups, nodes)
+    for group, record in zip(groups, group_records):
+        group.inherits = list(record[6])
+    for node, record in zip(nodes, node_records):
+        if record[0] == 'Node':
+            node.variables = _decode_variables(record, deref)
+
+
+def defined_tokens(summary):
+    """
+    Tokens that other files can use to refer to something in this file:
+    group tokens (inheritance and constructors) and import tokens.
+
+    :param summary tuple:
+    :rtype: set[str]
+    """
+    _, group_records, node_records = summary
+    ret = set()
+    for record in group_records:
+        ret.add(record[0])
+        ret.update(record[3])
+    for record in node_records:
+        ret.update(record[-1] if record[0] != 'Node' else record[6])
+    return ret
+
+
+def referenced_tokens(summary):
+    """
+    Tokens this file uses to refer to something that could be in another file:
+    inherited classes, imports and constructor calls assigned to variables.
+
+    :param summary tuple:
+    :rtype: set[str]
+    """
+    _, group_records, node_records = summary
+    ret = set()
+    for record in group_records:
+        ret.update(record[6])
+    for record in node_records:
+        if record[0] != 'Node':
+            continue
+        for _, points_to, _ in record[4]:
+            if points_to[0] == _STR:
+                ret.add(points_to[1])
+            elif points_to[0] == _CALL:
+                ret.add(points_to[1][0])
+    return ret
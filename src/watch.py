@@ -0,0 +1,198 @@
+"""
+File watching for --watch.
+
+On Linux, this uses inotify (through ctypes, there is nothing to install).
+Everywhere else, or when inotify can't be set up, it falls back to polling
+the files' mtimes and sizes.
+
+Watchers report changed file paths in the same form that
+get_sources_and_language produces them, i.e. os.path.join(root, filename)
+for directories that were passed in and the path as-is for files.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+POLL_INTERVAL = 1.0
+DEBOUNCE_SECONDS = 0.1
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _walk_dirs(path):
+    """
+    :param str path:
+    :rtype: list[str]
+    """
+    return [root for root, _, _ in os.walk(path)]
+
+
+class PollingWatcher():
+    """
+    Detects changes by comparing (mtime, size) snapshots of every file.
+    """
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        """
+        :param list[str] paths: files and directories
+        :param float interval: seconds between snapshots
+        """
+        self.paths = paths
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        ret = {}
+        for path in self.paths:
+            if os.path.isfile(path):
+                files = [path]
+            else:
+                files = [os.path.join(root, f) for root, _, fs in os.walk(path) for f in fs]
+            for f in files:
+                try:
+                    stat = os.stat(f)
+                except OSError:
+                    continue
+                ret[f] = (stat.st_mtime_ns, stat.st_size)
+        return ret
+
+    def wait(self, timeout=None):
+        """
+        Block until something changes or the timeout is hit.
+
+        :param float|None timeout:
+        :rtype: set[str]
+        """
+        start = time.time()
+        while True:
+            snapshot = self._take_snapshot()
+            changed = {f for f in set(snapshot) | set(self.snapshot)
+                       if snapshot.get(f) != self.snapshot.get(f)}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if timeout is not None and time.time() - start >= timeout:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher():
+    """
+    Linux-only watcher. Every directory under the watched paths gets its own
+    inotify watch, including directories created later.
+    """
+    def __init__(self, paths):
+        """
+        :param list[str] paths: files and directories
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.dirs_by_wd = {}
+        self.watched_dirs = set()
+        self.only_files = {}
+        try:
+            for path in paths:
+                if os.path.isfile(path):
+                    # Watch the directory but only report this file
+                    directory = os.path.dirname(path) or '.'
+                    self.only_files.setdefault(directory, set()).add(path)
+                    self._watch(directory)
+                else:
+                    for directory in _walk_dirs(path):
+                        self._watch(directory)
+        except BaseException:
+            # e.g. out of watches. make_watcher falls back to polling so don't leak the fd
+            os.close(self.fd)
+            raise
+
+    def _watch(self, directory):
+        if directory in self.watched_dirs:
+            return
+        wd = self._add_watch(self.fd, os.fsencode(directory), IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for %r" % directory)
+        self.dirs_by_wd[wd] = directory
+        self.watched_dirs.add(directory)
+
+    def _read_events(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+            directory = self.dirs_by_wd.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and directory not in self.only_files:
+                    for new_dir in _walk_dirs(path):
+                        self._watch(new_dir)
+                        changed.update(os.path.join(new_dir, f) for f in os.listdir(new_dir)
+                                       if os.path.isfile(os.path.join(new_dir, f)))
+                continue
+            if directory in self.only_files and path not in self.only_files[directory]:
+                continue
+            changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Block until something changes or the timeout is hit.
+        Bursts of events (e.g. an editor saving) are collected together.
+
+        :param float|None timeout:
+        :rtype: set[str]
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = self._read_events()
+        while select.select([self.fd], [], [], DEBOUNCE_SECONDS)[0]:
+            changed |= self._read_events()
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(paths):
+    """
+    Return an InotifyWatcher if possible or a PollingWatcher otherwise.
+
+    :param list[str] paths: files and directories
+    :rtype: InotifyWatcher|PollingWatcher
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError) as ex:
+            logging.info("Could not use inotify (%r). Falling back to polling.", ex)
+    return PollingWatcher(paths)
@@ -0,0 +1,22 @@
+def load(path):
+    with open(path) as f:
+        return f.read()
+
+
+def parse(text):
+    return text.split()
+
+
+def process(paths):
+    results = []
+    for path in paths:
+        try:
+            text = load(path)
+        except OSError:
+            continue
+        if text:
+            results.append(parse(text))
+    return results
+
+
+process(['a.txt'])
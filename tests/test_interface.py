@@ -1,16 +1,37 @@
+import ast
+import asyncio
+import gzip
+import inspect
 import json
 import locale
 import logging
 import os
+import pstats
 import shutil
 import sys
+import threading
+import urllib.error
+import urllib.request
 
+import pygraphviz
 import pytest
 
 sys.path.append(os.getcwd().split('/tests')[0])
 
-from src.engine import pasta, main, _generate_graphviz, SubsetParams
-from src import model
+from src.engine import (pasta, main, _generate_graphviz, _make_detail_edges, SubsetParams,
+                        _resolve_uid_collisions, _resolve_inherits,
+                        IncrementalModel, LanguageParams, generate_json,
+                        get_sources_and_language, map_it, map_it_async, pasta_async,
+                        _make_file_groups)
+from src import engine, model
+from src.cache import AnalysisCache
+from src.graph import ALL_DEPTHS, CallGraph
+from src.parser_pool import AsyncParserPool, ParserPool
+from src.profiling import qualified_name
+from src.python import Python
+from src import javascript, php, python, ruby
+from src.serve import QueryApp, make_loader, make_server
+from src.watch import PollingWatcher, make_watcher
 
 IMG_PATH = '/tmp/pasta/output.png'
 if os.path.exists("/tmp/pasta"):
@@ -103,6 +124,45 @@ def test_json():
     assert len(set(n['target'] for n in jobj['graph']['edges'])) == 3
 
 
+def test_json_streaming():
+    sources, _ = get_sources_and_language(['test_code/py/simple_b'], 'py')
+    _, all_nodes, edges = map_it(sources, 'py', False, [], [], [], [], False, LanguageParams())
+    expected = json.dumps({"graph": {
+        "directed": True,
+        "nodes": {n.uid: n.to_dict() for n in all_nodes},
+        "edges": [e.to_dict() for e in edges],
+    }})
+    assert generate_json(all_nodes, edges) == expected
+
+
+def test_lean_ndjson():
+    pasta('test_code/py/simple_b', output_file='/tmp/pasta/out.ndjson', lean_json=True)
+    with open('/tmp/pasta/out.ndjson') as f:
+        records = [json.loads(line) for line in f]
+    nodes = {r['uid']: r for r in records if r['type'] == 'node'}
+    edges = [r for r in records if r['type'] == 'edge']
+    assert len(nodes) == 4 and len(edges) == 4
+    assert not any('label' in r for r in records)
+    node = next(n for n in nodes.values() if n['name'] == 'simple_b::c.d')
+    assert node['kind'] == 'FUNCTION'
+    assert node['file'] == 'simple_b'
+    assert node['qualified_name'] == 'c.d'
+    assert isinstance(node['line'], int)
+    assert all(e['kind'] == 'CALL' and e['source'] in nodes for e in edges)
+
+
+def test_gzip():
+    pasta('test_code/py/simple_b', output_file='/tmp/pasta/out.gv')
+    pasta('test_code/py/simple_b', output_file='/tmp/pasta/out.gv.gz')
+    with open('/tmp/pasta/out.gv') as f:
+        plain = pygraphviz.AGraph(f.read())
+    with gzip.open('/tmp/pasta/out.gv.gz', 'rt') as f:
+        compressed = pygraphviz.AGraph(f.read())
+    assert sorted(n.attr['name'] for n in compressed.nodes()) == \
+        sorted(n.attr['name'] for n in plain.nodes())
+    assert len(compressed.edges()) == len(plain.edges())
+
+
 def test_weird_encoding():
     """
     To address https://github.com/scottrogowski/code2flow/issues/28
@@ -146,10 +206,25 @@ def test_bad_acorn(mocker, caplog):
 
 
 def test_bad_ruby_parse(mocker):
-    mocker.patch('subprocess.check_output', return_value=b'blah blah')
+    mocker.patch('src.ruby.Ruby.assert_dependencies')
+    mocker.patch('src.ruby.parse_file', return_value=(None, 'blah blah'))
     with pytest.raises(AssertionError) as ex:
-        pasta("test_code/rb/simple_b", "/tmp/pasta/out.json")
-        assert "ruby-parse" in ex and "syntax" in ex
+        pasta("test_code/rb/simple_b", "/tmp/pasta/out.json", jobs=1)
+    assert "get_ast.rb" in str(ex.value) and "syntax" in str(ex.value)
+    assert "blah blah" in str(ex.value)
+
+
+def test_ruby_dependencies(mocker):
+    mocker.patch('src.ruby.is_installed', return_value=False)
+    with pytest.raises(AssertionError) as ex:
+        ruby.Ruby.assert_dependencies()
+    assert "Ruby is required" in str(ex.value)
+
+    mocker.patch('src.ruby.is_installed', return_value=True)
+    mocker.patch('src.ruby.subprocess.run', return_value=mocker.Mock(returncode=1))
+    with pytest.raises(AssertionError) as ex:
+        ruby.Ruby.assert_dependencies()
+    assert "gem install parser" in str(ex.value)
 
 
 def test_bad_php_parse_a():
@@ -221,3 +296,779 @@ def test_subset_cli(mocker):
         main(['test_code/py/subset_find_exception/two.py', '--target-function', 'func', '--upstream-depth', '1'])
 
 
+
+
+def test_call_graph():
+    file_group = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    a, b, c, d, e = (model.Node(t, t + '()', [], [], file_group, line_number=i)
+                     for i, t in enumerate('abcde'))
+    for node in (a, b, c, d, e):
+        file_group.add_node(node)
+    edges = [model.Edge(a, b), model.Edge(b, c), model.Edge(d, b), model.Edge(a, c)]
+    graph = CallGraph([a, b, c, d, e], edges)
+
+    assert graph.find('b') == [b] and graph.find('my_file::b') == [b]
+    with pytest.raises(AssertionError):
+        graph.find_one('missing')
+    assert graph.callees(a) == [b, c]
+    assert graph.callers(b) == [a, d]
+    assert graph.reachable([a], downstream_depth=1) == {a, b, c}
+    assert graph.reachable([c, e], upstream_depth=1) == {a, b, c, e}
+    assert graph.reachable([c], upstream_depth=ALL_DEPTHS) == {a, b, c, d}
+    assert graph.edges_between({a, b, d}) == [edges[0], edges[2]]
+    assert graph.shortest_path(d, c) == [d, b, c]
+    assert graph.shortest_path(a, c) == [a, c]
+    assert graph.shortest_path(c, a) is None
+
+
+def test_subset_cli_all_depth():
+    def subset_nodes(*args):
+        main(['test_code/py/two_file_simple', '--output', '/tmp/pasta/subset.json',
+              '--target-function'] + list(args))
+        with open('/tmp/pasta/subset.json') as f:
+            jobj = json.loads(f.read())
+        return sorted(n['name'] for n in jobj['graph']['nodes'].values())
+
+    assert subset_nodes('b', '--upstream-depth', '1') == ['file_a::a', 'file_b::b']
+    assert subset_nodes('b', '--upstream-depth', 'all') == [
+        'file_a::(global)', 'file_a::a', 'file_b::b']
+    assert subset_nodes('a,b', '--downstream-depth', '1') == ['file_a::a', 'file_b::b']
+
+
+def test_subset_cli_control_flow():
+    # process has if / try / for nodes which share its name
+    main(['test_code/py/control_flow', '--output', '/tmp/pasta/subset.json',
+          '--target-function', 'process', '--downstream-depth', 'all'])
+    with open('/tmp/pasta/subset.json') as f:
+        names = {n['name'] for n in json.load(f)['graph']['nodes'].values()}
+    assert {'control_flow::process', 'control_flow::LOOP branch: process',
+            'control_flow::load', 'control_flow::parse'} <= names
+
+
+def test_metrics_out():
+    main(['test_code/py/two_file_simple', '--output', '/tmp/pasta/out.json',
+          '--metrics-out', '/tmp/pasta/metrics.json'])
+    with open('/tmp/pasta/metrics.json') as f:
+        metrics = json.load(f)
+    assert list(metrics['stages']) == ['parse', 'trim', 'consolidate', 'resolve_variables',
+                                       'link', 'log_bad_calls', 'write_output']
+    assert all(stage['wall_seconds'] >= 0 and stage['cpu_seconds'] >= 0
+               for stage in metrics['stages'].values())
+    assert metrics['counts'] == {'files': 2, 'groups': 2, 'nodes': 5, 'calls': 3,
+                                 'variables': 4, 'resolved_calls': 2, 'ambiguous_calls': 0}
+    assert metrics['edges_by_kind'] == {'CALL': 2}
+    assert metrics['peak_rss_bytes'] > 0
+
+    main(['test_code/py/two_file_simple', '--output', '/tmp/pasta/out.json',
+          '--metrics-out', '/tmp/pasta/metrics.prom'])
+    with open('/tmp/pasta/metrics.prom') as f:
+        prom = f.read()
+    assert '# TYPE pasta_stage_wall_seconds gauge' in prom
+    assert 'pasta_stage_cpu_seconds{stage="link"} ' in prom
+    assert 'pasta_edges{kind="CALL"} 2\n' in prom
+    assert 'pasta_nodes 5\n' in prom
+    assert not os.path.exists('/tmp/pasta/metrics.prom.tmp')
+
+
+def test_profile():
+    python_file = inspect.getsourcefile(Python)
+    lineno = inspect.getsourcelines(Python.make_nodes)[1] + 1
+    assert qualified_name(python_file, lineno) == 'Python.make_nodes'
+    assert qualified_name(python_file, 1) is None
+    assert qualified_name(__file__, 1) is None
+
+    main(['test_code/py/inherits', '--output', '/tmp/pasta/out.json',
+          '--profile', 'cpu', '--profile-out', '/tmp/pasta/out.pstats'])
+    functions = {function for _, _, function in pstats.Stats('/tmp/pasta/out.pstats').stats}
+    assert {'map_it', 'make_nodes'} <= functions
+
+    main(['test_code/py/inherits', '--output', '/tmp/pasta/out.json',
+          '--profile', 'mem', '--profile-out', '/tmp/pasta/memory.txt', '--profile-top', '100'])
+    with open('/tmp/pasta/memory.txt') as f:
+        report = f.read()
+    assert report.startswith('Peak traced memory:')
+    assert 'Python.make_nodes (src/python.py)' in report
+    assert 'profiling.py' not in report
+
+
+def test_detail_edges_dangling_uid(caplog):
+    caplog.set_level(logging.DEBUG)
+    module = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    head = model.Node('func', 'func()', [], [], module, line_number=1, detailNode='node_if')
+    if_node = model.IfNode('func', 'IF', 'a == 1', 'node_true', module,
+                           ifFalseID='node_missing', uid='node_if', lineno=2)
+    true_node = model.Node('func', 'func()', [], [], module, line_number=3,
+                           branch='IF TRUE', uid='node_true')
+    for node in (head, if_node, true_node):
+        module.add_node(node)
+
+    edges = _make_detail_edges(module.all_nodes())
+    assert [(e.node0, e.node1) for e in edges] == [(head, if_node), (if_node, true_node)]
+    assert "node_missing" in caplog.text and "ifFalseID" in caplog.text
+
+
+def test_stable_uids():
+    outputs = []
+    for _ in range(2):
+        pasta('test_code/py/inherits', output_file='/tmp/pasta/out.gv')
+        with open('/tmp/pasta/out.gv') as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
+    assert 'cluster_' in outputs[0]
+
+
+def test_uid_collisions(caplog):
+    file_groups = []
+    for token in ('file_a', 'file_b'):
+        file_group = model.Group(token, model.GROUP_TYPE.FILE, 'File', [], 0)
+        head = model.Node('func', 'func()', [], [], file_group, line_number=1,
+                          detailNode='node_if', uid='node_head')
+        if_node = model.IfNode('func', 'IF', 'a', None, file_group, uid='node_if', lineno=2)
+        file_group.add_node(head)
+        file_group.add_node(if_node)
+        file_groups.append(file_group)
+
+    _resolve_uid_collisions(file_groups)
+    uids = [n.uid for g in file_groups for n in g.all_nodes()]
+    assert len(set(uids)) == 4
+    head_b, if_b = file_groups[1].nodes
+    assert head_b.detailNode == if_b.uid != 'node_if'
+    assert "collided" in caplog.text
+
+
+def test_cached_names():
+    file_group = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    klass = model.Group('Klass', model.GROUP_TYPE.CLASS, 'Class', [], 1, parent=file_group)
+    file_group.add_subgroup(klass)
+    node_b = model.Node('b', 'b()', [], [], klass, line_number=2)
+    node_a = model.Node('a', 'a()', [], [], file_group, line_number=3)
+    klass.add_node(node_b)
+    file_group.add_node(node_a)
+
+    assert node_b.name() == 'my_file::Klass.b'
+    node_b.remove_from_parent()
+    assert node_b.name() == 'my_file::Klass.b'
+    assert node_b.token_with_ownership() == 'Klass.b'
+    assert sorted([node_b, node_a]) == [node_b, node_a]
+
+
+def test_label_cache():
+    file_group = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    node = model.Node('<<', '<<()', [], [], file_group, line_number=2, args=['a&b'])
+    other = model.Node('other', 'other()', [], [], file_group, line_number=5)
+    file_group.add_node(node)
+    file_group.add_node(other)
+
+    label = node.label()
+    assert '&lt;&lt;()' in label and 'a&amp;b' in label
+    assert node.label() is label
+    assert node.to_dict()['label'] is label
+
+    assert 'trunk.png' in other.label()
+    model.Edge(node, other)
+    assert 'green.png' in other.label() and 'trunk.png' not in other.label()
+    node.variables += [model.Variable('v', 'w')]
+    assert 'Variables:' in node.label()
+    node.variables = []
+    assert 'Variables:' not in node.label()
+
+
+def test_all_nodes_cache():
+    file_group = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    klass = model.Group('Klass', model.GROUP_TYPE.CLASS, 'Class', [], 1, parent=file_group)
+    inner = model.Group('Inner', model.GROUP_TYPE.CLASS, 'Class', [], 2, parent=klass)
+    file_group.add_subgroup(klass)
+    klass.add_subgroup(inner)
+    node_a = model.Node('a', 'a()', [], [], file_group, line_number=5)
+    node_b = model.Node('b', 'b()', [], [], klass, line_number=2)
+    file_group.add_node(node_a)
+    klass.add_node(node_b)
+
+    assert file_group.all_groups() == [file_group, klass, inner]
+    assert file_group.all_nodes() == [node_a, node_b]
+    assert file_group.all_nodes() is file_group.all_nodes()
+    assert list(file_group.iter_nodes()) == file_group.all_nodes()
+
+    node_c = model.Node('c', 'c()', [], [], inner, line_number=3)
+    inner.add_node(node_c)
+    assert file_group.all_nodes() == [node_a, node_b, node_c]
+    node_b.remove_from_parent()
+    assert file_group.all_nodes() == [node_a, node_c]
+    inner.remove_from_parent()
+    assert file_group.all_groups() == [file_group, klass]
+    assert file_group.all_nodes() == [node_a]
+
+    other_file = model.Group('other_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    other_klass = model.Group('Klass', model.GROUP_TYPE.CLASS, 'Class', [], 1,
+                              parent=other_file)
+    other_file.add_subgroup(other_klass)
+    group_index = model.make_group_index([file_group, other_file])
+    assert group_index['Klass'] is other_klass
+
+
+def test_get_variables_by_line():
+    file_group = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    root = model.Node('(global)', '(global)', [], [model.Variable('g', 'x', 1)], file_group,
+                      line_number=0)
+    file_group.add_node(root, is_root=True)
+    a, b, c, d = (model.Variable(t, 'x', line) for t, line in
+                  (('a', 5), ('b', 1), ('c', 3), ('d', 3)))
+    node = model.Node('func', 'func()', [], [a, b, c, d], file_group, line_number=1)
+    file_group.add_node(node)
+
+    def tokens(variables):
+        return [v.token for v in variables]
+
+    assert tokens(node.get_variables()) == ['a', 'c', 'd', 'b', 'g', 'func']
+    assert tokens(node.get_variables(3)) == ['c', 'd', 'b', 'g', 'func']
+    assert tokens(node.get_variables(2)) == ['b', 'g', 'func']
+    assert tokens(node.get_variables(0)) == ['g', 'func']
+
+    node.variables += [model.Variable('e', 'x', 2)]
+    assert tokens(node.get_variables(3)) == ['c', 'd', 'e', 'b', 'g', 'func']
+    file_group.add_node(model.Node('other', 'other()', [], [], file_group, line_number=4))
+    assert tokens(file_group.get_variables()) == ['other', 'g', 'func']
+    node.variables = [a]
+    assert tokens(node.get_variables(5)) == ['a', 'other', 'g', 'func']
+
+
+def test_compact_model():
+    file_group = model.Group('my_file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    base = model.Group('Base', model.GROUP_TYPE.CLASS, 'Class', [], 1, parent=file_group)
+    base.add_node(model.Node('base_method', 'base_method()', [], [], base, line_number=2))
+    children = []
+    for i in range(2):
+        child = model.Group('Child%d' % i, model.GROUP_TYPE.CLASS, 'Class', [], 3,
+                            parent=file_group, inherits=['Base'])
+        child.add_node(model.Node('method', 'method()', [model.Call('base_method')], [],
+                                  child, line_number=4))
+        children.append(child)
+
+    _resolve_inherits(children, {'Base': base.nodes})
+    var_0 = children[0].nodes[0].variables[0]
+    var_1 = children[1].nodes[0].variables[0]
+    assert var_0 is var_1
+    assert var_0.points_to is base.nodes[0]
+
+    node = children[0].nodes[0]
+    assert node.args == () and node.import_tokens == ()
+    edge = model.Edge(node, base.nodes[0])
+    for obj in (node, node.calls[0], var_0, edge):
+        assert not hasattr(obj, '__dict__')
+
+
+def test_import_index_first_match():
+    file_a = model.Group('file_a', model.GROUP_TYPE.FILE, 'File', ['file_a'], 0)
+    klass = model.Group('Klass', model.GROUP_TYPE.CLASS, 'Class', ['shared'], 1, parent=file_a)
+    file_a.add_subgroup(klass)
+    file_b = model.Group('file_b', model.GROUP_TYPE.FILE, 'File', [], 0)
+    node_b = model.Node('func', 'func()', [], [], file_b, import_tokens=['shared', 'file_a'])
+    file_b.add_node(node_b)
+    caller = model.Node('caller', 'caller()', [], [
+        model.Variable('a', 'shared'),
+        model.Variable('b', 'file_a'),
+        model.Variable('c', 'missing'),
+    ], file_b)
+
+    caller.resolve_variables([file_a, file_b], model.make_import_index([file_a, file_b]))
+    assert [v.points_to for v in caller.variables] == [klass, file_a,
+                                                       model.OWNER_CONST.UNKNOWN_MODULE]
+
+
+def test_jobs():
+    outputs = []
+    for jobs in (1, 2):
+        pasta('test_code/py/two_file_simple',
+              output_file='/tmp/pasta/out.json',
+              jobs=jobs)
+        with open('/tmp/pasta/out.json') as f:
+            jobj = json.loads(f.read())
+        nodes = jobj['graph']['nodes']
+        edges = sorted((nodes[e['source']]['name'], nodes[e['target']]['name'])
+                       for e in jobj['graph']['edges'])
+        outputs.append((sorted(n['name'] for n in nodes.values()), edges))
+    assert outputs[0] == outputs[1]
+    assert outputs[0][1]
+
+    with pytest.raises(AssertionError):
+        main(['test_code/py/two_file_simple', '--jobs', '-1'])
+
+
+def test_cache(mocker):
+    cache_dir = '/tmp/pasta/cache'
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def run():
+        pasta('test_code/py/two_file_simple',
+              output_file='/tmp/pasta/out.json',
+              cache_dir=cache_dir)
+        with open('/tmp/pasta/out.json') as f:
+            jobj = json.loads(f.read())
+        nodes = jobj['graph']['nodes']
+        return (sorted(n['name'] for n in nodes.values()),
+                sorted((nodes[e['source']]['name'], nodes[e['target']]['name'])
+                       for e in jobj['graph']['edges']))
+
+    first = run()
+    get_tree = mocker.patch('src.python.Python.get_tree', side_effect=AssertionError)
+    assert run() == first
+    assert not get_tree.called
+
+    # Changing the analysis code invalidates the entries
+    mocker.stopall()
+    mocker.patch('src.cache.analysis_code_hash', return_value='edited')
+    get_tree = mocker.spy(Python, 'get_tree')
+    assert run() == first
+    assert get_tree.called
+    mocker.stopall()
+
+    cache = AnalysisCache(cache_dir, 'test', max_bytes=0)
+    assert cache.evict() == 4
+    assert cache.evict() == 0
+
+
+def test_incremental_model():
+    directory = '/tmp/pasta/incremental'
+    shutil.rmtree(directory, ignore_errors=True)
+    shutil.copytree('test_code/py/two_file_simple', directory)
+    sources, _ = get_sources_and_language([directory], 'py')
+    file_b = os.path.join(directory, 'file_b.py')
+
+    def names(result):
+        _, all_nodes, edges = result
+        return (sorted(n.name() for n in all_nodes),
+                sorted((e.node0.name(), e.node1.name()) for e in edges))
+
+    def fresh():
+        return names(map_it(sources, 'py', False, [], [], [], [], False, LanguageParams()))
+
+    model = IncrementalModel('py', [], [], [], [], False, LanguageParams())
+    first = names(model.update(sources))
+    assert first == fresh()
+    assert model.update(sources) is None
+
+    # The a() -> b() edge comes from file_a which did not change
+    with open(file_b) as f:
+        code = f.read()
+    with open(file_b, 'w') as f:
+        f.write(code.replace('def b()', 'def b2()'))
+    second = names(model.update(sources, {file_b}))
+    assert second == fresh()
+    assert second != first
+
+    with open(file_b, 'w') as f:
+        f.write(code)
+    assert names(model.update(sources, {file_b})) == first
+
+
+def test_polling_watcher():
+    directory = '/tmp/pasta/watched'
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    path = os.path.join(directory, 'a.py')
+    with open(path, 'w') as f:
+        f.write('')
+
+    watcher = PollingWatcher([directory], interval=0.01)
+    assert watcher.wait(timeout=0) == set()
+    with open(path, 'w') as f:
+        f.write('def a():\n    pass\n')
+    assert watcher.wait(timeout=5) == {path}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotify is linux-only")
+def test_inotify_watcher_failure(mocker):
+    directory = '/tmp/pasta/watched'
+    os.makedirs(directory, exist_ok=True)
+    mocker.patch('src.watch.InotifyWatcher._watch', side_effect=OSError(28, "No space left"))
+    make_watcher([directory])
+    open_fds = len(os.listdir('/proc/self/fd'))
+    watcher = make_watcher([directory])
+    assert isinstance(watcher, PollingWatcher)
+    assert len(os.listdir('/proc/self/fd')) == open_fds
+
+
+def test_parser_pool():
+    # A --batch parser that "parses" a file into its length
+    worker = '/tmp/pasta/worker.py'
+    os.makedirs('/tmp/pasta', exist_ok=True)
+    with open(worker, 'w') as f:
+        f.write(
+            "import json, sys, time\n"
+            "for line in sys.stdin:\n"
+            "    src = open(json.loads(line)).read()\n"
+            "    if src == 'crash':\n"
+            "        sys.exit('no memory left')\n"
+            "    if src == 'hang':\n"
+            "        time.sleep(60)\n"
+            "    response = {'error': 'bad'} if src == 'bad' else {'tree': len(src)}\n"
+            "    print(json.dumps(response), flush=True)\n")
+    for name, src in (('good', 'good code'), ('bad', 'bad'), ('crash', 'crash'),
+                      ('hang', 'hang')):
+        with open('/tmp/pasta/' + name, 'w') as f:
+            f.write(src)
+
+    pool = ParserPool([sys.executable, worker], timeout=2)
+    assert pool.parse('/tmp/pasta/good') == (9, None)
+    assert pool.parse('/tmp/pasta/bad') == (None, 'bad')
+    tree, error = pool.parse('/tmp/pasta/crash')
+    # The error has the exit code and what the worker wrote to stderr
+    assert tree is None and 'code 1' in error and 'no memory left' in error
+    # A fresh worker picks up after the crash
+    assert pool.parse('/tmp/pasta/good') == (9, None)
+    tree, error = pool.parse('/tmp/pasta/hang')
+    assert tree is None and 'timed out' in error
+    assert pool.parse('/tmp/pasta/good') == (9, None)
+    assert len(pool.workers) == 1
+    pool.close()
+
+    async def parse_all():
+        pool = AsyncParserPool([sys.executable, worker], timeout=2)
+        try:
+            return [await pool.parse('/tmp/pasta/' + name)
+                    for name in ('crash', 'hang', 'good')]
+        finally:
+            await pool.close()
+
+    crashed, hung, good = asyncio.run(parse_all())
+    assert crashed[0] is None and 'no memory left' in crashed[1]
+    assert hung[0] is None and 'timed out' in hung[1]
+    assert good == (9, None)
+
+
+def test_serve():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return make_loader(['test_code/py/two_file_simple'])()
+
+    server = make_server(QueryApp(load), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    def query(path, data=None):
+        try:
+            with urllib.request.urlopen(base + path, data=data) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as ex:
+            return ex.code, ex.read().decode()
+
+    def names(path):
+        status, body = query(path)
+        assert status == 200, body
+        return sorted(n['name'] for n in json.loads(body)['graph']['nodes'].values())
+
+    try:
+        assert json.loads(query('/stats')[1])['files'] == 2
+        assert names('/callers?function=b') == ['file_a::a', 'file_b::b']
+        assert names('/subset?function=b&upstream=all') == [
+            'file_a::(global)', 'file_a::a', 'file_b::b']
+        assert names('/path?from=file_a::(global)&to=b') == [
+            'file_a::(global)', 'file_a::a', 'file_b::b']
+        assert names('/orphans') == ['file_a::(global)', 'file_b::(global)', 'file_b::c']
+        status, body = query('/callees?function=a&format=dot')
+        assert status == 200 and body.startswith('digraph') and 'file_b' in body
+
+        assert query('/callers?function=missing')[0] == 404
+        assert query('/subset?function=b&upstream=x')[0] == 400
+        assert query('/nowhere')[0] == 404
+
+        assert query('/reload', data=b'')[0] == 200
+        assert len(loads) == 2
+        assert names('/callers?function=b') == ['file_a::a', 'file_b::b']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_control_flow():
+    # process has if / try / for nodes which share its name
+    server = make_server(QueryApp(make_loader(['test_code/py/control_flow'])), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    def names(path):
+        with urllib.request.urlopen(base + path) as response:
+            return sorted(n['name'] for n in json.loads(response.read())['graph']['nodes'].values())
+
+    try:
+        assert names('/callers?function=load') == [
+            'control_flow::TRY branch: process', 'control_flow::load']
+        assert 'control_flow::parse' in names('/subset?function=process&downstream=all')
+        path = names('/path?from=control_flow::process&to=parse')
+        assert {'control_flow::LOOP branch: process', 'control_flow::parse'} <= set(path)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _PythonParsedElsewhere(Python):
+    """
+    Python parsed by a --batch worker, like js / php / rb are
+    """
+    @staticmethod
+    def parser_command(lang_params):
+        return [sys.executable, '/tmp/pasta/py_worker.py']
+
+    @staticmethod
+    def tree_from_parser(filename, tree, error):
+        if error:
+            raise AssertionError(error)
+        return ast.parse(tree)
+
+
+def _write_py_worker():
+    os.makedirs('/tmp/pasta', exist_ok=True)
+    with open('/tmp/pasta/py_worker.py', 'w') as f:
+        f.write(
+            "import json, sys\n"
+            "for line in sys.stdin:\n"
+            "    src = open(json.loads(line)).read()\n"
+            "    try:\n"
+            "        compile(src, 'x', 'exec')\n"
+            "        response = {'tree': src}\n"
+            "    except SyntaxError as ex:\n"
+            "        response = {'error': str(ex)}\n"
+            "    print(json.dumps(response), flush=True)\n")
+
+
+def test_async_parser_pool():
+    _write_py_worker()
+    for name, src in (('good.py', 'a = 1\n'), ('bad.py', 'def (\n')):
+        with open('/tmp/pasta/' + name, 'w') as f:
+            f.write(src)
+
+    async def parse_all():
+        pool = AsyncParserPool(_PythonParsedElsewhere.parser_command(None), size=2)
+        try:
+            results = await asyncio.gather(*(pool.parse('/tmp/pasta/' + name)
+                                             for name in ('good.py', 'bad.py', 'good.py')))
+        finally:
+            await pool.close()
+        return results, len(pool.workers)
+
+    results, num_workers = asyncio.run(parse_all())
+    assert results[0] == results[2] == ('a = 1\n', None)
+    assert results[1][0] is None and results[1][1]
+    assert num_workers == 2
+
+
+def test_map_it_async(mocker):
+    _write_py_worker()
+
+    def names(model):
+        _, all_nodes, edges = model
+        return (sorted(n.name() for n in all_nodes),
+                sorted((e.node0.name(), e.node1.name()) for e in edges))
+
+    sources, _ = get_sources_and_language(['test_code/py/inherits'], 'py')
+    args = (sources, 'py', False, [], [], [], [], False, LanguageParams())
+    expected = names(map_it(*args))
+
+    mocker.patch.dict('src.engine.LANGUAGES', {'py': _PythonParsedElsewhere})
+    build_threads = set()
+    make_file_group = engine.make_file_group
+
+    def record_thread(*args):
+        build_threads.add(threading.get_ident())
+        return make_file_group(*args)
+
+    mocker.patch('src.engine.make_file_group', side_effect=record_thread)
+    assert names(asyncio.run(map_it_async(*args, jobs=2))) == expected
+    # File groups are built off the event loop's thread
+    assert build_threads and threading.get_ident() not in build_threads
+    # Synchronous callers get the same concurrent parsing
+    assert names(map_it(*args, jobs=2)) == expected
+
+    os.makedirs('/tmp/pasta/async_errors', exist_ok=True)
+    for name, src in (('a.py', 'def a():\n    b()\n'), ('b.py', 'def (\n'),
+                      ('c.py', 'def b():\n    pass\n')):
+        with open('/tmp/pasta/async_errors/' + name, 'w') as f:
+            f.write(src)
+    sources = ['/tmp/pasta/async_errors/' + n for n in ('a.py', 'b.py', 'c.py')]
+    file_groups = _make_file_groups(sources, 'py', True, LanguageParams(), 2, None)
+    assert [g.token for g in file_groups] == ['a', 'c']
+    with pytest.raises(AssertionError):
+        _make_file_groups(sources, 'py', False, LanguageParams(), 2, None)
+
+
+def test_pasta_async(mocker):
+    subset_params = SubsetParams.generate('b', 1, 0)
+    pasta('test_code/py/two_file_simple', output_file='/tmp/pasta/sync.json')
+    pasta('test_code/py/two_file_simple', output_file='/tmp/pasta/sync_subset.json',
+          subset_params=subset_params)
+
+    # Built on map_it_async rather than running pasta in a thread
+    mocker.patch('src.engine.pasta', side_effect=AssertionError)
+    mocker.patch('src.engine.map_it', side_effect=AssertionError)
+    asyncio.run(pasta_async('test_code/py/two_file_simple', '/tmp/pasta/async.json', jobs=2))
+    asyncio.run(pasta_async('test_code/py/two_file_simple', '/tmp/pasta/async_subset.json',
+                            subset_params=subset_params))
+    for name in ('', '_subset'):
+        with open('/tmp/pasta/sync%s.json' % name) as f, \
+             open('/tmp/pasta/async%s.json' % name) as g:
+            assert f.read() == g.read()
+
+
+def test_deeply_nested_walk():
+    # f(f(f(...))) nested far past the recursion limit, as minified code can be
+    depth = sys.getrecursionlimit() * 5
+    loc = {'start': {'line': 1}}
+    js_tree = {'type': 'Literal', 'loc': loc}
+    for _ in range(depth):
+        js_tree = {'type': 'CallExpression', 'loc': loc, 'arguments': [js_tree],
+                   'callee': {'type': 'Identifier', 'name': 'f', 'loc': loc}}
+    calls, variables = javascript.make_calls_and_variables([js_tree], None)
+    assert len(calls) == depth and variables == []
+
+    php_tree = {'nodeType': 'Scalar_LNumber', 'attributes': {'startLine': 1}}
+    for _ in range(depth):
+        php_tree = {'nodeType': 'Expr_FuncCall', 'attributes': {'startLine': 1},
+                    'name': {'nodeType': 'Name', 'parts': ['f']},
+                    'args': [{'nodeType': 'Arg', 'value': php_tree}]}
+    calls, _ = php.make_calls_and_variables([php_tree], None)
+    assert len(calls) == depth
+
+    ruby_tree = ['int', 1]
+    for _ in range(depth):
+        ruby_tree = ['send', None, 'f', ruby_tree]
+    lines = [['lvasgn', 'x', ruby_tree], ['lvasgn', 'y', ['int', 2]]]
+    calls, variables = ruby.make_calls_and_variables(lines, None)
+    assert len(calls) == depth
+    assert [(v.token, v.points_to.token) for v in variables] == [('x', 'f')]
+
+
+def test_python_calls_at_any_depth():
+    tree = ast.parse("def outer(items):\n"
+                     "    total = parse(read(items))\n"
+                     "    for item in items:\n"
+                     "        log.write(item)\n"
+                     "        found = lookup(item)\n"
+                     "    results = [convert(i) for i in items]\n"
+                     "\n"
+                     "    @decorate()\n"
+                     "    def inner():\n"
+                     "        hidden()\n"
+                     "    return inner\n")
+    file_group = model.Group('file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    nodes = [n for n in Python.make_nodes(tree.body[0], file_group) if type(n) == model.Node]
+    assert [c.token for n in nodes for c in n.calls] == ['parse', 'read', 'write', 'lookup',
+                                                         'convert', 'decorate']
+    assert [v.token for n in nodes for v in n.variables] == ['total', 'write', 'found']
+
+
+def test_python_control_flow_blocks():
+    tree = ast.parse("def f(items):\n"
+                     "    with lock():\n"
+                     "        setup()\n"
+                     "    for item in load(items):\n"
+                     "        if item:\n"
+                     "            continue\n"
+                     "        handle(item)\n"
+                     "        break\n"
+                     "        unreachable()\n"
+                     "    else:\n"
+                     "        empty()\n"
+                     "    while running():\n"
+                     "        step()\n"
+                     "    match read():\n"
+                     "        case 'go':\n"
+                     "            go()\n"
+                     "        case _ if ok():\n"
+                     "            stop()\n"
+                     "    return done()\n"
+                     "    never()\n")
+    file_group = model.Group('file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    records = python.build_blocks(tree.body[0].body, file_group)
+    summary = [(r[0], r[2]) for r in records]
+    assert summary == [('BLOCK', None), ('BLOCK', 'LOOP'), ('BLOCK', 'IF TRUE'),
+                       ('BRANCH', 'IF'), ('BLOCK', 'CONTINUE'), ('BLOCK', 'LOOP ELSE'),
+                       ('BRANCH', 'FOR'), ('BLOCK', 'CONTINUE'), ('BLOCK', 'LOOP'),
+                       ('BRANCH', 'WHILE'), ('BLOCK', 'CONTINUE'), ('BLOCK', 'CASE'),
+                       ('BRANCH', 'CASE'), ('BLOCK', 'CASE'), ('BRANCH', 'CASE'),
+                       ('BLOCK', 'CONTINUE')]
+    by_uid = {r[1]: r for r in records}
+    head, first_case, last_case = records[0], records[12], records[14]
+    assert by_uid[head[7]][2] == 'FOR'
+    # Every block carries the calls of its statements and of the headers after it
+    assert [c.token for c in head[5]] == ['lock', 'setup', 'load']
+    assert first_case[6] == last_case[1] and first_case[7] == records[15][1]
+    assert last_case[6] is None and last_case[7] is None
+    # continue goes to the loop, break past it and the end of a loop body back to it
+    for_uid, while_uid = records[6][1], records[9][1]
+    assert records[2][8] == ('CONTINUE', for_uid)
+    assert records[4][8] == ('BREAK', records[7][1])
+    assert records[8][8] == ('LOOP_BACK', while_uid)
+    # done() ends the function anyway so there is no return edge
+    assert records[15][8] is None
+
+    nodes = Python.make_nodes(tree.body[0], file_group)
+    calls = [c.token for n in nodes if type(n) == model.Node for c in n.calls]
+    # Calls after a return or a break never happen but are kept
+    assert calls == ['lock', 'setup', 'load', 'handle', 'unreachable', 'empty', 'running',
+                     'step', 'read', 'ok', 'go', 'stop', 'done', 'never']
+    assert {n.nodeName for n in nodes if type(n) == model.IfNode} == {'IF', 'FOR', 'WHILE', 'CASE'}
+
+
+def test_python_return_edges():
+    tree = ast.parse("def f(a):\n"
+                     "    for x in a:\n"
+                     "        if x:\n"
+                     "            return x\n"
+                     "    cleanup()\n"
+                     "    return None\n")
+    file_group = model.Group('file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    nodes = Python.make_nodes(tree.body[0], file_group)
+    exit_node = nodes[-1]
+    assert exit_node.branch == 'EXIT' and exit_node.line_number == 6
+    returns = [n for n in nodes if type(n) == model.Node and n.jumpID]
+    assert [(n.branch, n.jumpKind, n.jumpID) for n in returns] == \
+        [('IF TRUE', model.EDGE_KIND.RETURN, exit_node.uid)]
+    # The if ends the loop body so it continues to the loop
+    if_node = next(n for n in nodes if type(n) == model.IfNode and n.nodeName == 'IF')
+    for_node = next(n for n in nodes if type(n) == model.IfNode and n.nodeName == 'FOR')
+    assert if_node.ifContID == for_node.uid
+
+    edges = _make_detail_edges(nodes)
+    assert [(e.node0, e.node1) for e in edges if e.kind == model.EDGE_KIND.RETURN] == \
+        [(returns[0], exit_node)]
+
+
+def test_python_many_branches():
+    source = "def f(a):\n" + "".join("    if a == %d:\n        g%d()\n" % (i, i)
+                                     for i in range(2000))
+    file_group = model.Group('file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    nodes = Python.make_nodes(ast.parse(source).body[0], file_group)
+    assert len(nodes) == 1 + 2000 * 2
+    assert nodes[-1].ifContID is None
+
+
+def test_quoted_condition_dot():
+    os.makedirs('/tmp/pasta/quoted', exist_ok=True)
+    with open('/tmp/pasta/quoted/quoted.py', 'w') as f:
+        f.write('def f(word):\n'
+                '    match word:\n'
+                '        case "it\'s":\n'
+                '            g()\n\n\n'
+                'def g():\n'
+                '    pass\n')
+    pasta('/tmp/pasta/quoted', output_file='/tmp/pasta/quoted.gv')
+    with open('/tmp/pasta/quoted.gv') as f:
+        graph = pygraphviz.AGraph(f.read())
+    labels = [n.attr['label'] for n in graph.nodes() if n.attr['shape'] == 'diamond']
+    assert labels == ['CASE &#92;n "it\'s" &#92;n Ln: 3']
+
+
+def test_python_method_blocks():
+    tree = ast.parse("class A():\n"
+                     "    def m(self, a):\n"
+                     "        if a:\n"
+                     "            b()\n"
+                     "        return a\n")
+    file_group = model.Group('file', model.GROUP_TYPE.FILE, 'File', [], 0)
+    class_group = Python.make_class_group(tree.body[0], file_group)
+    assert [type(n).__name__ for n in class_group.nodes] == ['Node', 'Node', 'IfNode', 'Node']
+    uids = {n.uid for n in class_group.nodes}
+    assert all(n.detailNode in uids for n in class_group.nodes
+               if type(n) == model.Node and n.detailNode)